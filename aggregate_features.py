@@ -1,9 +1,3 @@
-# Blob wrangling
-from azure.storage.blob import BlobServiceClient
-
-# Dotenv loading 
-from dotenv import load_dotenv
-
 # OS traversal 
 import os 
 
@@ -17,26 +11,252 @@ import fastavro
 import argparse
 
 # Typehinting 
-from typing import Union
+from typing import Union, Tuple, Callable, Dict, Iterator
+
+# Multi-process backfills 
+from concurrent.futures import ProcessPoolExecutor
+
+# Body parsing 
+import json
+import ast
 
 # Input/output stream
 import io
 
+# Timing 
+import time
+
 # Iteration tracking 
 from tqdm import tqdm
 
 # Importing blob functionalities
-from blobs import get_blob_names, get_delta_blobs
+from blobs import get_blob_names, list_delta_blobs, download_blobs, map_blobs, BlobStream, get_partition_day
+
+# Shared clients
+from resources import get_config, get_container_client
+
+# Importing the manifest of the processed blobs
+from manifest import DEFAULT_MANIFEST_PATH, load_manifest, save_manifest, get_blob_entry, get_unprocessed_blobs, update_manifest
+
+# Azure errors 
+from azure.core.exceptions import ResourceNotFoundError
 
 # Dataframes
 import pandas as pd 
 
-# Tempdir 
-import tempfile
+# Columnar body parsing 
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.compute as pc
 
 # Importing logging 
 import logging
 
+# Importing the streaming aggregation
+from aggregation import MINUTE_KEYS, SOURCE_KEYS, VARIABLES, PARTIAL_COLUMNS, aggregate_partials, merge_partials, add_means
+
+# Importing the parquet serialization
+from feature_store import RUN_STAMP_FORMAT, write_features_parquet, split_feature_files
+
+# Run metrics
+from metrics import timed, count
+
+# Local cache of the decoded capture blobs
+from blob_cache import PartialsCache, get_partials_cache
+
+# Defining the timestamp format in the body 
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Defining the root folder of the event hub capture blobs
+CAPTURE_ROOT = "flexitricity/"
+
+# Defining the number of records whose bodies are parsed at once by the arrow decoder
+DECODE_BATCH_RECORDS = 10000
+
+# Defining the avro decoders; "arrow" parses the bodies column by column, "records" one by one
+DECODERS = ["arrow", "records"]
+
+# Defining how the arrow json reader parses the bodies; The other fields of the bodies are ignored
+BODY_PARSE_OPTIONS = pa_json.ParseOptions(
+    explicit_schema=pa.schema([("timestamp", pa.string())] + [(key, pa.float64()) for key in VARIABLES]),
+    unexpected_field_behavior="ignore"
+)
+
+# Defining the default folder of the partition day checkpoints of the backfills
+DEFAULT_CHECKPOINT_PATH = "checkpoints/aggregate_features"
+
+def parse_body(body: bytes) -> Union[dict, None]:
+    """
+    Parses the body of a record into a dictionary; Returns None if the body can not be parsed
+
+    The body is parsed as json and, if that fails, as a python literal
+
+    Arguments
+    ---------
+    body: bytes
+        The raw body of the record
+    """
+    try:
+        body = body.decode("utf-8")
+    except Exception:
+        return None
+
+    # Trying the fast json parser first
+    try:
+        parsed = json.loads(body)
+    except ValueError:
+        # Falling back to a safe python literal parser
+        try:
+            parsed = ast.literal_eval(body)
+        except Exception:
+            return None
+
+    # Only dictionaries are valid bodies
+    if not isinstance(parsed, dict):
+        return None
+
+    # Returning the parsed body
+    return parsed
+
+def extract_batch_features(records: list) -> Tuple[pd.DataFrame, int]:
+    """
+    Creates the features used for the aggregation for a batch of records (usually one avro file)
+
+    Returns the features dataframe and the number of records that were skipped because 
+    they could not be parsed
+
+    Arguments
+    ---------
+    records: list
+        List of the avro records
+    """
+    # Parsing the bodies 
+    bodies = [parse_body(record["Body"]) if "Body" in record else None for record in records]
+    bodies = [body for body in bodies if body is not None]
+
+    # Building the columnar arrays
+    columns = {"timestamp": [body.get("timestamp") for body in bodies]}
+    for key in VARIABLES:
+        columns[key] = [body.get(key) for body in bodies]
+    features = finish_features(pd.DataFrame(columns))
+
+    # Returning the features and the number of skipped records
+    return features, len(records) - features.shape[0]
+
+def finish_features(features: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the body columns to numbers and timestamps, drops the rows whose timestamp could not be 
+    parsed and derives the time parts; A variable that could not be parsed is left missing, which 
+    only leaves it out of the statistics of that variable
+
+    Arguments
+    ---------
+    features: pd.DataFrame
+        Dataframe with the timestamp and the variables of the bodies, one row per reading
+    """
+    # Converting the measurements to numbers
+    for key in VARIABLES:
+        features[key] = pd.to_numeric(features[key], errors="coerce")
+
+    # Converting the timestamps with the known format in one call, unless they were already converted
+    if not pd.api.types.is_datetime64_any_dtype(features["timestamp"]):
+        timestamp = pd.to_datetime(features["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+
+        # Falling back to inferring the format for the timestamps that did not match
+        mismatch = timestamp.isna() & features["timestamp"].notna()
+        if mismatch.any():
+            timestamp[mismatch] = pd.to_datetime(features.loc[mismatch, "timestamp"], format="mixed", errors="coerce")
+        features["timestamp"] = timestamp
+
+    # Dropping the rows without a timestamp
+    features = features.dropna(subset=["timestamp"]).reset_index(drop=True)
+
+    # Deriving the time parts from the timestamps
+    features["year"] = features["timestamp"].dt.year
+    features["month"] = features["timestamp"].dt.month
+    features["day"] = features["timestamp"].dt.day
+    features["hour"] = features["timestamp"].dt.hour
+    features["minute"] = features["timestamp"].dt.minute
+    features["second"] = features["timestamp"].dt.second
+
+    # Returning the features in the same column order as extract_features
+    return features[["timestamp", "year", "month", "day", "hour", "minute", "second"] + VARIABLES]
+
+def parse_bodies_arrow(bodies: list) -> pd.DataFrame:
+    """
+    Parses the json bodies of a batch of records column by column with the arrow json reader, 
+    without a python object per body, and creates the features; Raises pyarrow.ArrowInvalid if 
+    any body is not a single line json object with numeric variables
+
+    Arguments
+    ---------
+    bodies: list
+        The raw bodies of the records
+    """
+    # The reader parses newline delimited json, so a body spanning several lines can not be split
+    data = b"\n".join(bodies)
+    if data.count(b"\n") != len(bodies) - 1:
+        raise pa.ArrowInvalid("A body spans several lines")
+    table = pa_json.read_json(io.BytesIO(data), parse_options=BODY_PARSE_OPTIONS)
+
+    # Converting the timestamps in one cast; Other formats than the known one are left to pandas
+    try:
+        timestamp = pc.cast(table.column("timestamp"), pa.timestamp("us"))
+    except pa.ArrowInvalid:
+        return finish_features(table.to_pandas())
+
+    # Dropping the rows without a timestamp; The missing variables are converted to NaN
+    valid = pc.is_valid(timestamp)
+    timestamp = pc.filter(timestamp, valid)
+
+    # Deriving the time parts in arrow and creating the frame once
+    columns = {"timestamp": timestamp.to_numpy()}
+    for part in ["year", "month", "day", "hour", "minute", "second"]:
+        columns[part] = getattr(pc, part)(timestamp).to_numpy()
+    for key in VARIABLES:
+        columns[key] = pc.filter(table.column(key), valid).to_numpy()
+
+    # Returning the features in the same column order as extract_features
+    return pd.DataFrame(columns)
+
+def decode_capture_blob(stream, batch_records: int = DECODE_BATCH_RECORDS) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    """
+    Decodes a capture avro file block by block and yields the features, the number of records and 
+    the number of skipped records of every batch of about batch_records records
+
+    Only the bodies are kept from the avro records; They are parsed column by column with the arrow 
+    json reader, and the batches that it can not parse are parsed record by record
+
+    Arguments
+    ---------
+    stream: file object
+        The avro file; Read block by block, so it can be the stream of a download in progress
+    batch_records: int
+        The number of records parsed at once
+    """
+    bodies = []
+    blocks = fastavro.block_reader(stream)
+    while True:
+        block = next(blocks, None)
+        if block is not None:
+            for record in block:
+                bodies.append(record.get("Body"))
+            if len(bodies) < batch_records:
+                continue
+
+        # Parsing the batch once it is full or the file ended
+        if len(bodies) > 0:
+            valid_bodies = [body for body in bodies if body is not None]
+            try:
+                features = parse_bodies_arrow(valid_bodies)
+            except pa.ArrowInvalid:
+                features, _ = extract_batch_features([{"Body": body} for body in valid_bodies])
+            yield features, len(bodies), len(bodies) - features.shape[0]
+            bodies = []
+
+        if block is None:
+            return
+
 def extract_features(record: dict) -> dict:
     """
     Creates the features used for the aggregation
@@ -55,11 +275,13 @@ def extract_features(record: dict) -> dict:
     body = record["Body"]
 
     # Converting the body that is in bytes to a dictionary 
-    body = eval(body.decode("utf-8"))
+    body = parse_body(body)
+    if body is None:
+        return {}
 
     # Converting the timestamp to a datetime object
     try:
-        timestamp = datetime.datetime.strptime(body["timestamp"], "%Y-%m-%d %H:%M:%S.%f")
+        timestamp = datetime.datetime.strptime(body["timestamp"], TIMESTAMP_FORMAT)
     except Exception as e: 
         # Logging the error
         logging.warning(f"Could not convert the timestamp to a datetime object: {e}; Trying pandas to_datetime")
@@ -94,126 +316,532 @@ def extract_features(record: dict) -> dict:
     }
 
     # Appending the power_usage, voltage and current features
-    for key in ["power_usage", "voltage", "current"]:
+    for key in VARIABLES:
         features[key] = body[key]
 
     # Returning the features
     return features
 
-# Defining the function to aggregate the features 
-def main(delta_hours: Union[int, None]) -> None: 
+def get_decoder(decoder: Union[str, None] = None) -> str:
     """
-    Function that reads the raw streaming data and aggregates it 
-    
+    Resolves the avro decoder; Defaults to the AVRO_DECODER variable or "arrow"
+    """
+    if decoder is None:
+        decoder = os.getenv("AVRO_DECODER", "arrow")
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder}; Expected one of {DECODERS}")
+    return decoder
+
+def aggregate_blob_records(blob: bytes) -> Tuple[pd.DataFrame, int]:
+    """
+    Decodes a downloaded capture blob record by record and reduces it to per minute sums and counts;
+    Returns the partial aggregates and the number of records that could not be parsed
+    """
+    with timed("decode") as counters:
+        # Creating a fastavro reader
+        avro_reader = fastavro.reader(io.BytesIO(blob))
+
+        # Extracting the features of all the records in the blob at once
+        records = list(avro_reader)
+        features, skipped = extract_batch_features(records)
+        counters["records"] = len(records)
+        counters["skipped"] = skipped
+
+    with timed("groupby"):
+        # Reducing the readings to per minute sums and counts right away
+        return aggregate_partials(features), skipped
+
+def aggregate_blob_stream(container_client, blob_name: str) -> Tuple[pd.DataFrame, int]:
+    """
+    Streams a capture blob through the arrow decoder and reduces it to per minute sums and counts 
+    batch by batch, so the memory depends on the batch size and not on the size of the blob;
+    Returns the partial aggregates and the number of records that could not be parsed
+
     Arguments
     ---------
-    delta_hours: int
-        The number of hours to look back in time to aggregate the features
+    container_client: ContainerClient
+        The container client of the capture container
+    blob_name: str
+        The name of the capture blob
     """
-    # Infering the current file directory 
-    current_file_directory = os.path.dirname(os.path.abspath(__file__))
+    # Timing the request of the blob; The transfer of its chunks is reported by the stream as they are read
+    with timed("download", blobs=1):
+        stream = BlobStream(container_client.download_blob(blob_name))
 
-    # Loading the .env file from the parent directory
-    load_dotenv(os.path.join(current_file_directory, ".env"))
+    return aggregate_capture_stream(stream)
 
-    # Extracting the connection string and the container name from the .env file 
-    connection_string = os.getenv("AZURE_BLOB_CONNECTION_STRING")
-    container_name = os.getenv("AZURE_BLOB_CONTAINER_NAME")
+def aggregate_capture_stream(stream) -> Tuple[pd.DataFrame, int]:
+    """
+    Decodes a capture avro file with the arrow decoder and reduces it to per minute sums and counts 
+    batch by batch; Returns the partial aggregates and the number of records that could not be parsed
+
+    Arguments
+    ---------
+    stream: file object
+        The avro file; Read block by block, so it can be the stream of a download in progress. The 
+        seconds a BlobStream waits for its chunks are reported under "download" and not under "decode"
+    """
+    partials, skipped_records = [], 0
+    batches = decode_capture_blob(stream)
+    while True:
+        # Reading the next chunks of the blob and parsing their bodies
+        start, bytes_read, download_seconds = time.perf_counter(), stream.tell(), getattr(stream, "download_seconds", 0.0)
+        batch = next(batches, None)
+        seconds = time.perf_counter() - start - (getattr(stream, "download_seconds", 0.0) - download_seconds)
+        if batch is None:
+            count("decode", seconds, bytes=stream.tell() - bytes_read)
+            break
+        features, records, skipped = batch
+        count("decode", seconds, bytes=stream.tell() - bytes_read, records=records, skipped=skipped)
+        skipped_records += skipped
+
+        with timed("groupby"):
+            partials.append(aggregate_partials(features))
+
+    # Merging the batches of a large blob
+    with timed("groupby"):
+        if len(partials) == 0:
+            return aggregate_partials(pd.DataFrame(columns=MINUTE_KEYS + VARIABLES)), skipped_records
+        if len(partials) == 1:
+            return partials[0], skipped_records
+        return merge_partials(partials), skipped_records
+
+def get_source_run() -> str:
+    """
+    Creates the run stamp of the partials aggregated now; The rows of a later run of a capture blob 
+    supersede the ones of its earlier runs, see feature_store.drop_superseded
+    """
+    return datetime.datetime.now().strftime(RUN_STAMP_FORMAT)
 
-    # Extrating the aggregated feature path 
-    aggregated_feature_path = os.getenv("AZURE_ML_DATASET_PATH")
+def combine_blob_partials(blob_partials: Dict[str, pd.DataFrame], source_run: str) -> pd.DataFrame:
+    """
+    Combines the partial aggregates of every capture blob into one frame without merging the blobs, 
+    so a blob that is aggregated again later replaces exactly its own rows
 
-    # Initial placeholder whether the connection was successfull 
-    connection_success = False
+    The rows are sorted by the blob and the minute, so the result does not depend on the order in 
+    which the blobs finished
 
-    try:
-        # Creating the blob service client
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+    Arguments
+    ---------
+    blob_partials: Dict[str, pd.DataFrame]
+        The partial aggregates of every capture blob name
+    source_run: str
+        The run stamp of the aggregation, see get_source_run
+    """
+    frames = [partials.assign(source_blob=blob_name, source_run=source_run) for blob_name, partials in blob_partials.items() if partials.shape[0] > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=MINUTE_KEYS + SOURCE_KEYS + PARTIAL_COLUMNS)
+    return sort_blob_partials(pd.concat(frames, ignore_index=True))
 
-        # Extracting the container client
-        container_client = blob_service_client.get_container_client(container_name)
+def sort_blob_partials(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sorts the partial aggregates of the capture blobs by the blob and the minute
+    """
+    return partials.sort_values(["source_blob"] + MINUTE_KEYS, ignore_index=True)[MINUTE_KEYS + SOURCE_KEYS + PARTIAL_COLUMNS]
 
-        # Printing that the connection was successfull
-        logging.info("The connection was successfull")
+def take_cached_partials(cache: PartialsCache, blob_names: list, etags: Dict[str, str]) -> Tuple[Dict[str, pd.DataFrame], int, list]:
+    """
+    Takes the partial aggregates of the unchanged blobs from the local cache
 
-        # Raising the connection success flag
-        connection_success = True
-    except: 
-        # Printing that the connection was not successfull 
-        logging.warn("The connection was not successfull")
+    Returns the partials of every cached blob, their number of skipped records and the names 
+    of the blobs that are not in the cache
+    """
+    partials, skipped_records, missing_names = {}, 0, []
+    with timed("cache") as counters:
+        for blob_name in blob_names:
+            cached = cache.get(blob_name, etags.get(blob_name))
+            if cached is None:
+                missing_names.append(blob_name)
+                continue
+            partials[blob_name] = cached[0]
+            skipped_records += cached[1]
+        counters["hits"] = len(blob_names) - len(missing_names)
+        counters["misses"] = len(missing_names)
+
+    return partials, skipped_records, missing_names
+
+def aggregate_blobs(
+        container_client, 
+        blob_names: list, 
+        download_workers: int = 8, 
+        etags: Union[Dict[str, str], None] = None, 
+        cache: Union[PartialsCache, None] = None,
+        decoder: Union[str, None] = None,
+        source_run: Union[str, None] = None
+    ) -> Tuple[Union[pd.DataFrame, None], int]:
+    """
+    Downloads the capture blobs and reduces their records to per minute sums and counts
 
-        # Raising an error
-        connection_success = False
+    Returns the partial aggregates with one row per blob and minute, see combine_blob_partials 
+    (None if there were no blobs), and the number of records that could not be parsed
 
-    if not connection_success:
-        return 
-    
-    # Listing all the blobs in the container; The blobs should be created in the past 24 hours
-    blobs = container_client.list_blobs(name_starts_with="flexitricity/")
+    If a cache is given, the partials of every blob version are taken from it instead of being 
+    downloaded and decoded again, and the decoded ones are added to it
 
-    # Extracting the blob names
-    blob_names = get_blob_names(blobs)
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    blob_names: list
+        The names of the capture blobs
+    download_workers: int
+        The number of threads downloading the avro blobs concurrently
+    etags: Dict[str, str]
+        The etag of every blob name; The blobs without an etag are never cached
+    cache: PartialsCache
+        The local cache of the partials of every blob version
+    decoder: str
+        "arrow" or "records"; Defaults to the AVRO_DECODER variable or "arrow"
+    source_run: str
+        The run stamp the rows are marked with; Defaults to now
+    """
+    # Creating an empty dictionary to store the partial per minute aggregates of each blob
+    partials = {}
+
+    # Counting the records that could not be parsed
+    skipped_records = 0
+
+    # Taking the partials of the unchanged blobs from the local cache
+    etags = etags or {}
+    if cache is not None:
+        partials, skipped_records, blob_names = take_cached_partials(cache, blob_names, etags)
+
+    # Streaming and decoding the blobs in the download threads with the arrow decoder, or downloading 
+    # them whole and decoding them here record by record; The blobs are yielded in the order of the names
+    if get_decoder(decoder) == "arrow":
+        results = map_blobs(blob_names, lambda blob_name: aggregate_blob_stream(container_client, blob_name), max_workers=download_workers)
+    else:
+        downloads = download_blobs(container_client, blob_names, max_workers=download_workers)
+        results = ((blob_name, aggregate_blob_records(blob)) for blob_name, blob in downloads)
+
+    # Iterating over the per minute sums and counts of every blob
+    for blob_name, (blob_partials, skipped) in tqdm(results, total=len(blob_names), desc="Extracting the features"):
+        partials[blob_name] = blob_partials
+        skipped_records += skipped
+
+        # Caching the partials of the blob version for the overlapping windows of the next runs
+        if cache is not None:
+            with timed("cache_put"):
+                cache.put(blob_name, etags.get(blob_name), blob_partials, skipped)
+
+    # If there are no blobs, there is nothing to aggregate
+    if len(partials) == 0:
+        return None, skipped_records
+
+    # Returning the partials of all the blobs, marked with their blob and the run
+    with timed("groupby"):
+        return combine_blob_partials(partials, source_run or get_source_run()), skipped_records
+
+def aggregate_new_blobs(container_client, delta_hours: Union[int, None], download_workers: int = 8, full_backfill: bool = False, manifest_path: str = DEFAULT_MANIFEST_PATH) -> Tuple[Union[pd.DataFrame, None], dict]:
+    """
+    Downloads the capture blobs of the window that are not in the manifest yet and aggregates them per minute
 
-    # Extracting the delta blobs
-    delta_blob_names = get_delta_blobs(blob_names, delta_hours)
+    Returns the per minute sums, counts and means of every blob (None if there were no new blobs) and 
+    the manifest that has to be saved once the means are stored
 
-    # Creating an empty list to store the aggregated features
-    aggregated_features = []
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    delta_hours: int
+        The number of hours to look back in time to aggregate the features
+    download_workers: int
+        The number of threads downloading the avro blobs concurrently
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored and every blob in the window is processed
+    manifest_path: str
+        The name of the manifest blob
+    """
+    listed_blobs, manifest, delta_blobs = list_new_blobs(container_client, delta_hours, full_backfill, manifest_path)
+    delta_blob_names = get_blob_names(delta_blobs)
 
     # Logging the number of blobs 
     logging.info(f"There are {len(delta_blob_names)} blobs to aggregate")
 
-    # Iterating over the delta blob names and extracting the features
-    for blob_name in tqdm(delta_blob_names, desc="Extracting the features"):
-        # Extracting the blob client
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    # Aggregating the blobs to per minute sums and counts, reusing the locally cached blob versions
+    etags = {blob.name: blob.etag for blob in delta_blobs}
+    partials, skipped_records = aggregate_blobs(container_client, delta_blob_names, download_workers, etags, get_partials_cache())
 
-        # Downloading the blob
-        blob = blob_client.download_blob().readall()
+    # Logging the number of skipped records once 
+    if skipped_records > 0:
+        logging.warning(f"Skipped {skipped_records} records that could not be parsed")
 
-        # Creating a fastavro reader
-        avro_reader = fastavro.reader(io.BytesIO(blob))
+    # If there are no blobs, there is nothing to aggregate
+    if partials is None:
+        logging.info("No new blobs to aggregate")
+        return None, manifest
 
-        # Iterating over the records in the blob
-        for record in avro_reader:
-            # Extracting the features
-            features = extract_features(record)
+    # Calculating the mean of the power_usage, voltage and current by year, month, day, hour, minute and blob; 
+    # The sums and counts are kept so the features of different blobs and runs can be combined exactly
+    with timed("groupby") as counters:
+        aggregated_features = add_means(partials)
+        counters["rows"] = aggregated_features.shape[0]
 
-            # Appending the features to the list
-            aggregated_features.append(features)
+    # Returning the means and the manifest with the processed blobs
+    return aggregated_features, update_manifest(manifest, delta_blobs, listed_blobs)
 
-    # Converting to a parquet file
-    aggregated_features = pd.DataFrame(aggregated_features)
+def list_new_blobs(container_client, delta_hours: Union[int, None], full_backfill: bool = False, manifest_path: str = DEFAULT_MANIFEST_PATH) -> Tuple[list, dict, list]:
+    """
+    Lists the capture blobs of the window and leaves the ones that are not in the manifest yet
 
-    # Aggregating by year, month, day, hour, minute and calculating the mean of the power_usage, voltage and current
-    variables = ["power_usage", "voltage", "current"]
-    aggregated_features = aggregated_features.groupby(["year", "month", "day", "hour", "minute"], as_index=False)[variables].mean()
+    Returns the listed blobs, the manifest and the blobs to process
 
-    # Creating a date column 
-    aggregated_features["date"] = pd.to_datetime(aggregated_features[["year", "month", "day", "hour", "minute"]])
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    delta_hours: int
+        The number of hours to look back in time; If None, all the blobs are listed
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored; The rows of the reprocessed blobs 
+        supersede the ones of their earlier runs in the feature files
+    manifest_path: str
+        The name of the manifest blob
+    """
+    # Listing only the blobs of the time window by listing their day and hour folders
+    listed_blobs = list_delta_blobs(container_client, CAPTURE_ROOT, delta_hours)
+
+    # Loading the manifest of the already processed blobs; A full backfill starts from scratch and 
+    # replaces the earlier runs of every blob it aggregates
+    manifest = {} if full_backfill else load_manifest(container_client, manifest_path)
 
-    # Creating the name for the blob for upload
-    # The name will start with the min year, month, day, hour and minute and end with the max year, month, day, hour and minute
-    min_date = aggregated_features['date'].min()
-    max_date = aggregated_features['date'].max()
+    # Leaving only the new, changed or late arriving blobs
+    return listed_blobs, manifest, get_unprocessed_blobs(listed_blobs, manifest)
 
-    # Converting to string 
-    min_date = min_date.strftime("%Y-%m-%d-%H-%M")
-    max_date = max_date.strftime("%Y-%m-%d-%H-%M")
+def get_checkpoint_name(checkpoint_path: str, partition_day: str) -> str:
+    """
+    Creates the name of the checkpoint of a partition day, without an extension
+    """
+    return f"{checkpoint_path}/{partition_day}"
 
-    # Dropping the date column
-    aggregated_features.drop(columns=["date"], inplace=True)
+def load_checkpoint(container_client, checkpoint_name: str, entries: dict) -> Union[pd.DataFrame, None]:
+    """
+    Loads the partial aggregates of a partition day if its checkpoint was made from exactly the given blobs
 
-    # Creating the name for the blob for upload 
-    feature_blob_name = f"{aggregated_feature_path}/{min_date}_{max_date}.parquet"
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the checkpoints
+    checkpoint_name: str
+        The name of the checkpoint without an extension
+    entries: dict
+        The manifest entries of the blobs of the partition day
+    """
+    try:
+        checkpoint = json.loads(container_client.download_blob(f"{checkpoint_name}.json").readall())
+        if checkpoint.get("blobs") != entries:
+            return None
+        partials = pd.read_parquet(io.BytesIO(container_client.download_blob(f"{checkpoint_name}.parquet").readall()))
+    except ResourceNotFoundError:
+        return None
+
+    # Checkpoints written before all the statistics existed or before the blobs were kept apart are aggregated again
+    if not all(column in partials.columns for column in SOURCE_KEYS + PARTIAL_COLUMNS):
+        return None
+    return partials
+
+def aggregate_partition_day(checkpoint_name: str, blob_names: list, entries: dict, container_factory: Callable = get_container_client, download_workers: int = 4) -> Tuple[Union[pd.DataFrame, None], int]:
+    """
+    Aggregates the blobs of one partition day in a worker process and saves its checkpoint
+
+    The partial aggregates are written before the json with the blob entries, so a checkpoint 
+    is only valid once both exist
+
+    Arguments
+    ---------
+    checkpoint_name: str
+        The name of the checkpoint without an extension
+    blob_names: list
+        The names of the capture blobs of the partition day
+    entries: dict
+        The manifest entries of the blobs
+    container_factory: Callable
+        Creates the container client in the worker process
+    download_workers: int
+        The number of threads downloading the avro blobs concurrently
+    """
+    container_client = container_factory()
+    etags = {blob_name: entry["etag"] for blob_name, entry in entries.items()}
+    partials, skipped_records = aggregate_blobs(container_client, blob_names, download_workers, etags, get_partials_cache())
+    if partials is not None:
+        buffer = io.BytesIO()
+        partials.to_parquet(buffer, index=False)
+        container_client.upload_blob(name=f"{checkpoint_name}.parquet", data=buffer.getvalue(), overwrite=True)
+        container_client.upload_blob(name=f"{checkpoint_name}.json", data=json.dumps({"blobs": entries}), overwrite=True)
+
+    return partials, skipped_records
+
+def backfill_blobs(
+        container_client,
+        delta_hours: Union[int, None],
+        workers: int,
+        download_workers: int = 4,
+        full_backfill: bool = False,
+        manifest_path: str = DEFAULT_MANIFEST_PATH,
+        checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+        container_factory: Callable = get_container_client
+    ) -> Tuple[Union[pd.DataFrame, None], dict]:
+    """
+    Aggregates the new blobs of the window like aggregate_new_blobs, but spreads the partition days over a process pool
+
+    Every partition day is reduced to per minute sums and counts of its blobs in a worker and 
+    checkpointed; The partition days whose checkpoint matches their blobs are loaded instead, so an 
+    interrupted backfill resumes where it stopped
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    delta_hours: int
+        The number of hours to look back in time; If None, all the blobs are aggregated
+    workers: int
+        The number of worker processes
+    download_workers: int
+        The number of threads downloading the avro blobs in every worker
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored
+    manifest_path: str
+        The name of the manifest blob
+    checkpoint_path: str
+        The folder of the partition day checkpoints
+    container_factory: Callable
+        Creates the container client in the worker processes; Has to be picklable
+    """
+    listed_blobs, manifest, delta_blobs = list_new_blobs(container_client, delta_hours, full_backfill, manifest_path)
+
+    # Grouping the blobs by partition and day
+    partition_days = {}
+    for blob in delta_blobs:
+        partition_days.setdefault(get_partition_day(blob.name, CAPTURE_ROOT), []).append(blob)
+    logging.info(f"There are {len(delta_blobs)} blobs in {len(partition_days)} partition days to aggregate")
+
+    partials = []
+    skipped_records = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Loading the checkpoint or submitting the aggregation of every partition day, in the order of their names
+        partition_results, resumed = [], 0
+        for partition_day, blobs in sorted(partition_days.items()):
+            checkpoint_name = get_checkpoint_name(checkpoint_path, partition_day)
+            entries = {blob.name: get_blob_entry(blob) for blob in blobs}
+
+            # Resuming from the checkpoint if the blobs did not change since
+            checkpoint = load_checkpoint(container_client, checkpoint_name, entries)
+            if checkpoint is not None:
+                partition_results.append((checkpoint, None))
+                resumed += 1
+                continue
+
+            partition_results.append((None, executor.submit(aggregate_partition_day, checkpoint_name, get_blob_names(blobs), entries, container_factory, download_workers)))
+
+        logging.info(f"Resumed {resumed} partition days from their checkpoints")
+
+        # Collecting the partition days in the order of their names and not in the order they finish
+        for checkpoint, future in tqdm(partition_results, desc="Aggregating the partition days"):
+            if future is None:
+                partials.append(checkpoint)
+                continue
+            with timed("partition_day"):
+                partition_partials, skipped = future.result()
+            skipped_records += skipped
+            if partition_partials is not None:
+                partials.append(partition_partials)
+
+    # Logging the number of skipped records once 
+    if skipped_records > 0:
+        logging.warning(f"Skipped {skipped_records} records that could not be parsed")
+
+    if len(partials) == 0:
+        logging.info("No new blobs to aggregate")
+        return None, manifest
+
+    # Combining the blobs of the partition days in the same order as aggregate_blobs and calculating the means
+    with timed("groupby") as counters:
+        partials = [day_partials for day_partials in partials if day_partials.shape[0] > 0] or partials[:1]
+        aggregated_features = add_means(sort_blob_partials(pd.concat(partials, ignore_index=True)))
+        counters["rows"] = aggregated_features.shape[0]
+
+    return aggregated_features, update_manifest(manifest, delta_blobs, listed_blobs)
+
+def upload_features(container_client, feature_files: Dict[str, pd.DataFrame], manifest_path: str, manifest: dict) -> None:
+    """
+    Uploads the per minute features of every day partition and then saves the manifest of the processed blobs
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the feature blobs
+    feature_files: Dict[str, pd.DataFrame]
+        The features of every feature file, created by split_feature_files; If empty, only the manifest is saved
+    manifest_path: str
+        The name of the manifest blob
+    manifest: dict
+        The manifest including the blobs of the features
+    """
+    # If none of the records could be parsed, the blobs are still marked as processed
+    if len(feature_files) == 0:
+        logging.info("The new blobs did not contain any valid records")
+
+    for feature_blob_name, features in feature_files.items():
+        # Writing the sorted parquet file with row group statistics
+        with timed("write_parquet", rows=features.shape[0]) as counters:
+            data = write_features_parquet(features)
+            counters["bytes"] = len(data)
+
+        # Uploading the parquet file to its day partition
+        with timed("upload", bytes=len(data)):
+            container_client.upload_blob(name=feature_blob_name, data=data)
+
+    # Marking the blobs as processed only after the uploads succeeded
+    with timed("save_manifest"):
+        save_manifest(container_client, manifest_path, manifest)
+
+# Defining the function to aggregate the features 
+def main(delta_hours: Union[int, None], download_workers: int = 8, full_backfill: bool = False, workers: int = 1) -> None: 
+    """
+    Function that reads the raw streaming data and aggregates it 
+    
+    Arguments
+    ---------
+    delta_hours: int
+        The number of hours to look back in time to aggregate the features
+    download_workers: int
+        The number of threads downloading the avro blobs concurrently
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored and every blob in the window is processed
+    workers: int
+        If more than 1, the partition days are aggregated in that many processes and checkpointed 
+        to AZURE_CHECKPOINT_PATH, so an interrupted backfill resumes
+    """
+    # Loading the settings once per process
+    config = get_config()
+
+    # Extracting the path of the manifest of the processed blobs
+    manifest_path = os.getenv("AZURE_MANIFEST_PATH", DEFAULT_MANIFEST_PATH)
+
+    try:
+        # Reusing the cached container client
+        container_client = get_container_client()
+
+        # Printing that the connection was successfull
+        logging.info("The connection was successfull")
+    except: 
+        # Printing that the connection was not successfull 
+        logging.warn("The connection was not successfull")
+
+        return 
 
-    # Creating a temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Saving the dataframe to a parquet file
-        aggregated_features.to_parquet(os.path.join(temp_dir, "aggregated_features.parquet"))
+    # Aggregating the new blobs
+    if workers > 1:
+        checkpoint_path = os.getenv("AZURE_CHECKPOINT_PATH", DEFAULT_CHECKPOINT_PATH)
+        aggregated_features, manifest = backfill_blobs(container_client, delta_hours, workers, download_workers, full_backfill, manifest_path, checkpoint_path)
+    else:
+        aggregated_features, manifest = aggregate_new_blobs(container_client, delta_hours, download_workers, full_backfill, manifest_path)
+    if aggregated_features is None:
+        return
 
-        # Uploading the parquet file to the blob storage
-        container_client.upload_blob(name=feature_blob_name, data=open(os.path.join(temp_dir, "aggregated_features.parquet"), "rb"))
+    # Uploading the features of every day partition and the manifest
+    feature_files = split_feature_files(config["aggregated_feature_path"], aggregated_features)
+    upload_features(container_client, feature_files, manifest_path, manifest)
 
     # Logging a successfull run 
     logging.info("The aggregation was successfull")
@@ -227,6 +855,9 @@ if __name__ == '__main__':
 
     # Adding the arguments to the parser
     parser.add_argument("--delta_hours", type=int, help="The number of hours to look back in time to aggregate the features", default=None)
+    parser.add_argument("--download_workers", type=int, help="The number of threads downloading the blobs concurrently", default=8)
+    parser.add_argument("--full_backfill", action="store_true", help="Ignore the manifest of the processed blobs and process every blob in the window")
+    parser.add_argument("--workers", type=int, help="The number of processes aggregating the partition days; More than 1 checkpoints every partition day", default=1)
 
     # Parsing the arguments
     args = parser.parse_args()
@@ -235,4 +866,4 @@ if __name__ == '__main__':
     delta_hours = args.delta_hours
 
     # Calling the main function
-    main(delta_hours=delta_hours)
\ No newline at end of file
+    main(delta_hours=delta_hours, download_workers=args.download_workers, full_backfill=args.full_backfill, workers=args.workers)
\ No newline at end of file
@@ -1,6 +1,3 @@
-# Dotenv loading 
-from dotenv import load_dotenv
-
 # OS traversal 
 import os 
 
@@ -10,9 +7,6 @@ import datetime
 # Input/output stream
 import io
 
-# Iteration tracking 
-from tqdm import tqdm
-
 # Importing blob functionalities
 from blobs import get_blob_names
 
@@ -22,8 +16,23 @@ import pandas as pd
 # Importing logging 
 import logging
 
-# PSQL connection 
-import psycopg2
+# Typehinting 
+from typing import Union
+
+# Shared connections
+from resources import get_config, get_connection_pool, borrow_connection
+
+# Minutes ahead targets
+from targets import HORIZONS, compute_forward_sums, build_forward_sums_query
+
+# Dense minute grid
+from resampling import get_fill_policy, resample_minutes, log_gap_report
+
+# Bulk writing to PSQL
+from psql import get_write_mode, get_watermark, write_dataframe, require_unique_index
+
+# Run metrics
+from metrics import timed
 
 # Defining the feature names 
 FEATURES = [
@@ -32,111 +41,166 @@ FEATURES = [
     'voltage'
 ]
 
-# Infering the current file directory 
-def main():
-    current_file_directory = os.path.dirname(os.path.abspath(__file__))
-
-    # Loading the .env file from the parent directory
-    load_dotenv(os.path.join(current_file_directory, ".env"))
-
-    # PSQL credentials
-    db_user = os.getenv('PSQL_USER', 'default_user')
-    db_pass = os.getenv('PSQL_PASSWORD', 'default_pass')
-    db_host = os.getenv('PSQL_HOST', 'localhost')
-    db_name = os.getenv('PSQL_DATABASE', 'default_db')
-    db_port = os.getenv('PSQL_PORT', '5432')
-    
-    # Connecting to psql
-    try:
-        conn = psycopg2.connect(user=db_user, password=db_pass, host=db_host, port=db_port, database=db_name)
-        cursor = conn.cursor()
-        logging.info("Connected to PSQL")
-    except:
-        logging.warn("Could not connect to PSQL")
-        return
-    
-    # Getting the newest datetime from the 'power_consumption' table
-    cursor.execute("SELECT MAX(timestamp) FROM power_consumption")
-    max_timestamp = cursor.fetchone()[0]
+# Defining the engines that compute the minutes ahead sums 
+ENGINES = ["pandas", "sql"]
+
+# Defining the columns of the power_consumption table
+POWER_CONSUMPTION_COLUMNS = [
+    "timestamp", 
+    "power_usage_5_minutes_ahead", 
+    "power_usage_15_minutes_ahead", 
+    "power_usage_60_minutes_ahead", 
+    "created_datetime", 
+    "updated_datetime"
+]
 
-    # Defining the default query (max_timestamp - 60 minutes)
-    query = f"SELECT timestamp, power_usage FROM electricity_timeseries WHERE timestamp > '{max_timestamp}'"
+def build_power_consumption(conn, write_mode: str, timeseries: Union[pd.DataFrame, None] = None) -> Union[pd.DataFrame, None]:
+    """
+    Computes the minutes ahead power usage sums after the watermark in memory
 
-    # If the max_timestamp is null, we download all the 'electricity_timeseries' table
-    if max_timestamp is None:
-        # Creating the query
-        query = f"SELECT timestamp, power_usage FROM electricity_timeseries"
+    Returns None if no minute has a complete window yet
 
-    # Executing the query
-    cursor.execute(query)
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    write_mode: str
+        "insert" or "upsert"
+    timeseries: pd.DataFrame
+        The newest electricity_timeseries minutes handed over in memory by the previous stage; 
+        Only the minutes before them are read from the database, so their write does not have to finish first
+    """
+    cursor = conn.cursor()
 
-    # Fetching the data
-    data = cursor.fetchall()
+    # Getting the newest datetime from the 'power_consumption' table
+    max_timestamp = get_watermark(cursor, "power_consumption", write_mode)
+
+    # Only the minutes after the watermark are needed; Their windows lie after the watermark as well 
+    query = "SELECT timestamp, power_usage FROM electricity_timeseries WHERE (%(max_timestamp)s::timestamp IS NULL OR timestamp > %(max_timestamp)s::timestamp)"
+    params = {"max_timestamp": max_timestamp}
+    in_memory = None
+    if timeseries is not None and timeseries.shape[0] > 0:
+        in_memory = timeseries[["timestamp", "power_usage"]]
+        if max_timestamp is not None:
+            in_memory = in_memory[in_memory["timestamp"] > max_timestamp]
+        query += " AND timestamp < %(min_timestamp)s"
+        params["min_timestamp"] = timeseries["timestamp"].min().to_pydatetime()
+    with timed("read_timeseries") as counters:
+        cursor.execute(query + " ORDER BY timestamp", params)
+
+        # Fetching the data
+        data = cursor.fetchall()
+        counters["rows"] = len(data)
 
     # Creating the dataframe
     timeseries = pd.DataFrame(data, columns=["timestamp", "power_usage"])
 
-    # Sorting the dataframe
-    timeseries = timeseries.sort_values("timestamp")
-
-    # Creating the 5, 15 and 60 minutes ahead sum power_usage features
-    for minutes in [5, 15, 60]:
-        # Creating the feature name
-        feature_name = f"power_usage_{minutes}_minutes_ahead"
+    # Appending the in memory minutes after the stored ones
+    if in_memory is not None:
+        timeseries = pd.concat([timeseries, in_memory], ignore_index=True).sort_values("timestamp", ignore_index=True)
 
-        # Creating the feature
-        series = timeseries["power_usage"].rolling(minutes).sum()
+    # Placing the minutes on a dense grid from the minute after the watermark, so the windows
+    # span minutes and not rows; The gaps are filled with the GAP_FILL_POLICY or invalidate their windows
+    start = None if max_timestamp is None else max_timestamp + datetime.timedelta(minutes=1)
+    with timed("resample", rows=timeseries.shape[0]) as counters:
+        timeseries, gap_report = resample_minutes(timeseries, ["power_usage"], start=start)
+        counters["missing_minutes"] = gap_report["missing_minutes"]
+        counters["filled_minutes"] = gap_report["filled_minutes"]
+        counters["gaps"] = gap_report["gaps"]
+    log_gap_report(gap_report)
 
-        # Appending the feature to the dataframe
-        timeseries[feature_name] = series.shift(-minutes)
+    # Creating the 5, 15 and 60 minutes ahead sum power_usage features; 
+    # The minutes whose windows are not complete yet are left for the next run
+    with timed("forward_sums", rows=timeseries.shape[0]):
+        timeseries = compute_forward_sums(timeseries, HORIZONS)
 
-    # Dropping the NaN values
-    timeseries = timeseries.dropna()
+    # The missing minutes that were not filled get no row, like in the sql engine
+    timeseries = timeseries[~timeseries["gap"] | timeseries["filled"]].reset_index(drop=True)
 
     # Inspecting whether the dataframe is empty
     if timeseries.shape[0] == 0:
         logging.info("The dataframe is empty; Returning")
-        return
+        return None
     
-    # Uploading the sql 
-    for index, row in tqdm(timeseries.iterrows(), total=len(timeseries)):
-        # Getting the current datetime 
-        current_datetime = row["timestamp"]
-
-        # Creating the values 
-        values = (
-            row['timestamp'],
-            row['power_usage_5_minutes_ahead'],
-            row['power_usage_15_minutes_ahead'],
-            row['power_usage_60_minutes_ahead'],
-            current_datetime,
-            current_datetime,
-        )
-
-        # Creating the uplaod query 
-        query = f"""
-            INSERT INTO power_consumption (
-                timestamp, 
-                power_usage_5_minutes_ahead, 
-                power_usage_15_minutes_ahead, 
-                power_usage_60_minutes_ahead, 
-                created_datetime, 
-                updated_datetime
-            ) VALUES (
-                '{values[0]}', 
-                '{values[1]}', 
-                '{values[2]}', 
-                '{values[3]}', 
-                '{values[4]}', 
-                '{values[5]}'
-            )
-        """
-
-        # Executing the query
-        cursor.execute(query)
-
-    # Commiting the changes
-    conn.commit()
+    # The created and updated datetimes are the timestamps of the rows
+    timeseries["created_datetime"] = timeseries["timestamp"]
+    timeseries["updated_datetime"] = timeseries["timestamp"]
+
+    return timeseries
+
+def write_power_consumption(conn, write_mode: str, engine: str) -> None:
+    """
+    Computes the minutes ahead power usage sums after the watermark and writes them to the power_consumption table
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    write_mode: str
+        "insert" or "upsert"
+    engine: str
+        "pandas" or "sql"
+    """
+    # Computing and writing the sums inside postgres; No rows cross the wire
+    if engine == "sql":
+        # The gaps always invalidate their windows inside postgres
+        if get_fill_policy() != "none":
+            logging.warning("The sql engine does not fill the missing minutes; Their windows are dropped")
+        cursor = conn.cursor()
+        max_timestamp = get_watermark(cursor, "power_consumption", write_mode)
+        if write_mode == "upsert":
+            require_unique_index(conn, "power_consumption", ["timestamp"])
+        with timed("write_power_consumption") as counters:
+            cursor.execute(build_forward_sums_query(horizons=HORIZONS, write_mode=write_mode), {"max_timestamp": max_timestamp})
+            logging.info(f"Wrote {cursor.rowcount} rows into power_consumption")
+            conn.commit()
+            counters["rows"] = cursor.rowcount
+        return
+
+    # Computing the sums in memory
+    timeseries = build_power_consumption(conn, write_mode)
+    if timeseries is None:
+        return
+
+    # Writing the rows to the database in bulk
+    write_dataframe(conn, "power_consumption", timeseries, POWER_CONSUMPTION_COLUMNS, keys=["timestamp"], write_mode=write_mode)
+
+def main(write_mode: Union[str, None] = None, engine: Union[str, None] = None):
+    """
+    Function that creates the minutes ahead power usage sums and writes them to the power_consumption table
+
+    Arguments
+    ---------
+    write_mode: str
+        "insert" appends the rows after the watermark, "upsert" reprocesses the last 
+        PSQL_UPSERT_LOOKBACK_MINUTES before it; Defaults to the PSQL_WRITE_MODE variable
+    engine: str
+        "pandas" computes the sums in memory, "sql" computes them inside postgres with 
+        window functions and INSERT ... SELECT; Defaults to the POWER_CONSUMPTION_ENGINE variable or "pandas"
+    """
+    # Loading the settings once per process
+    get_config()
+
+    # Resolving the write mode
+    write_mode = get_write_mode(write_mode)
+
+    # Resolving the engine
+    if engine is None:
+        engine = os.getenv("POWER_CONSUMPTION_ENGINE", "pandas")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}; Expected one of {ENGINES}")
+
+    # Connecting to psql through the shared pool
+    try:
+        get_connection_pool()
+        logging.info("Connected to PSQL")
+    except:
+        logging.warn("Could not connect to PSQL")
+        return
+
+    # Borrowing a connection and returning it when the stage is done
+    with borrow_connection() as conn:
+        write_power_consumption(conn, write_mode, engine)
 
 if __name__ == '__main__': 
     main()
\ No newline at end of file
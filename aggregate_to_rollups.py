@@ -0,0 +1,196 @@
+# Date wrangling
+import datetime
+
+# Dataframes
+import pandas as pd
+
+# Importing logging
+import logging
+
+# Typehinting
+from typing import Dict, Iterable, Union
+
+# Shared clients and connections
+from resources import get_config, get_container_client, get_connection_pool, borrow_connection
+
+# Reading the per minute sums and counts of the feature store
+from aggregate_to_timeseries import read_minute_partials
+from aggregation import MINUTE_KEYS, VARIABLES, rollup_partials, partials_to_statistics
+
+# Bulk writing to PSQL
+from psql import get_write_mode, get_watermark, write_dataframe
+
+# Safe SQL composition
+from psycopg2 import sql
+
+# Run metrics
+from metrics import timed
+
+# Defining the rollup tables and the length of their buckets in minutes
+ROLLUPS = {
+    "electricity_timeseries_5_minutes": 5,
+    "electricity_timeseries_15_minutes": 15,
+    "electricity_timeseries_hourly": 60,
+    "electricity_timeseries_daily": 1440,
+}
+
+# Defining the statistics of every variable in the rollup tables
+STATISTICS = ["mean", "std", "min", "max"]
+
+# Defining the columns of the rollup tables
+ROLLUP_COLUMNS = (
+    ["timestamp", "reading_count"]
+    + [f"{variable}_{statistic}" for variable in VARIABLES for statistic in STATISTICS]
+    + ["created_datetime", "updated_datetime"]
+)
+
+def ensure_rollup_tables(conn) -> None:
+    """
+    Creates the rollup tables with the unique timestamp their upserts need, if they do not exist;
+    Every row is a bucket starting at its timestamp. Runs in the setup step, see migrate.py
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    """
+    columns = sql.SQL(", ").join(
+        sql.SQL("{} DOUBLE PRECISION").format(sql.Identifier(f"{variable}_{statistic}")) for variable in VARIABLES for statistic in STATISTICS
+    )
+    with conn.cursor() as cursor:
+        for table in ROLLUPS:
+            cursor.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id SERIAL PRIMARY KEY, timestamp TIMESTAMP UNIQUE, reading_count BIGINT, {columns},
+                    created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+                )
+            """).format(table=sql.Identifier(table), columns=columns))
+    conn.commit()
+
+def build_rollups(
+        conn,
+        container_client,
+        aggregated_feature_path: str,
+        write_mode: str,
+        download_workers: int = 8,
+        features: Union[pd.DataFrame, None] = None,
+        exclude_blobs: Iterable[str] = ()
+    ) -> Union[Dict[str, pd.DataFrame], None]:
+    """
+    Recomputes the buckets of the rollup tables that hold minutes after their watermark
+
+    The buckets are rolled up from the per minute sums, sums of squares, minimums, maximums and
+    counts of the feature store, so their statistics are those of the raw readings; Every table 
+    recomputes the bucket of its own watermark and the later ones, so a bucket that was still 
+    filling up is completed with its new minutes. The minutes are read once, from the earliest of 
+    these buckets, which is usually the day of the daily table
+
+    Returns the new and changed buckets of every table with new minutes, or None if there are no minutes
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    write_mode: str
+        "insert" or "upsert"; In "upsert" mode the buckets of the last PSQL_UPSERT_LOOKBACK_MINUTES
+        before the watermark are recomputed as well
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    features: pd.DataFrame
+        Per minute sums and counts handed over in memory by the previous stage
+    exclude_blobs: Iterable[str]
+        The feature blobs that hold the in memory features and are not read again
+    """
+    # Finding the bucket of the watermark of every table; An empty table is rolled up from the whole history
+    starts = {}
+    with conn.cursor() as cursor:
+        for table, minutes in ROLLUPS.items():
+            watermark = get_watermark(cursor, table, write_mode)
+            starts[table] = None if watermark is None else pd.Timestamp(watermark).floor(f"{minutes}min")
+
+    # Reading the minutes from the earliest bucket; The read starts after the minute before it
+    min_timestamp = None
+    if all(start is not None for start in starts.values()):
+        min_timestamp = min(starts.values()).to_pydatetime() - datetime.timedelta(minutes=1)
+    partials = read_minute_partials(container_client, aggregated_feature_path, min_timestamp, download_workers, features, exclude_blobs)
+    if partials is None:
+        logging.info("No new minutes to roll up")
+        return None
+    minute_timestamps = pd.to_datetime(partials[MINUTE_KEYS])
+
+    rollups = {}
+    now = datetime.datetime.now()
+    for table, minutes in ROLLUPS.items():
+        with timed("rollup") as counters:
+            # Leaving the minutes of the bucket of the watermark of the table and of the later ones
+            table_partials = partials if starts[table] is None else partials[minute_timestamps >= starts[table]]
+            counters["rows"] = 0
+            if table_partials.shape[0] == 0:
+                continue
+
+            # Merging the minutes of every bucket and converting them to the statistics
+            statistics = partials_to_statistics(rollup_partials(table_partials, minutes))
+            statistics["timestamp"] = pd.to_datetime(statistics[MINUTE_KEYS])
+            statistics = statistics.drop(columns=MINUTE_KEYS).rename(columns={"count": "reading_count"})
+
+            statistics["created_datetime"] = now
+            statistics["updated_datetime"] = now
+            rollups[table] = statistics[ROLLUP_COLUMNS].reset_index(drop=True)
+            counters["rows"] = rollups[table].shape[0]
+
+    return rollups
+
+def write_rollups(conn, rollups: Dict[str, pd.DataFrame]) -> None:
+    """
+    Writes the recomputed buckets to the rollup tables; The buckets that already exist are updated
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    rollups: Dict[str, pd.DataFrame]
+        The buckets of every rollup table, created by build_rollups
+    """
+    for table, buckets in rollups.items():
+        write_dataframe(conn, table, buckets, ROLLUP_COLUMNS, keys=["timestamp"], write_mode="upsert")
+
+def main(write_mode: Union[str, None] = None, download_workers: int = 8):
+    """
+    Function that rolls the new minutes of the feature store up into the 5 minute, 15 minute,
+    hourly and daily tables
+
+    Arguments
+    ---------
+    write_mode: str
+        "insert" recomputes the buckets from the watermark on, "upsert" from PSQL_UPSERT_LOOKBACK_MINUTES
+        before it; Defaults to the PSQL_WRITE_MODE variable
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    """
+    # Loading the settings once per process
+    config = get_config()
+
+    # Resolving the write mode
+    write_mode = get_write_mode(write_mode)
+
+    try:
+        # Reusing the cached container client
+        container_client = get_container_client()
+        get_connection_pool()
+        logging.info("The connection was successfull")
+    except:
+        logging.warn("The connection was not successfull")
+        return
+
+    # Borrowing a connection and returning it when the stage is done
+    with borrow_connection() as conn:
+        rollups = build_rollups(conn, container_client, config["aggregated_feature_path"], write_mode, download_workers)
+        if rollups is not None:
+            write_rollups(conn, rollups)
+
+if __name__ == '__main__':
+    main()
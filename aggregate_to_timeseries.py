@@ -1,23 +1,11 @@
-# Blob wrangling
-from azure.storage.blob import BlobServiceClient
-
-# Dotenv loading 
-from dotenv import load_dotenv
-
-# OS traversal 
-import os 
-
 # Date wrangling 
 import datetime
 
-# Input/output stream
-import io
-
 # Iteration tracking 
 from tqdm import tqdm
 
 # Importing blob functionalities
-from blobs import get_blob_names
+from blobs import get_new_feature_blobs, list_feature_blobs, download_blobs
 
 # Dataframes
 import pandas as pd 
@@ -25,8 +13,21 @@ import pandas as pd
 # Importing logging 
 import logging
 
-# PSQL connection 
-import psycopg2
+# Typehinting 
+from typing import Union, Iterable
+
+# Shared clients and connections
+from resources import get_config, get_container_client, get_connection_pool, borrow_connection
+
+# Parquet reading with column and row group pruning
+from feature_store import read_feature_partials, get_compacted_from, drop_compacted, drop_superseded
+from aggregation import MINUTE_KEYS, SOURCE_KEYS, PARTIAL_COLUMNS, merge_partials, partials_to_means
+
+# Bulk writing to PSQL
+from psql import get_write_mode, get_watermark, write_dataframe
+
+# Run metrics
+from metrics import timed
 
 # Defining the feature names 
 FEATURES = [
@@ -35,83 +36,125 @@ FEATURES = [
     'voltage'
 ]
 
-# Infering the current file directory 
-def main():
-    current_file_directory = os.path.dirname(os.path.abspath(__file__))
-
-    # Loading the .env file from the parent directory
-    load_dotenv(os.path.join(current_file_directory, ".env"))
-
-    # Extracting the connection string and the container name from the .env file 
-    connection_string = os.getenv("AZURE_BLOB_CONNECTION_STRING")
-    container_name = os.getenv("AZURE_BLOB_CONTAINER_NAME")
-
-    # Extrating the aggregated feature path 
-    aggregated_feature_path = os.getenv("AZURE_ML_DATASET_PATH")
-
-    # PSQL credentials
-    db_user = os.getenv('PSQL_USER', 'default_user')
-    db_pass = os.getenv('PSQL_PASSWORD', 'default_pass')
-    db_host = os.getenv('PSQL_HOST', 'localhost')
-    db_name = os.getenv('PSQL_DATABASE', 'default_db')
-    db_port = os.getenv('PSQL_PORT', '5432')
-
-    try:
-        # Creating the blob service client
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-
-        # Extracting the container client
-        container_client = blob_service_client.get_container_client(container_name)
-
-        # Printing that the connection was successfull
-        logging.info("The connection was successfull")
-
-    except: 
-        # Printing that the connection was not successfull 
-        logging.warn("The connection was not successfull")
-
-        return 
-    
-    # Connecting to psql
-    try:
-        conn = psycopg2.connect(user=db_user, password=db_pass, host=db_host, port=db_port, database=db_name)
-        cursor = conn.cursor()
-        logging.info("Connected to PSQL")
-    except:
-        logging.warn("Could not connect to PSQL")
-        return
-    
-    # Listing all the blobs in the container; 
-    all_blobs = container_client.list_blobs(name_starts_with=aggregated_feature_path)
-
-    # Extracting the blob names
-    blob_names = get_blob_names(all_blobs)
-
-    # Reading all the data in the blobs 
-    blob_data = pd.DataFrame({})
-    for blob_name in tqdm(blob_names):
-        # Downloading the blob
-        blob = container_client.download_blob(blob=blob_name)
-
+# Defining the columns of the electricity_timeseries table
+TIMESERIES_COLUMNS = ['timestamp', 'power_usage', 'current', 'voltage', 'created_datetime', 'updated_datetime']
+
+def read_minute_partials(
+        container_client, 
+        aggregated_feature_path: str, 
+        min_timestamp: Union[datetime.datetime, None], 
+        download_workers: int = 8, 
+        features: Union[pd.DataFrame, None] = None, 
+        exclude_blobs: Iterable[str] = ()
+    ) -> Union[pd.DataFrame, None]:
+    """
+    Reads the per minute sums and counts of the feature blobs after min_timestamp and merges them 
+    with the in memory features; Every capture blob is only counted in its latest run
+
+    Returns None if there are no feature blobs and no in memory features
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    min_timestamp: datetime
+        Only the minutes after it are read; If None, all the minutes are read
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    features: pd.DataFrame
+        Per minute sums and counts handed over in memory by the previous stage; They are combined 
+        with the feature blobs as if they were read from their blob
+    exclude_blobs: Iterable[str]
+        The feature blobs that hold the in memory features and are not read again
+    """
+    with timed("list_blobs") as counters:
+        # Listing only the day partitions that can hold minutes after the timestamp
+        all_blob_names = list_feature_blobs(container_client, aggregated_feature_path, min_timestamp)
+
+        # Leaving only the blobs whose date range in the name reaches past the timestamp
+        exclude_blobs = set(exclude_blobs)
+        blob_names = [blob_name for blob_name in get_new_feature_blobs(all_blob_names, min_timestamp) if blob_name not in exclude_blobs]
+        counters["blobs"] = len(blob_names)
+    logging.info(f"There are {len(blob_names)} feature blobs newer than {min_timestamp}")
+
+    # Downloading the blobs concurrently and reading their sums and counts
+    blob_data = {}
+    compacted_from = {}
+    for blob_name, blob in tqdm(download_blobs(container_client, blob_names, max_workers=download_workers), total=len(blob_names)):
         # Trying to read the blob
         try:
-            blob_data = pd.concat([blob_data, pd.read_parquet(io.BytesIO(blob.readall()))])
+            with timed("read_parquet", bytes=len(blob)) as counters:
+                blob_data[blob_name] = read_feature_partials(blob, blob_name, min_timestamp=min_timestamp)
+                compacted_from[blob_name] = get_compacted_from(blob)
+                counters["rows"] = blob_data[blob_name].shape[0]
         except:
             logging.warn(f"Could not read blob {blob_name}")
             continue
 
-    # Grouping by year, month, day, hour, minute and getting the mean of the features
-    blob_data = blob_data.groupby(['year', 'month', 'day', 'hour', 'minute'], as_index=False)[FEATURES].mean()
+    # Skipping the days that a compaction already merged but did not delete yet
+    blob_data = drop_compacted(blob_data, {blob_name: sources for blob_name, sources in compacted_from.items() if len(sources) > 0})
+
+    # Adding the in memory features 
+    if features is not None and features.shape[0] > 0:
+        blob_data.append(features[MINUTE_KEYS + SOURCE_KEYS + PARTIAL_COLUMNS])
+
+    # If there are no new blobs, then we can return
+    if len(blob_data) == 0:
+        return None
+
+    with timed("groupby") as counters:
+        # Leaving out the earlier runs of the capture blobs that were aggregated again and summing 
+        # the sums and counts of the same minute
+        partials = merge_partials([drop_superseded(pd.concat(blob_data, ignore_index=True))])
+        counters["rows"] = partials.shape[0]
+
+    return partials
+
+def build_timeseries(conn, container_client, aggregated_feature_path: str, write_mode: str, download_workers: int = 8, features: Union[pd.DataFrame, None] = None, exclude_blobs: Iterable[str] = ()) -> Union[pd.DataFrame, None]:
+    """
+    Reads the feature blobs newer than the watermark and creates the minutes to write to the electricity_timeseries table
+
+    Returns None if there are no new minutes
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    write_mode: str
+        "insert" or "upsert"
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    features: pd.DataFrame
+        Per minute sums and counts handed over in memory by the previous stage; They are combined 
+        with the feature blobs as if they were read from their blob
+    exclude_blobs: Iterable[str]
+        The feature blobs that hold the in memory features and are not read again
+    """
+    cursor = conn.cursor()
+
+    # Getting the max timestamp from the database table called "electricity_timeseries"
+    max_timestamp = get_watermark(cursor, "electricity_timeseries", write_mode)
+
+    # Reading the sums and counts of the minutes after the watermark
+    partials = read_minute_partials(container_client, aggregated_feature_path, max_timestamp, download_workers, features, exclude_blobs)
+    if partials is None:
+        logging.info("No new data to upload")
+        return None
+
+    # Dividing the sums by the counts
+    blob_data = partials_to_means(partials)
 
     # Creating the timestamp column 
     blob_data['timestamp'] = pd.to_datetime(blob_data[['year', 'month', 'day', 'hour', 'minute']])
 
     # dropping the year, month, day, hour and minute columns
     blob_data.drop(columns=['year', 'month', 'day', 'hour', 'minute'], inplace=True)
-
-    # Getting the max timestamp from the database table called "electricity_timeseries"
-    cursor.execute("SELECT MAX(timestamp) FROM electricity_timeseries")
-    max_timestamp = cursor.fetchone()[0]
     
     # If the timestamp is not null, then we need to filter the data
     if max_timestamp:
@@ -121,31 +164,87 @@ def main():
     # If there is no data, then we can return
     if blob_data.shape[0] == 0:
         logging.info("No new data to upload")
-        return
+        return None
+    
+    # Adding the creation and update datetimes
+    now = datetime.datetime.now()
+    blob_data['created_datetime'] = now
+    blob_data['updated_datetime'] = now
+
+    # Returning the minutes sorted by timestamp
+    return blob_data.sort_values('timestamp', ignore_index=True)
+
+def write_timeseries(conn, container_client, aggregated_feature_path: str, write_mode: str, download_workers: int = 8) -> Union[pd.DataFrame, None]:
+    """
+    Reads the feature blobs newer than the watermark and writes their minutes to the electricity_timeseries table
+
+    Returns the written minutes or None if there were none
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    write_mode: str
+        "insert" or "upsert"
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    """
+    # Creating the new minutes
+    timeseries = build_timeseries(conn, container_client, aggregated_feature_path, write_mode, download_workers)
+    if timeseries is None:
+        return None
+
+    # Writing the new rows to the database in bulk
+    write_dataframe(conn, "electricity_timeseries", timeseries, TIMESERIES_COLUMNS, keys=['timestamp'], write_mode=write_mode)
+
+    return timeseries
+
+def main(write_mode: Union[str, None] = None, download_workers: int = 8):
+    """
+    Function that reads the aggregated features and appends the new minutes to the electricity_timeseries table
+
+    Arguments
+    ---------
+    write_mode: str
+        "insert" appends the rows after the watermark, "upsert" reprocesses the last 
+        PSQL_UPSERT_LOOKBACK_MINUTES before it; Defaults to the PSQL_WRITE_MODE variable
+    download_workers: int
+        The number of threads downloading the feature blobs concurrently
+    """
+    # Loading the settings once per process
+    config = get_config()
+
+    # Resolving the write mode
+    write_mode = get_write_mode(write_mode)
+
+    try:
+        # Reusing the cached container client
+        container_client = get_container_client()
+
+        # Printing that the connection was successfull
+        logging.info("The connection was successfull")
+
+    except: 
+        # Printing that the connection was not successfull 
+        logging.warn("The connection was not successfull")
+
+        return 
     
-    # If the data is not null, we upload row by row the data to the database
-    for _, row in tqdm(blob_data.iterrows(), total=blob_data.shape[0], desc="Uploading data to PSQL"):
-        # Getting the current datetime 
-        now = datetime.datetime.now()
-
-        # Creating the upload values 
-        values = (
-            row['timestamp'], 
-            row['power_usage'], 
-            row['current'], 
-            row['voltage'], 
-            now, 
-            now
-        )
-
-        # Creating the query
-        query = f"INSERT INTO electricity_timeseries (timestamp, power_usage, current, voltage, created_datetime, updated_datetime) VALUES (%s, %s, %s, %s, %s, %s)"
-
-        # Executing the query
-        cursor.execute(query, values)
-
-    # Commiting the changes
-    conn.commit()
+    # Connecting to psql through the shared pool
+    try:
+        get_connection_pool()
+        logging.info("Connected to PSQL")
+    except:
+        logging.warn("Could not connect to PSQL")
+        return
+
+    # Borrowing a connection and returning it when the stage is done
+    with borrow_connection() as conn:
+        write_timeseries(conn, container_client, config["aggregated_feature_path"], write_mode, download_workers)
 
 if __name__ == '__main__': 
     main()
\ No newline at end of file
@@ -0,0 +1,195 @@
+# Dataframes
+import pandas as pd 
+
+# Array math 
+import numpy as np
+
+# Typehinting 
+from typing import List
+
+# Defining the columns that identify a minute bucket 
+MINUTE_KEYS = ["year", "month", "day", "hour", "minute"]
+
+# Defining the columns that identify the capture blob and the run every row of partials was aggregated from
+SOURCE_KEYS = ["source_blob", "source_run"]
+
+# Defining the aggregated variables 
+VARIABLES = ["power_usage", "voltage", "current"]
+
+# Defining the mergeable statistics of every variable and how partials of the same minute are merged; 
+# The count of a variable only counts the readings that hold it
+STATISTICS = {"sum": "sum", "sumsq": "sum", "min": "min", "max": "max", "count": "sum"}
+
+# Defining the columns of the partial aggregates besides the minute keys 
+PARTIAL_COLUMNS = [f"{variable}_{statistic}" for variable in VARIABLES for statistic in STATISTICS] + ["count"]
+
+# Defining how every partial column is merged
+MERGE_FUNCTIONS = {**{f"{variable}_{statistic}": function for variable in VARIABLES for statistic, function in STATISTICS.items()}, "count": "sum"}
+
+def aggregate_partials(features: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduces a batch of feature rows to the partial aggregates per minute 
+
+    The partial aggregates hold the count of the readings and the sum, the sum of squares, the 
+    minimum, the maximum and the count of each variable, so partials of different batches can be 
+    merged without keeping the raw readings; A missing value only leaves out that variable of the reading
+
+    Arguments
+    ---------
+    features: pd.DataFrame
+        Dataframe with the minute keys and the variables, one row per reading
+    """
+    # Returning an empty frame with the partial columns if there are no readings
+    if features.shape[0] == 0:
+        return pd.DataFrame(columns=MINUTE_KEYS + PARTIAL_COLUMNS)
+
+    # Summing the variables and their squares with the compensated summation of the pandas groupby, 
+    # so the means match groupby().mean() of the readings exactly; The groups come sorted by the minute
+    squares = {f"{variable}_sumsq": features[variable].to_numpy(dtype=np.float64) ** 2 for variable in VARIABLES}
+    sums = features[MINUTE_KEYS + VARIABLES].assign(**squares).groupby(MINUTE_KEYS, sort=True).sum()
+
+    # Sorting the readings by their minute, in the order of the groups
+    keys = features[MINUTE_KEYS].to_numpy(dtype=np.int64)
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+
+    # Finding the first reading of every minute
+    starts = np.flatnonzero(np.concatenate([[True], (keys[1:] != keys[:-1]).any(axis=1)]))
+
+    # Reducing the minimums, maximums and counts of the sorted arrays directly, which is much faster 
+    # than adding them to the groupby; fmin and fmax skip the missing values like the groupby sums do
+    columns = {key: keys[starts, index] for index, key in enumerate(MINUTE_KEYS)}
+    for variable in VARIABLES:
+        values = features[variable].to_numpy(dtype=np.float64)[order]
+        columns[f"{variable}_sum"] = sums[variable].to_numpy()
+        columns[f"{variable}_sumsq"] = sums[f"{variable}_sumsq"].to_numpy()
+        columns[f"{variable}_min"] = np.fmin.reduceat(values, starts)
+        columns[f"{variable}_max"] = np.fmax.reduceat(values, starts)
+        columns[f"{variable}_count"] = np.add.reduceat(~np.isnan(values), starts, dtype=np.int64)
+    columns["count"] = np.diff(np.append(starts, len(keys)))
+
+    # Returning the partial aggregates
+    return pd.DataFrame(columns)
+
+def merge_partials(partials: List[pd.DataFrame], keys: List[str] = MINUTE_KEYS) -> pd.DataFrame:
+    """
+    Merges a list of partial aggregates into one partial aggregate with one row per minute
+
+    Counts, sums and sums of squares are added up, minimums and maximums are reduced; A statistic 
+    that is missing in one of the merged partials (files written before it existed) stays missing 
+    instead of silently covering only part of the readings. The minimum and maximum of a variable 
+    without readings in a partial are not missing, there is just nothing to reduce
+
+    Arguments
+    ---------
+    partials: list
+        List of partial aggregate dataframes created by aggregate_partials
+    keys: list
+        The columns of the merged buckets
+    """
+    # Concatenating the partials
+    merged = pd.concat(partials, ignore_index=True)
+    for column in PARTIAL_COLUMNS:
+        if column not in merged.columns:
+            merged[column] = float("nan")
+
+    # Merging the statistics of the same minute
+    grouped = merged.groupby(keys)
+    result = grouped.agg(MERGE_FUNCTIONS)
+
+    # Invalidating the statistics that were missing in some of the partials
+    present = merged[PARTIAL_COLUMNS].notna()
+    for variable in VARIABLES:
+        empty = merged[f"{variable}_count"].eq(0)
+        present[f"{variable}_min"] |= empty
+        present[f"{variable}_max"] |= empty
+    complete = present.groupby([merged[key] for key in keys]).all()
+    result = result.where(complete)
+
+    # Returning the merged partials
+    return result.reset_index()[keys + PARTIAL_COLUMNS]
+
+def rollup_partials(partials: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """
+    Merges the per minute partial aggregates into buckets of the given number of minutes, 
+    e.g. 5, 15, 60 or 1440 for days; The minute keys of a bucket are the ones of its first minute
+
+    Arguments
+    ---------
+    partials: pd.DataFrame
+        Partial aggregate dataframe with one row per minute
+    minutes: int
+        The length of the buckets in minutes
+    """
+    bucket = pd.to_datetime(partials[MINUTE_KEYS]).dt.floor(f"{minutes}min")
+    partials = partials.copy()
+    partials["year"] = bucket.dt.year
+    partials["month"] = bucket.dt.month
+    partials["day"] = bucket.dt.day
+    partials["hour"] = bucket.dt.hour
+    partials["minute"] = bucket.dt.minute
+
+    return merge_partials([partials])
+
+def partials_to_means(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the partial aggregates to the per minute means of the variables
+
+    Arguments
+    ---------
+    partials: pd.DataFrame
+        Partial aggregate dataframe with one row per minute
+    """
+    # Copying the minute keys
+    means = partials[MINUTE_KEYS].copy()
+
+    # Dividing the sums by the counts of the variables
+    for variable in VARIABLES:
+        means[variable] = partials[f"{variable}_sum"] / partials[f"{variable}_count"]
+
+    # Returning the means sorted by the minute
+    return means.sort_values(MINUTE_KEYS).reset_index(drop=True)
+
+def add_means(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the per minute means of the variables to the partial aggregates, keeping the sums and 
+    the counts so the result can still be merged with other partials
+
+    Arguments
+    ---------
+    partials: pd.DataFrame
+        Partial aggregate dataframe with one row per minute
+    """
+    partials = partials.sort_values(MINUTE_KEYS).reset_index(drop=True)
+    for variable in VARIABLES:
+        partials[variable] = partials[f"{variable}_sum"] / partials[f"{variable}_count"]
+
+    # Returning the partials with the means
+    return partials
+
+def partials_to_statistics(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the partial aggregates to the count and the mean, standard deviation, minimum and 
+    maximum of every variable
+
+    The standard deviation is the sample standard deviation; It is missing for buckets with one reading 
+    of the variable. The count is the number of readings, also the ones missing some variables
+
+    Arguments
+    ---------
+    partials: pd.DataFrame
+        Partial aggregate dataframe with one row per bucket
+    """
+    statistics = partials[MINUTE_KEYS + ["count"]].copy()
+    for variable in VARIABLES:
+        count = partials[f"{variable}_count"]
+        mean = partials[f"{variable}_sum"] / count
+        variance = (partials[f"{variable}_sumsq"] - count * mean * mean) / (count - 1)
+
+        statistics[f"{variable}_mean"] = mean
+        statistics[f"{variable}_std"] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        statistics[f"{variable}_min"] = partials[f"{variable}_min"]
+        statistics[f"{variable}_max"] = partials[f"{variable}_max"]
+
+    # Returning the statistics sorted by the bucket
+    return statistics.sort_values(MINUTE_KEYS).reset_index(drop=True)
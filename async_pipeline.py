@@ -0,0 +1,616 @@
+# Event loop
+import asyncio
+
+# OS traversal
+import os
+
+# Input/output stream
+import io
+
+# Json serialization
+import json
+
+# Date wrangling
+import datetime
+
+# Importing logging
+import logging
+
+# Queue of the pending blobs
+from collections import deque
+
+# Typehinting
+from typing import Any, Awaitable, Dict, List, Tuple, Union
+
+# Dataframes
+import pandas as pd
+
+# Async blob wrangling and PSQL driver
+from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+from azure.core.exceptions import ResourceNotFoundError
+import asyncpg
+
+# Shared clients and connections
+from resources import get_config, get_container_client, get_connection_pool, borrow_connection
+
+# Importing blob functionalities
+from blobs import BlobStream, get_delta_prefixes, get_delta_blobs, get_blob_names
+
+# Importing the manifest of the processed blobs
+from manifest import DEFAULT_MANIFEST_PATH, get_unprocessed_blobs, update_manifest
+
+# The stages
+from aggregate_features import CAPTURE_ROOT, aggregate_capture_stream, take_cached_partials, combine_blob_partials, get_source_run
+from aggregation import add_means
+from blob_cache import PartialsCache, get_partials_cache
+from feature_store import write_features_parquet, split_feature_files
+from compact_features import compact_features
+from aggregate_to_timeseries import build_timeseries, TIMESERIES_COLUMNS
+from aggregate_to_rollups import build_rollups, ROLLUP_COLUMNS
+from aggregate_to_power_consumption import build_power_consumption, POWER_CONSUMPTION_COLUMNS
+from create_analysis_data import write_analysis_data, DEFAULT_CHUNK_SIZE
+from pipeline import Stage, sort_stages, resolve_modes, write_sql_power_consumption
+
+# Bulk writing to PSQL
+from psql import DEFAULT_BATCH_SIZE, require_unique_index
+
+# Run metrics
+import metrics
+
+class AsyncPipelineRun:
+    """
+    Holds the in memory values and the pending durable writes of one run of the async pipeline;
+    The writes are asyncio tasks, so they overlap with each other and with the next stages
+    """
+    def __init__(self):
+        self.values = {}
+        self.writes = {}
+
+    def put(self, name: str, value: Any) -> None:
+        """
+        Hands a value over to the downstream stages
+        """
+        self.values[name] = value
+
+    def submit_write(self, name: str, write: Awaitable) -> asyncio.Task:
+        """
+        Starts a durable write in the background; The task reports under the stage that started it
+        """
+        logging.info(f"Started the write {name}")
+        self.writes[name] = asyncio.ensure_future(write)
+        return self.writes[name]
+
+    async def get(self, name: str) -> Any:
+        """
+        Returns an in memory value or waits for a durable write and returns its result;
+        A failed write raises its exception
+        """
+        if name in self.values:
+            return self.values[name]
+
+        # Reporting how long the stage was blocked by the write
+        with metrics.timed(f"wait_{name}"):
+            return await self.writes[name]
+
+    async def wait(self) -> None:
+        """
+        Waits for all the durable writes and raises the first failure
+        """
+        results = await asyncio.gather(*self.writes.values(), return_exceptions=True)
+        errors = []
+        for name, result in zip(self.writes, results):
+            if isinstance(result, BaseException):
+                logging.error(f"The write {name} failed: {result}")
+                errors.append(result)
+            else:
+                logging.info(f"Finished the write {name}")
+        if len(errors) > 0:
+            raise errors[0]
+
+async def run_stages_async(stages: List[Stage]) -> Dict[str, Any]:
+    """
+    Runs the coroutines of the stages one after the other while their durable writes run
+    as tasks; Returns the in memory values of the run
+
+    Arguments
+    ---------
+    stages: List[Stage]
+        The stages of the pipeline; Their run is a coroutine function taking the AsyncPipelineRun
+    """
+    run = AsyncPipelineRun()
+    try:
+        for stage in sort_stages(stages):
+            logging.info(f"Running the stage {stage.name}")
+            with metrics.stage(stage.name):
+                await stage.run(run)
+
+            # Every declared output has to be handed over
+            missing = [output for output in stage.outputs if output not in run.values and output not in run.writes]
+            if len(missing) > 0:
+                raise ValueError(f"The stage {stage.name} did not produce {missing}")
+    except BaseException:
+        # Letting the started writes finish; Their failures are only logged, so the failure of the stage is raised
+        try:
+            await run.wait()
+        except Exception:
+            pass
+        raise
+
+    # Waiting for the writes; The first failed write fails the run
+    await run.wait()
+
+    return run.values
+
+async def list_delta_blobs_async(container_client, root: str, delta_hours: Union[int, None], concurrency: int) -> list:
+    """
+    Lists the blobs of the window like blobs.list_delta_blobs, but lists the day and hour
+    folders of all the partitions concurrently
+
+    Arguments
+    ---------
+    container_client: azure.storage.blob.aio.ContainerClient
+        The async container client of the capture container
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    delta_hours: int
+        The number of hours to look back in time; If None, all the blobs are listed
+    concurrency: int
+        The maximum number of concurrent listings
+    """
+    with metrics.timed("list_blobs") as counters:
+        if delta_hours is None:
+            # Listing the whole history
+            blobs = [blob async for blob in container_client.list_blobs(name_starts_with=root)]
+            counters["blobs"] = len(blobs)
+            return blobs
+
+        # Fixing the current date so the prefixes and the filter use the same window
+        current_date = datetime.datetime.now()
+
+        # Walking the event hub folders and then the partition folders
+        partition_prefixes = []
+        async for hub in container_client.walk_blobs(name_starts_with=root, delimiter="/"):
+            async for partition in container_client.walk_blobs(name_starts_with=hub.name, delimiter="/"):
+                partition_prefixes.append(partition.name)
+
+        # Listing the prefixes of the window concurrently
+        semaphore = asyncio.Semaphore(concurrency)
+        async def list_prefix(prefix: str) -> list:
+            async with semaphore:
+                return [blob async for blob in container_client.list_blobs(name_starts_with=prefix)]
+        listings = await asyncio.gather(*[list_prefix(prefix) for prefix in get_delta_prefixes(partition_prefixes, delta_hours, current_date)])
+        blobs = [blob for listing in listings for blob in listing]
+
+        # Filtering the edges of the window exactly
+        delta_blob_names = set(get_delta_blobs(get_blob_names(blobs), delta_hours, current_date))
+        blobs = [blob for blob in blobs if blob.name in delta_blob_names]
+        counters["blobs"] = len(blobs)
+        return blobs
+
+async def load_manifest_async(container_client, manifest_path: str) -> dict:
+    """
+    Loads the manifest of the processed blobs like manifest.load_manifest with the async client
+    """
+    try:
+        downloader = await container_client.download_blob(manifest_path)
+        manifest = json.loads(await downloader.readall())
+    except ResourceNotFoundError:
+        logging.info(f"No manifest found at {manifest_path}; Processing all the blobs")
+        return {}
+
+    return manifest.get("blobs", {})
+
+class AsyncBlobStream(BlobStream):
+    """
+    Read only file object over the chunks of an async blob download, for a reader running in a
+    thread; Every chunk is awaited on the event loop of the download, so the blob is decoded while
+    it downloads without being buffered whole
+
+    Arguments
+    ---------
+    downloader: azure.storage.blob.aio.StorageStreamDownloader
+        The downloader returned by the async download_blob
+    loop: asyncio.AbstractEventLoop
+        The event loop of the download
+    """
+    def __init__(self, downloader, loop: asyncio.AbstractEventLoop):
+        # The chunks of an async download are an async iterator, so the sync one is not created
+        io.RawIOBase.__init__(self)
+        self._chunks = downloader.chunks()
+        self._chunk = memoryview(b"")
+        self.bytes_read = 0
+        self.download_seconds = 0.0
+        self._loop = loop
+
+    def next_chunk(self) -> Union[bytes, None]:
+        """
+        Waits for the next chunk of the download on the event loop; None once the download is consumed
+        """
+        try:
+            return asyncio.run_coroutine_threadsafe(self._chunks.__anext__(), self._loop).result()
+        except StopAsyncIteration:
+            return None
+
+async def aggregate_blobs_async(
+        container_client,
+        blob_names: list,
+        concurrency: int,
+        etags: Union[Dict[str, str], None] = None,
+        cache: Union[PartialsCache, None] = None,
+        source_run: Union[str, None] = None
+    ) -> Tuple[Union[pd.DataFrame, None], int]:
+    """
+    Downloads the capture blobs with the async client and reduces them to per minute sums and counts
+    like aggregate_features.aggregate_blobs; The downloads run concurrently on the event loop and the
+    arrow decoding of their streams runs in threads
+
+    The partials of every blob are kept apart and sorted like the ones of aggregate_blobs, so they 
+    do not depend on the order in which the downloads finish
+
+    Arguments
+    ---------
+    container_client: azure.storage.blob.aio.ContainerClient
+        The async container client of the capture container
+    blob_names: list
+        The names of the capture blobs
+    concurrency: int
+        The maximum number of blobs downloaded or decoded at the same time
+    etags: Dict[str, str]
+        The etag of every blob name; The blobs without an etag are never cached
+    cache: PartialsCache
+        The local cache of the partials of every blob version
+    source_run: str
+        The run stamp the rows are marked with; Defaults to now
+    """
+    partials, skipped_records = {}, 0
+
+    # Taking the partials of the unchanged blobs from the local cache
+    etags = etags or {}
+    if cache is not None:
+        partials, skipped_records, blob_names = await asyncio.to_thread(take_cached_partials, cache, blob_names, etags)
+
+    # Defining the decoding of a blob while it downloads; Runs in a thread
+    def decode(blob_name: str, stream: AsyncBlobStream) -> Tuple[pd.DataFrame, int]:
+        blob_partials, skipped = aggregate_capture_stream(stream)
+        if cache is not None:
+            with metrics.timed("cache_put"):
+                cache.put(blob_name, etags.get(blob_name), blob_partials, skipped)
+        return blob_partials, skipped
+
+    loop = asyncio.get_running_loop()
+    async def process(blob_name: str) -> Tuple[pd.DataFrame, int]:
+        with metrics.timed("download", blobs=1):
+            downloader = await container_client.download_blob(blob_name)
+        return await asyncio.to_thread(decode, blob_name, AsyncBlobStream(downloader, loop))
+
+    async def consume(blob_name: str, task: asyncio.Task) -> None:
+        nonlocal skipped_records
+        partials[blob_name], skipped = await task
+        skipped_records += skipped
+
+    # Keeping at most concurrency blobs in flight and consuming them in submission order
+    pending = deque()
+    try:
+        for blob_name in blob_names:
+            pending.append((blob_name, asyncio.ensure_future(process(blob_name))))
+            if len(pending) >= max(1, concurrency):
+                await consume(*pending.popleft())
+        while pending:
+            await consume(*pending.popleft())
+    finally:
+        # Cancelling the blobs still in flight if one of them failed
+        for _, task in pending:
+            task.cancel()
+
+    # If there are no blobs, there is nothing to aggregate
+    if len(partials) == 0:
+        return None, skipped_records
+
+    with metrics.timed("groupby"):
+        return await asyncio.to_thread(combine_blob_partials, partials, source_run or get_source_run()), skipped_records
+
+async def upload_features_async(container_client, feature_files: Dict[str, pd.DataFrame], manifest_path: str, manifest: dict) -> None:
+    """
+    Uploads the feature files concurrently like aggregate_features.upload_features and then saves the manifest
+    """
+    async def upload(feature_blob_name: str, features: pd.DataFrame) -> None:
+        with metrics.timed("write_parquet", rows=features.shape[0]) as counters:
+            data = await asyncio.to_thread(write_features_parquet, features)
+            counters["bytes"] = len(data)
+        with metrics.timed("upload", bytes=len(data)):
+            await container_client.upload_blob(name=feature_blob_name, data=data)
+
+    await asyncio.gather(*[upload(name, features) for name, features in feature_files.items()])
+
+    # Marking the blobs as processed only after the uploads succeeded
+    with metrics.timed("save_manifest"):
+        await container_client.upload_blob(name=manifest_path, data=json.dumps({"blobs": manifest}), overwrite=True)
+
+def quote_identifier(name: str) -> str:
+    """
+    Quotes a table or column name for PSQL
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+def require_unique_index_pooled(table: str, keys: list) -> None:
+    """
+    Checks the conflict target of the upserts through a pooled psycopg2 connection
+    """
+    with borrow_connection() as conn:
+        require_unique_index(conn, table, keys)
+
+async def write_dataframe_async(
+        pool: asyncpg.Pool,
+        table: str,
+        df: pd.DataFrame,
+        columns: list,
+        keys: list,
+        write_mode: str,
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> int:
+    """
+    Writes the dataframe like psql.write_dataframe with the async driver: binary COPY in "insert" mode,
+    COPY into a staging table merged with ON CONFLICT DO UPDATE in "upsert" mode; Every batch is
+    written in its own transaction
+
+    Arguments
+    ---------
+    pool: asyncpg.Pool
+        The async connection pool
+    table: str
+        The name of the table
+    df: pd.DataFrame
+        The dataframe to write
+    columns: list
+        The columns of the dataframe to write
+    keys: list
+        The columns that identify a row, used in "upsert" mode
+    write_mode: str
+        Either "insert" or "upsert"
+    batch_size: int
+        The number of rows written per transaction
+    """
+    # Missing values are written as NULL
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+
+    # Composing the statements of the upsert
+    column_list = ", ".join(quote_identifier(column) for column in columns)
+    key_list = ", ".join(quote_identifier(key) for key in keys)
+    staging = f"{table}_staging"
+    update_columns = [column for column in columns if column not in keys and column != "created_datetime"]
+    action = "UPDATE SET " + ", ".join(f"{quote_identifier(column)} = EXCLUDED.{quote_identifier(column)}" for column in update_columns) if update_columns else "NOTHING"
+
+    # Making sure the conflict target exists; It is built once by migrate.py
+    if write_mode == "upsert":
+        await asyncio.to_thread(require_unique_index_pooled, table, keys)
+
+    rows_written = 0
+    with metrics.timed(f"write_{table}") as counters:
+        async with pool.acquire() as conn:
+            for start in range(0, values.shape[0], batch_size):
+                records = list(values.iloc[start:start + batch_size].itertuples(index=False, name=None))
+                async with conn.transaction():
+                    if write_mode == "upsert":
+                        await conn.execute(f"CREATE TEMP TABLE {quote_identifier(staging)} ON COMMIT DROP AS SELECT {column_list} FROM {quote_identifier(table)} WITH NO DATA")
+                        await conn.copy_records_to_table(staging, records=records, columns=columns)
+                        await conn.execute(f"""
+                            INSERT INTO {quote_identifier(table)} ({column_list})
+                            SELECT DISTINCT ON ({key_list}) {column_list} FROM {quote_identifier(staging)} ORDER BY {key_list}
+                            ON CONFLICT ({key_list}) DO {action}
+                        """)
+                    else:
+                        await conn.copy_records_to_table(table, records=records, columns=columns)
+                rows_written += len(records)
+                logging.info(f"Wrote {rows_written}/{values.shape[0]} rows into {table}")
+        counters["rows"] = rows_written
+
+    return rows_written
+
+def build_async_stages(
+        container_client,
+        sync_container_client,
+        pool: asyncpg.Pool,
+        aggregated_feature_path: str,
+        delta_hours: Union[int, None],
+        write_mode: str,
+        engine: str,
+        mode: str,
+        blob_concurrency: int,
+        download_workers: int = 8,
+        full_backfill: bool = False,
+        manifest_path: str = DEFAULT_MANIFEST_PATH,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> List[Stage]:
+    """
+    Creates the stages of the electricity pipeline for the event loop
+
+    The capture listing, the downloads, the feature uploads and the electricity_timeseries, rollup
+    and power_consumption writes use the async clients and overlap with each other and with the next
+    stages; The pandas computations and the reads of the stage functions run in threads with the
+    pooled psycopg2 connections, so the stages compute exactly what the threaded pipeline does
+    """
+    async def features_stage(run: AsyncPipelineRun):
+        listed_blobs = await list_delta_blobs_async(container_client, CAPTURE_ROOT, delta_hours, blob_concurrency)
+        manifest = {} if full_backfill else await load_manifest_async(container_client, manifest_path)
+        delta_blobs = get_unprocessed_blobs(listed_blobs, manifest)
+        logging.info(f"There are {len(delta_blobs)} blobs to aggregate")
+
+        etags = {blob.name: blob.etag for blob in delta_blobs}
+        partials, skipped_records = await aggregate_blobs_async(container_client, get_blob_names(delta_blobs), blob_concurrency, etags, get_partials_cache())
+        if skipped_records > 0:
+            logging.warning(f"Skipped {skipped_records} records that could not be parsed")
+
+        features, feature_files = None, {}
+        if partials is not None:
+            with metrics.timed("groupby") as counters:
+                features = await asyncio.to_thread(add_means, partials)
+                counters["rows"] = features.shape[0]
+            feature_files = split_feature_files(aggregated_feature_path, features)
+            run.submit_write("feature_blob", upload_features_async(container_client, feature_files, manifest_path, update_manifest(manifest, delta_blobs, listed_blobs)))
+        else:
+            logging.info("No new blobs to aggregate")
+            run.put("feature_blob", None)
+        run.put("features", features)
+        run.put("feature_blob_names", list(feature_files))
+
+    def build_timeseries_pooled(features, exclude_blobs):
+        with borrow_connection() as conn:
+            return build_timeseries(conn, sync_container_client, aggregated_feature_path, write_mode, download_workers, features=features, exclude_blobs=exclude_blobs)
+
+    async def timeseries_stage(run: AsyncPipelineRun):
+        timeseries = await asyncio.to_thread(build_timeseries_pooled, await run.get("features"), await run.get("feature_blob_names"))
+        if timeseries is not None:
+            run.submit_write("electricity_timeseries", write_dataframe_async(pool, "electricity_timeseries", timeseries, TIMESERIES_COLUMNS, ["timestamp"], write_mode))
+        else:
+            run.put("electricity_timeseries", None)
+        run.put("timeseries", timeseries)
+
+    def build_rollups_pooled(features, exclude_blobs):
+        with borrow_connection() as conn:
+            return build_rollups(conn, sync_container_client, aggregated_feature_path, write_mode, download_workers, features=features, exclude_blobs=exclude_blobs)
+
+    async def write_rollups_async(rollups: Dict[str, pd.DataFrame]) -> None:
+        # The buckets are recomputed, so they are always upserted
+        await asyncio.gather(*[
+            write_dataframe_async(pool, table, buckets, ROLLUP_COLUMNS, ["timestamp"], "upsert") for table, buckets in rollups.items()
+        ])
+
+    async def rollup_stage(run: AsyncPipelineRun):
+        rollups = await asyncio.to_thread(build_rollups_pooled, await run.get("features"), await run.get("feature_blob_names"))
+        if rollups is not None:
+            run.submit_write("rollup_tables", write_rollups_async(rollups))
+        else:
+            run.put("rollup_tables", None)
+        run.put("rollups", rollups)
+
+    async def compaction_stage(run: AsyncPipelineRun):
+        # Merging the files of the days the run wrote to, once they are uploaded
+        await run.get("feature_blob")
+        days = None if delta_hours is None else delta_hours // 24 + 1
+        run.submit_write("compacted_features", asyncio.to_thread(compact_features, sync_container_client, aggregated_feature_path, days, download_workers=download_workers))
+
+    def build_power_consumption_pooled(timeseries):
+        with borrow_connection() as conn:
+            return build_power_consumption(conn, write_mode, timeseries=timeseries)
+
+    async def power_consumption_stage(run: AsyncPipelineRun):
+        # The sql engine reads the minutes from the table, so their write has to finish first
+        if engine == "sql":
+            await run.get("electricity_timeseries")
+            run.submit_write("power_consumption", asyncio.to_thread(write_sql_power_consumption, write_mode))
+            return
+
+        power_consumption = await asyncio.to_thread(build_power_consumption_pooled, await run.get("timeseries"))
+
+        # The sums follow the minutes, so they are only written once the minutes are; A failed write stops the stage
+        await run.get("electricity_timeseries")
+        if power_consumption is not None:
+            run.submit_write("power_consumption", write_dataframe_async(pool, "power_consumption", power_consumption, POWER_CONSUMPTION_COLUMNS, ["timestamp"], write_mode))
+        else:
+            run.put("power_consumption", None)
+
+    def write_analysis_data_pooled():
+        with borrow_connection() as conn:
+            write_analysis_data(conn, write_mode, mode, chunk_size)
+
+    async def analysis_stage(run: AsyncPipelineRun):
+        # The join reads both tables, so the power_consumption write has to finish first
+        await run.get("power_consumption")
+        await asyncio.to_thread(write_analysis_data_pooled)
+
+    return [
+        Stage("aggregate_features", features_stage, outputs=["features", "feature_blob_names", "feature_blob"]),
+        Stage("aggregate_to_timeseries", timeseries_stage, inputs=["features", "feature_blob_names"], outputs=["timeseries", "electricity_timeseries"]),
+        Stage("aggregate_to_rollups", rollup_stage, inputs=["features", "feature_blob_names"], outputs=["rollups", "rollup_tables"]),
+        Stage("compact_features", compaction_stage, inputs=["feature_blob", "timeseries", "rollups"], outputs=["compacted_features"]),
+        Stage(
+            "aggregate_to_power_consumption",
+            power_consumption_stage,
+            inputs=["electricity_timeseries"] if engine == "sql" else ["timeseries", "electricity_timeseries"],
+            outputs=["power_consumption"]
+        ),
+        Stage("create_analysis_data", analysis_stage, inputs=["power_consumption"]),
+    ]
+
+async def main_async(
+        delta_hours: Union[int, None],
+        write_mode: Union[str, None] = None,
+        engine: Union[str, None] = None,
+        mode: Union[str, None] = None,
+        download_workers: int = 8,
+        full_backfill: bool = False
+    ) -> None:
+    """
+    Runs the pipeline on the event loop with the async blob client and the async PSQL driver
+
+    The number of concurrent blob requests and PSQL writes are set with the ASYNC_BLOB_CONCURRENCY
+    and ASYNC_PSQL_CONCURRENCY app settings
+
+    Arguments
+    ---------
+    delta_hours: int
+        The number of hours to look back in time to aggregate the features
+    write_mode: str
+        "insert" or "upsert"; Defaults to the PSQL_WRITE_MODE variable
+    engine: str
+        The power consumption engine; Defaults to the POWER_CONSUMPTION_ENGINE variable or "pandas"
+    mode: str
+        The analysis data mode; Defaults to the ANALYSIS_DATA_MODE variable or "memory"
+    download_workers: int
+        The number of threads reading the feature files in the timeseries and compaction stages
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored and every blob in the window is processed
+    """
+    # Loading the settings once per process
+    config = get_config()
+    write_mode, engine, mode = resolve_modes(write_mode, engine, mode)
+
+    # Connecting to the blob storage and psql; The async clients belong to the event loop of the run
+    try:
+        sync_container_client = get_container_client()
+        get_connection_pool()
+        container_client = AsyncContainerClient.from_connection_string(config["connection_string"], config["container_name"])
+    except:
+        logging.warn("The connection was not successfull")
+        return
+
+    # Closing the async blob client even if the PSQL pool cannot be created
+    try:
+        try:
+            pool = await asyncpg.create_pool(min_size=1, max_size=config["async_psql_concurrency"], **{**config["psql"], "port": int(config["psql"]["port"])})
+            logging.info("The connection was successfull")
+        except:
+            logging.warn("The connection was not successfull")
+            return
+
+        stages = build_async_stages(
+            container_client,
+            sync_container_client,
+            pool,
+            config["aggregated_feature_path"],
+            delta_hours,
+            write_mode,
+            engine,
+            mode,
+            config["async_blob_concurrency"],
+            download_workers=download_workers,
+            full_backfill=full_backfill,
+            manifest_path=os.getenv("AZURE_MANIFEST_PATH", DEFAULT_MANIFEST_PATH),
+        )
+        metrics.start_run()
+        try:
+            await run_stages_async(stages)
+        finally:
+            # Logging and uploading the run report even if a stage failed
+            metrics.finish_run(sync_container_client, config["metrics_report_path"])
+            await pool.close()
+    finally:
+        await container_client.close()
+
+    logging.info("The async pipeline was successfull")
+
+def main(delta_hours: Union[int, None], **kwargs) -> None:
+    """
+    Runs the async pipeline on a new event loop; Takes the arguments of main_async
+    """
+    asyncio.run(main_async(delta_hours, **kwargs))
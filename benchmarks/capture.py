@@ -0,0 +1,148 @@
+# Arg parsing
+import argparse
+
+# Date wrangling
+import datetime
+
+# Input/output stream
+import io
+
+# Body serialization
+import json
+
+# Typehinting
+from typing import Union
+
+# Array math
+import numpy as np
+
+# Avro writing
+import fastavro
+
+# Importing the in-memory container
+from benchmarks.fakes import FakeContainerClient
+
+# Defining the schema of the Event Hubs capture avro files
+CAPTURE_SCHEMA = fastavro.parse_schema({
+    "type": "record",
+    "name": "EventData",
+    "namespace": "Microsoft.ServiceBus.Messaging",
+    "fields": [
+        {"name": "SequenceNumber", "type": "long"},
+        {"name": "Offset", "type": "string"},
+        {"name": "EnqueuedTimeUtc", "type": "string"},
+        {"name": "SystemProperties", "type": {"type": "map", "values": ["long", "double", "string", "bytes"]}},
+        {"name": "Properties", "type": {"type": "map", "values": ["long", "double", "string", "bytes", "null"]}},
+        {"name": "Body", "type": ["null", "bytes"]},
+    ],
+})
+
+# Defining the date format of the EnqueuedTimeUtc field
+ENQUEUED_TIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+
+def create_capture_records(start: datetime.datetime, capture_minutes: int, readings_per_minute: int, rng: np.random.Generator, sequence_number: int = 0) -> list:
+    """
+    Creates the records of one capture file; Every record is a reading of the meter with a json body
+
+    Arguments
+    ---------
+    start: datetime.datetime
+        The start of the capture window
+    capture_minutes: int
+        The capture window of the event hub in minutes
+    readings_per_minute: int
+        The number of meter readings per minute
+    rng: np.random.Generator
+        The random generator of the readings
+    sequence_number: int
+        The sequence number of the first record
+    """
+    readings = capture_minutes * readings_per_minute
+    offsets = np.arange(readings) * 60.0 / readings_per_minute
+    power_usage = rng.random(readings) * 10
+    voltage = 230 + rng.random(readings)
+    current = rng.random(readings) * 5
+
+    records = []
+    for i in range(readings):
+        timestamp = start + datetime.timedelta(seconds=float(offsets[i]))
+        body = {
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "power_usage": float(power_usage[i]),
+            "voltage": float(voltage[i]),
+            "current": float(current[i]),
+        }
+        records.append({
+            "SequenceNumber": sequence_number + i,
+            "Offset": str(sequence_number + i),
+            "EnqueuedTimeUtc": timestamp.strftime(ENQUEUED_TIME_FORMAT),
+            "SystemProperties": {},
+            "Properties": {},
+            "Body": json.dumps(body).encode("utf-8"),
+        })
+
+    return records
+
+def create_capture_blobs(
+        container_client: FakeContainerClient,
+        root: str,
+        days: float,
+        partitions: int = 2,
+        readings_per_minute: int = 6,
+        capture_minutes: int = 5,
+        end: Union[datetime.datetime, None] = None,
+        seed: int = 0
+    ) -> int:
+    """
+    Fills the container with synthetic Event Hubs capture files of the last days, in the
+    <root><hub>/<partition>/YYYY/MM/DD/HH/MM/SS.avro layout; Returns the number of records
+
+    Arguments
+    ---------
+    container_client: FakeContainerClient
+        The in-memory container
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    days: float
+        The number of days of history
+    partitions: int
+        The number of event hub partitions; Every partition receives its own readings
+    readings_per_minute: int
+        The number of meter readings per minute and partition
+    capture_minutes: int
+        The capture window of the event hub in minutes
+    end: datetime.datetime
+        The end of the history; Defaults to the current minute
+    seed: int
+        The seed of the readings
+    """
+    rng = np.random.default_rng(seed)
+    if end is None:
+        end = datetime.datetime.now().replace(second=0, microsecond=0)
+    date = end - datetime.timedelta(days=days)
+
+    records = 0
+    while date < end:
+        for partition in range(partitions):
+            # Writing one capture file per partition and window
+            capture = create_capture_records(date, capture_minutes, readings_per_minute, rng, sequence_number=records)
+            buffer = io.BytesIO()
+            fastavro.writer(buffer, CAPTURE_SCHEMA, capture)
+            container_client.upload_blob(f"{root}electricity/{partition}/{date.strftime('%Y/%m/%d/%H/%M/%S')}.avro", buffer.getvalue())
+            records += len(capture)
+        date += datetime.timedelta(minutes=capture_minutes)
+
+    return records
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Generates synthetic Event Hubs capture files and reports their size")
+    parser.add_argument("--days", type=float, help="The number of days of history", default=1)
+    parser.add_argument("--partitions", type=int, help="The number of event hub partitions", default=2)
+    parser.add_argument("--readings_per_minute", type=int, help="The number of meter readings per minute and partition", default=6)
+    args = parser.parse_args()
+
+    container_client = FakeContainerClient()
+    records = create_capture_blobs(container_client, "flexitricity/", args.days, args.partitions, args.readings_per_minute)
+    size = sum(len(data) for data, _ in container_client.blobs.values())
+    print(f"{len(container_client.names)} blobs, {records} records, {size / 1024 / 1024:.1f} MiB")
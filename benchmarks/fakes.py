@@ -0,0 +1,132 @@
+# Prefix search 
+import bisect
+
+# Typehinting 
+from typing import Union
+
+# Date wrangling 
+import datetime
+
+# Generating etags
+import hashlib
+
+# Azure errors 
+from azure.core.exceptions import ResourceNotFoundError
+
+class FakeBlob:
+    """
+    Stand-in for the BlobProperties and BlobPrefix objects returned by the listing
+    """
+    def __init__(self, name: str, size: int = 0, etag: Union[str, None] = None, last_modified: Union[datetime.datetime, None] = None):
+        self.name = name
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+class FakeDownloader:
+    """
+    Stand-in for the StorageStreamDownloader returned by download_blob
+    """
+    def __init__(self, data: bytes, chunk_size: int = 4 * 1024 * 1024):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def readall(self) -> bytes:
+        return self.data
+
+    def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+class FakeContainerClient:
+    """
+    In-memory stand-in for azure.storage.blob.ContainerClient
+
+    The names are kept sorted so a prefix listing only touches the matching names, 
+    like the storage service does
+    """
+    def __init__(self):
+        self.names = []
+        self.blobs = {}
+
+    def _properties(self, name: str) -> FakeBlob:
+        data, last_modified = self.blobs[name]
+        return FakeBlob(name, len(data), hashlib.md5(data).hexdigest(), last_modified)
+
+    def add_name(self, name: str) -> None:
+        """
+        Adds an empty blob name; Used to build big listings cheaply
+        """
+        if name not in self.blobs:
+            bisect.insort(self.names, name)
+        self.blobs[name] = (b"", datetime.datetime.now(datetime.timezone.utc))
+
+    def upload_blob(self, name: str, data, overwrite: bool = False, **kwargs) -> None:
+        # Reading file like objects
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if name in self.blobs and not overwrite:
+            raise ValueError(f"The blob {name} already exists")
+        if name not in self.blobs:
+            bisect.insort(self.names, name)
+        self.blobs[name] = (bytes(data), datetime.datetime.now(datetime.timezone.utc))
+
+    def _range(self, name_starts_with: Union[str, None]) -> tuple:
+        if not name_starts_with:
+            return 0, len(self.names)
+        start = bisect.bisect_left(self.names, name_starts_with)
+        end = bisect.bisect_left(self.names, name_starts_with + "\U0010ffff", lo=start)
+        return start, end
+
+    def list_blobs(self, name_starts_with: Union[str, None] = None, **kwargs):
+        start, end = self._range(name_starts_with)
+        for index in range(start, end):
+            yield self._properties(self.names[index])
+
+    def walk_blobs(self, name_starts_with: Union[str, None] = None, delimiter: str = "/", **kwargs):
+        prefix = name_starts_with or ""
+        index, end = self._range(name_starts_with)
+
+        # Jumping over the content of every folder like the hierarchical listing of the service
+        while index < end:
+            rest = self.names[index][len(prefix):]
+            if delimiter in rest:
+                folder = prefix + rest.split(delimiter)[0] + delimiter
+                yield FakeBlob(folder)
+                index = bisect.bisect_left(self.names, folder + "\U0010ffff", lo=index, hi=end)
+            else:
+                yield self._properties(self.names[index])
+                index += 1
+
+    def download_blob(self, blob, **kwargs) -> FakeDownloader:
+        if blob not in self.blobs:
+            raise ResourceNotFoundError(f"The blob {blob} does not exist")
+        return FakeDownloader(self.blobs[blob][0])
+
+    def delete_blob(self, blob, **kwargs) -> None:
+        if blob not in self.blobs:
+            raise ResourceNotFoundError(f"The blob {blob} does not exist")
+        del self.blobs[blob]
+        self.names.pop(bisect.bisect_left(self.names, blob))
+
+    def get_blob_client(self, blob: str, **kwargs):
+        return FakeBlobClient(self, blob)
+
+class FakeBlobClient:
+    """
+    Stand-in for the BlobClient of a single blob
+    """
+    def __init__(self, container_client: FakeContainerClient, name: str):
+        self.container_client = container_client
+        self.name = name
+
+    def download_blob(self, **kwargs) -> FakeDownloader:
+        return self.container_client.download_blob(self.name)
+
+    def upload_blob(self, data, overwrite: bool = False, **kwargs) -> None:
+        self.container_client.upload_blob(self.name, data, overwrite=overwrite)
+
+    def get_blob_properties(self):
+        return self.container_client._properties(self.name)
@@ -0,0 +1,79 @@
+# Arg parsing 
+import argparse
+
+# Date wrangling 
+import datetime
+
+# Timing 
+import time
+
+# Importing blob functionalities
+from blobs import get_blob_names, get_delta_blobs, list_delta_blob_names
+
+# Importing the in-memory container
+from benchmarks.fakes import FakeContainerClient
+
+def create_capture_names(container_client: FakeContainerClient, root: str, days: int, partitions: int, capture_minutes: int = 5) -> None:
+    """
+    Fills the container with the capture blob names of the last days
+
+    Arguments
+    ---------
+    container_client: FakeContainerClient
+        The in-memory container
+    root: str
+        The root folder of the capture blobs
+    days: int
+        The number of days of history
+    partitions: int
+        The number of event hub partitions
+    capture_minutes: int
+        The capture window of the event hub in minutes
+    """
+    end = datetime.datetime.now().replace(second=0, microsecond=0)
+    date = end - datetime.timedelta(days=days)
+    while date <= end:
+        for partition in range(partitions):
+            container_client.add_name(f"{root}electricity/{partition}/{date.strftime('%Y/%m/%d/%H/%M/%S')}.avro")
+        date += datetime.timedelta(minutes=capture_minutes)
+
+def main(delta_hours: int, partitions: int) -> None:
+    """
+    Compares the full listing with the time-pruned listing as the history grows
+
+    Arguments
+    ---------
+    delta_hours: int
+        The number of hours of the window
+    partitions: int
+        The number of event hub partitions
+    """
+    root = "flexitricity/"
+    print(f"{'history days':>12} {'blobs':>10} {'full listing s':>15} {'pruned listing s':>17} {'window blobs':>13}")
+    for days in [7, 30, 180, 365, 3 * 365]:
+        container_client = FakeContainerClient()
+        create_capture_names(container_client, root, days, partitions)
+
+        # Listing everything and filtering the names
+        start = time.perf_counter()
+        full = get_delta_blobs(get_blob_names(container_client.list_blobs(name_starts_with=root)), delta_hours)
+        full_seconds = time.perf_counter() - start
+
+        # Listing only the folders of the window
+        start = time.perf_counter()
+        pruned = list_delta_blob_names(container_client, root, delta_hours)
+        pruned_seconds = time.perf_counter() - start
+
+        # Both listings have to return the same blobs
+        assert sorted(full) == sorted(pruned), "The pruned listing differs from the full listing"
+
+        print(f"{days:>12} {len(container_client.names):>10} {full_seconds:>15.3f} {pruned_seconds:>17.3f} {len(pruned):>13}")
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Benchmark of the time-pruned capture blob listing")
+    parser.add_argument("--delta_hours", type=int, help="The number of hours of the window", default=24)
+    parser.add_argument("--partitions", type=int, help="The number of event hub partitions", default=2)
+    args = parser.parse_args()
+
+    main(delta_hours=args.delta_hours, partitions=args.partitions)
@@ -0,0 +1,121 @@
+# Arg parsing 
+import argparse
+
+# Date wrangling 
+import datetime
+
+# Timing 
+import time
+
+# Dataframes
+import pandas as pd 
+
+# Array math 
+import numpy as np
+
+# PSQL connection 
+import psycopg2
+
+# Bulk writing to PSQL
+from psql import copy_dataframe
+
+# Pipeline settings
+from resources import get_config
+
+# Defining the columns of the benchmark table, shaped like electricity_timeseries
+COLUMNS = ['timestamp', 'power_usage', 'current', 'voltage', 'created_datetime', 'updated_datetime']
+
+def connect():
+    """
+    Connects to the benchmark database using the same PSQL_* variables as the pipeline
+    """
+    return psycopg2.connect(**get_config()["psql"])
+
+def create_timeseries(rows: int) -> pd.DataFrame:
+    """
+    Creates a synthetic minute timeseries with the given number of rows
+    """
+    rng = np.random.default_rng(0)
+    now = datetime.datetime.now()
+    return pd.DataFrame({
+        'timestamp': pd.date_range("2020-01-01", periods=rows, freq="min"),
+        'power_usage': rng.random(rows) * 10,
+        'current': rng.random(rows) * 5,
+        'voltage': 230 + rng.random(rows),
+        'created_datetime': now,
+        'updated_datetime': now,
+    })
+
+def create_table(conn, table: str) -> None:
+    """
+    (Re)creates the benchmark table
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(f"""
+            CREATE TABLE {table} (
+                id SERIAL PRIMARY KEY, 
+                timestamp TIMESTAMP, 
+                power_usage DOUBLE PRECISION, 
+                current DOUBLE PRECISION, 
+                voltage DOUBLE PRECISION, 
+                created_datetime TIMESTAMP, 
+                updated_datetime TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+def insert_row_by_row(conn, table: str, df: pd.DataFrame) -> None:
+    """
+    The previous loader: one INSERT per row and a single commit at the end
+    """
+    cursor = conn.cursor()
+    query = f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s, %s)"
+    for _, row in df.iterrows():
+        cursor.execute(query, tuple(row[column] for column in COLUMNS))
+    conn.commit()
+
+def main(rows: int, batch_size: int) -> None:
+    """
+    Compares the rows per second of the row by row INSERT loader and the COPY loader
+
+    Arguments
+    ---------
+    rows: int
+        The number of rows to write
+    batch_size: int
+        The number of rows per COPY transaction
+    """
+    conn = connect()
+    table = "benchmark_electricity_timeseries"
+    df = create_timeseries(rows)
+
+    # Timing both loaders on an empty table
+    results = {}
+    for name, loader in [
+        ("insert per row", lambda: insert_row_by_row(conn, table, df)), 
+        ("copy", lambda: copy_dataframe(conn, table, df, COLUMNS, batch_size=batch_size))
+    ]:
+        create_table(conn, table)
+        start = time.perf_counter()
+        loader()
+        results[name] = time.perf_counter() - start
+
+    # Cleaning up
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.commit()
+    conn.close()
+
+    # Reporting the throughput
+    for name, seconds in results.items():
+        print(f"{name:>15}: {rows} rows in {seconds:.2f} s ({rows / seconds:,.0f} rows/s)")
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Benchmark of the PSQL loaders")
+    parser.add_argument("--rows", type=int, help="The number of rows to write", default=100000)
+    parser.add_argument("--batch_size", type=int, help="The number of rows per COPY transaction", default=50000)
+    args = parser.parse_args()
+
+    main(rows=args.rows, batch_size=args.batch_size)
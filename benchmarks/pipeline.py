@@ -0,0 +1,254 @@
+# Arg parsing
+import argparse
+
+# OS traversal
+import os
+
+# Timing
+import time
+
+# Peak memory fallback
+import resource
+
+# Sampling the memory in the background
+import threading
+
+# Run report serialization
+import json
+
+# Typehinting
+from typing import Union
+
+# Run metrics
+import metrics
+
+# The stages
+from aggregate_features import CAPTURE_ROOT, aggregate_new_blobs, upload_features
+from feature_store import split_feature_files
+from aggregate_to_timeseries import write_timeseries
+from aggregate_to_rollups import build_rollups, write_rollups
+from aggregate_to_power_consumption import write_power_consumption, ENGINES
+from create_analysis_data import write_analysis_data
+from migrate import migrate
+
+# The synthetic capture files, the in-memory container and the benchmark database
+from benchmarks.capture import create_capture_blobs
+from benchmarks.fakes import FakeContainerClient
+from benchmarks.loaders import connect
+
+# Defining the schema the pipeline tables are created in, so the benchmark never touches the real tables
+SCHEMA = "benchmark"
+
+# Defining the folders of the feature blobs and the manifest in the in-memory container
+FEATURE_PATH = "features"
+MANIFEST_PATH = "manifests/aggregate_features.json"
+
+# Defining the analysis data modes that run on a single connection
+MODES = ["memory", "sql"]
+
+# Defining the counter that measures the throughput of every stage
+THROUGHPUT = {
+    "aggregate_features": ("decode", "records"),
+    "aggregate_to_timeseries": ("write_electricity_timeseries", "rows"),
+    "aggregate_to_rollups": ("rollup", "rows"),
+    "aggregate_to_power_consumption": ("write_power_consumption", "rows"),
+    "create_analysis_data": ("write_api_power_usage_analytics", "rows"),
+}
+
+# Defining the tables of the pipeline
+TABLES = """
+    CREATE TABLE electricity_timeseries (
+        id SERIAL PRIMARY KEY, timestamp TIMESTAMP, power_usage DOUBLE PRECISION, current DOUBLE PRECISION,
+        voltage DOUBLE PRECISION, created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+    );
+    CREATE TABLE power_consumption (
+        id SERIAL PRIMARY KEY, timestamp TIMESTAMP, power_usage_5_minutes_ahead DOUBLE PRECISION,
+        power_usage_15_minutes_ahead DOUBLE PRECISION, power_usage_60_minutes_ahead DOUBLE PRECISION,
+        created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+    );
+    CREATE TABLE api_power_usage (
+        id SERIAL PRIMARY KEY, timestamp TIMESTAMP, endpoint TEXT, version TEXT,
+        power_usage_5_minutes_ahead DOUBLE PRECISION, power_usage_15_minutes_ahead DOUBLE PRECISION,
+        power_usage_60_minutes_ahead DOUBLE PRECISION, response_status_code INTEGER, request TEXT,
+        created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+    );
+    CREATE TABLE api_power_usage_analytics (
+        id SERIAL PRIMARY KEY, timestamp TIMESTAMP, endpoint TEXT, version TEXT,
+        power_usage_5_minutes_ahead DOUBLE PRECISION, power_usage_15_minutes_ahead DOUBLE PRECISION,
+        power_usage_60_minutes_ahead DOUBLE PRECISION, power_usage_5_minutes_ahead_forecast DOUBLE PRECISION,
+        power_usage_15_minutes_ahead_forecast DOUBLE PRECISION, power_usage_60_minutes_ahead_forecast DOUBLE PRECISION,
+        created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+    );
+"""
+
+def get_rss() -> int:
+    """
+    Returns the resident memory of the process in bytes; Falls back to the peak of the process where /proc is missing
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakMemory:
+    """
+    Samples the resident memory of the process in the background while the block runs
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, get_rss())
+
+    def __enter__(self):
+        self.start = self.peak = get_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, get_rss())
+
+def create_schema(conn) -> None:
+    """
+    (Re)creates the pipeline tables and their indexes in the benchmark schema and points the connection to it
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        cursor.execute(f"SET search_path TO {SCHEMA}")
+        cursor.execute(TABLES)
+    conn.commit()
+
+    # Creating the rollup tables and building the indexes like the setup step of a deployment
+    migrate(conn)
+
+def create_api_forecasts(conn, every: int = 3) -> None:
+    """
+    Creates api forecasts of two model versions for every n-th minute of the timeseries
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO api_power_usage (
+                timestamp, endpoint, version, power_usage_5_minutes_ahead, power_usage_15_minutes_ahead,
+                power_usage_60_minutes_ahead, response_status_code, request, created_datetime, updated_datetime
+            )
+            SELECT timestamp, 'predict', version, power_usage * 5, power_usage * 15, power_usage * 60, 200, '{}', now(), now()
+            FROM electricity_timeseries CROSS JOIN (VALUES ('v1'), ('v2')) AS versions (version)
+            WHERE EXTRACT(EPOCH FROM timestamp)::bigint / 60 %% %s = 0
+        """, (every,))
+    conn.commit()
+
+def main(days: float, partitions: int, readings_per_minute: int, engine: str, mode: str, download_workers: int, report: Union[str, None]) -> None:
+    """
+    Runs the five stages on synthetic capture files of the last days, against the in-memory
+    container and the benchmark schema of the PSQL_* database, and reports the throughput and the
+    peak resident memory of every stage
+
+    Arguments
+    ---------
+    days: float
+        The number of days of capture files
+    partitions: int
+        The number of event hub partitions
+    readings_per_minute: int
+        The number of meter readings per minute and partition
+    engine: str
+        The power consumption engine
+    mode: str
+        The analysis data mode
+    download_workers: int
+        The number of threads downloading the blobs
+    report: str
+        The path of the json run report; Not written if None
+    """
+    container_client = FakeContainerClient()
+    start = time.perf_counter()
+    records = create_capture_blobs(container_client, CAPTURE_ROOT, days, partitions, readings_per_minute)
+    print(f"Generated {len(container_client.names)} capture files with {records} records in {time.perf_counter() - start:.1f} s")
+
+    conn = connect()
+    create_schema(conn)
+
+    # Defining the stages in the order of the pipeline
+    def run_features():
+        features, manifest = aggregate_new_blobs(container_client, None, download_workers, full_backfill=True, manifest_path=MANIFEST_PATH)
+        if features is not None:
+            upload_features(container_client, split_feature_files(FEATURE_PATH, features), MANIFEST_PATH, manifest)
+
+    def run_rollups():
+        rollups = build_rollups(conn, container_client, FEATURE_PATH, "insert", download_workers)
+        if rollups is not None:
+            write_rollups(conn, rollups)
+
+    stages = [
+        ("aggregate_features", run_features),
+        ("aggregate_to_timeseries", lambda: write_timeseries(conn, container_client, FEATURE_PATH, "insert", download_workers)),
+        ("aggregate_to_rollups", run_rollups),
+        ("aggregate_to_power_consumption", lambda: write_power_consumption(conn, "insert", engine)),
+        ("create_analysis_data", lambda: write_analysis_data(conn, "insert", mode)),
+    ]
+
+    metrics.start_run()
+    memory = {}
+    for name, run in stages:
+        # The analysis joins the forecasts the api wrote for the timeseries
+        if name == "create_analysis_data":
+            create_api_forecasts(conn)
+
+        with PeakMemory() as peak, metrics.stage(name):
+            run()
+        memory[name] = peak
+    run_report = metrics.finish_run()
+
+    # Printing the throughput and the memory of every stage
+    print(f"{'stage':<32} {'seconds':>9} {'items':>10} {'items/s':>12} {'peak RSS MiB':>13} {'growth MiB':>11}")
+    for name, _ in stages:
+        stage = run_report["stages"][name]
+        step, counter = THROUGHPUT[name]
+        items = stage["steps"].get(step, {}).get(counter, 0)
+        rate = items / stage["seconds"] if stage["seconds"] > 0 else 0
+        peak = memory[name]
+        print(f"{name:<32} {stage['seconds']:>9.2f} {items:>10} {rate:>12.0f} {peak.peak / 2 ** 20:>13.1f} {(peak.peak - peak.start) / 2 ** 20:>11.1f}")
+
+    # Writing the full report with the steps of every stage
+    if report:
+        for name, _ in stages:
+            run_report["stages"][name]["peak_rss_bytes"] = memory[name].peak
+        with open(report, "w") as file:
+            json.dump(run_report, file, indent=2)
+
+    # Cleaning up
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="End to end benchmark of the pipeline on synthetic capture files")
+    parser.add_argument("--days", type=float, help="The number of days of capture files, from 1 to 365", default=1)
+    parser.add_argument("--partitions", type=int, help="The number of event hub partitions", default=2)
+    parser.add_argument("--readings_per_minute", type=int, help="The number of meter readings per minute and partition", default=6)
+    parser.add_argument("--engine", type=str, choices=ENGINES, help="The power consumption engine", default="pandas")
+    parser.add_argument("--mode", type=str, choices=MODES, help="The analysis data mode", default="memory")
+    parser.add_argument("--download_workers", type=int, help="The number of threads downloading the blobs", default=8)
+    parser.add_argument("--report", type=str, help="The path of the json run report", default=None)
+    args = parser.parse_args()
+
+    main(
+        days=args.days,
+        partitions=args.partitions,
+        readings_per_minute=args.readings_per_minute,
+        engine=args.engine,
+        mode=args.mode,
+        download_workers=args.download_workers,
+        report=args.report
+    )
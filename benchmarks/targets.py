@@ -0,0 +1,128 @@
+# Arg parsing 
+import argparse
+
+# Timing 
+import time
+
+# Dataframes
+import pandas as pd 
+
+# Array math 
+import numpy as np
+
+# Minutes ahead targets
+from targets import HORIZONS, get_target_name, compute_forward_sums, build_forward_sums_query
+
+# Dense minute grid
+from resampling import resample_minutes
+
+# Bulk writing to PSQL
+from psql import copy_dataframe
+
+# Reusing the connection and the synthetic timeseries of the loader benchmark
+from benchmarks.loaders import connect, create_timeseries, create_table
+
+# Defining the benchmark tables
+SOURCE_TABLE = "benchmark_electricity_timeseries"
+TARGET_TABLE = "benchmark_power_consumption"
+
+# Defining the columns of the target table
+TARGET_COLUMNS = ["timestamp"] + [get_target_name(minutes) for minutes in HORIZONS] + ["created_datetime", "updated_datetime"]
+
+def create_target_table(conn) -> None:
+    """
+    (Re)creates the benchmark target table, shaped like power_consumption
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
+        cursor.execute(f"""
+            CREATE TABLE {TARGET_TABLE} (
+                id SERIAL PRIMARY KEY, 
+                timestamp TIMESTAMP, 
+                {', '.join(f'{get_target_name(minutes)} DOUBLE PRECISION' for minutes in HORIZONS)}, 
+                created_datetime TIMESTAMP, 
+                updated_datetime TIMESTAMP
+            )
+        """)
+    conn.commit()
+
+def run_pandas(conn) -> None:
+    """
+    The pandas engine: fetch the timeseries, place it on the dense minute grid without filling
+    the gaps, compute the sums in memory and copy them back
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT timestamp, power_usage FROM {SOURCE_TABLE} ORDER BY timestamp")
+        timeseries = pd.DataFrame(cursor.fetchall(), columns=["timestamp", "power_usage"])
+    timeseries, _ = resample_minutes(timeseries, ["power_usage"], policy="none")
+    timeseries = compute_forward_sums(timeseries, HORIZONS)
+    timeseries = timeseries[~timeseries["gap"]]
+    timeseries["created_datetime"] = timeseries["timestamp"]
+    timeseries["updated_datetime"] = timeseries["timestamp"]
+    copy_dataframe(conn, TARGET_TABLE, timeseries, TARGET_COLUMNS)
+
+def run_sql(conn) -> None:
+    """
+    The sql engine: one INSERT ... SELECT with window functions
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(build_forward_sums_query(SOURCE_TABLE, TARGET_TABLE, HORIZONS), {"max_timestamp": None})
+    conn.commit()
+
+def read_targets(conn) -> pd.DataFrame:
+    """
+    Reads the written sums ordered by the timestamp
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT {', '.join(TARGET_COLUMNS[:-2])} FROM {TARGET_TABLE} ORDER BY timestamp")
+        return pd.DataFrame(cursor.fetchall(), columns=TARGET_COLUMNS[:-2])
+
+def main(sizes: list) -> None:
+    """
+    Compares the pandas and the sql engine of the minutes ahead sums as the table grows;
+    Both engines have to write the same timestamps and the same sums
+
+    Arguments
+    ---------
+    sizes: list
+        The numbers of minutes in the source table
+    """
+    conn = connect()
+    print(f"{'minutes':>10} {'pandas s':>10} {'sql s':>10} {'rows':>10}")
+    for size in sizes:
+        # Creating a timeseries with gaps and missing values
+        timeseries = create_timeseries(size)
+        rng = np.random.default_rng(size)
+        timeseries = timeseries[rng.random(size) > 0.01]
+        timeseries.loc[rng.random(timeseries.shape[0]) < 0.001, "power_usage"] = np.nan
+        create_table(conn, SOURCE_TABLE)
+        copy_dataframe(conn, SOURCE_TABLE, timeseries, list(timeseries.columns))
+
+        # Timing both engines on an empty target table
+        results = {}
+        for name, engine in [("pandas", run_pandas), ("sql", run_sql)]:
+            create_target_table(conn)
+            start = time.perf_counter()
+            engine(conn)
+            results[name] = (time.perf_counter() - start, read_targets(conn))
+
+        # Checking that both engines wrote the same rows
+        pandas_targets, sql_targets = results["pandas"][1], results["sql"][1]
+        assert pandas_targets["timestamp"].equals(sql_targets["timestamp"]), "The engines wrote different timestamps"
+        assert np.allclose(pandas_targets.iloc[:, 1:].values, sql_targets.iloc[:, 1:].values, rtol=1e-9), "The engines wrote different sums"
+
+        print(f"{size:>10} {results['pandas'][0]:>10.2f} {results['sql'][0]:>10.2f} {sql_targets.shape[0]:>10}")
+
+    # Cleaning up
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SOURCE_TABLE}, {TARGET_TABLE}")
+    conn.commit()
+    conn.close()
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Benchmark of the pandas and sql engines of the minutes ahead sums")
+    parser.add_argument("--sizes", type=int, nargs="+", help="The numbers of minutes in the source table", default=[10000, 100000, 525600])
+    args = parser.parse_args()
+
+    main(sizes=args.sizes)
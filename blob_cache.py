@@ -0,0 +1,156 @@
+# OS traversal
+import os
+
+# Cache keys
+import hashlib
+
+# Unique temporary files
+import uuid
+
+# Caching
+from functools import lru_cache
+
+# Input/output stream
+import io
+
+# Typehinting
+from typing import Union, Tuple
+
+# Dataframes
+import pandas as pd
+
+# Parquet metadata
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Importing logging
+import logging
+
+# Shared settings
+from resources import get_config
+
+# Importing the columns of the partial aggregates
+from aggregation import MINUTE_KEYS, PARTIAL_COLUMNS
+
+# Defining the metadata key holding the number of records that could not be parsed
+SKIPPED_KEY = b"skipped"
+
+# Versioning the cached partials by their columns, so a change of the statistics never serves stale entries
+CACHE_VERSION = hashlib.sha256(",".join(MINUTE_KEYS + PARTIAL_COLUMNS).encode("utf-8")).hexdigest()[:8]
+
+class PartialsCache:
+    """
+    Local on-disk cache of the per minute partial aggregates of every capture blob
+
+    The capture blobs are immutable, so an entry keyed by the blob name and its etag never goes
+    stale; The entries are parquet files whose modification time is touched on every hit and the
+    least recently used ones are evicted once the cache grows past its size cap
+
+    Arguments
+    ---------
+    path: str
+        The local folder of the cache
+    max_bytes: int
+        The size cap of the cache in bytes
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+        # Tracking the size of the cache, so the folder is only scanned when it may be full
+        self.size = self.evict()
+
+    def get_file_name(self, blob_name: str, etag: str) -> str:
+        """
+        Creates the content addressed file name of a blob version
+        """
+        key = hashlib.sha256(f"{CACHE_VERSION}/{blob_name}/{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.path, f"{key}.parquet")
+
+    def get(self, blob_name: str, etag: Union[str, None]) -> Union[Tuple[pd.DataFrame, int], None]:
+        """
+        Returns the partial aggregates and the number of skipped records of a blob version; None on a miss
+        """
+        if etag is None:
+            return None
+
+        file_name = self.get_file_name(blob_name, etag)
+        try:
+            table = pq.read_table(file_name)
+
+            # Marking the entry as recently used
+            os.utime(file_name)
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        skipped = int((table.schema.metadata or {}).get(SKIPPED_KEY, b"0"))
+        return table.to_pandas(), skipped
+
+    def put(self, blob_name: str, etag: Union[str, None], partials: pd.DataFrame, skipped: int) -> None:
+        """
+        Stores the partial aggregates of a blob version and evicts the least recently used entries past the size cap
+        """
+        if etag is None:
+            return
+
+        # Recording the skipped records in the metadata of the file
+        table = pa.Table.from_pandas(partials, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SKIPPED_KEY: str(skipped).encode("utf-8")})
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+
+        # Writing to a temporary file first, so concurrent workers never read a partial entry
+        file_name = self.get_file_name(blob_name, etag)
+        temporary_name = f"{file_name}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temporary_name, "wb") as file:
+                file.write(buffer.getvalue())
+            os.replace(temporary_name, file_name)
+        except OSError as e:
+            logging.warning(f"Could not cache the partials of {blob_name}: {e}")
+            return
+
+        # Other processes may share the folder, so the size is recounted before evicting
+        self.size += buffer.getbuffer().nbytes
+        if self.size > self.max_bytes:
+            self.size = self.evict()
+
+    def evict(self) -> int:
+        """
+        Deletes the least recently used entries until the cache fits its size cap; Returns the size of the cache
+        """
+        entries = []
+        with os.scandir(self.path) as files:
+            for file in files:
+                if not file.name.endswith(".parquet"):
+                    continue
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file.path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, file_name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                continue
+            size -= file_size
+
+        return size
+
+@lru_cache(maxsize=None)
+def get_partials_cache() -> Union[PartialsCache, None]:
+    """
+    Creates the local cache of the partial aggregates once per process from the BLOB_CACHE_PATH
+    and BLOB_CACHE_MAX_MB variables; None if BLOB_CACHE_PATH is not set
+    """
+    config = get_config()
+    if not config["blob_cache_path"]:
+        return None
+
+    return PartialsCache(config["blob_cache_path"], config["blob_cache_max_mb"] * 2 ** 20)
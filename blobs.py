@@ -1,9 +1,28 @@
 # Typehinting 
-from typing import Union
+from typing import Union, Iterator, Tuple, Callable, Any
+
+# Streamed downloads 
+import io
 
 # Datetime 
 import datetime
 
+# Timing 
+import time
+
+# Concurrent downloads 
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+# Run metrics
+from metrics import timed, count, bind_stage
+
+# Defining the date format in the names of the aggregated feature blobs
+FEATURE_BLOB_DATE_FORMAT = "%Y-%m-%d-%H-%M"
+
+# Defining the hive style day partition folders of the aggregated feature blobs
+FEATURE_PARTITION_FORMAT = "year=%Y/month=%m/day=%d/"
+
 # Getting all the names for the blobs 
 def get_blob_names(blobs) -> list:
     """
@@ -19,7 +38,123 @@ def get_blob_names(blobs) -> list:
     # Returning the blob names 
     return blob_names
 
-def get_delta_blobs(blob_names: list, delta_hours: Union[int, None]) -> list:
+def get_partition_prefixes(container_client, root: str) -> list:
+    """
+    Lists the partition folders of the capture container
+
+    The blob names are in the form: 
+    <root>/<str>/<partition>/year/month/day/hour/minute/second.avro
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    """
+    # Creating an empty list to store the partition prefixes
+    partition_prefixes = []
+
+    # Walking the event hub folders and then the partition folders
+    for hub in container_client.walk_blobs(name_starts_with=root, delimiter="/"):
+        for partition in container_client.walk_blobs(name_starts_with=hub.name, delimiter="/"):
+            partition_prefixes.append(partition.name)
+
+    # Returning the partition prefixes
+    return partition_prefixes
+
+def get_delta_prefixes(partition_prefixes: list, delta_hours: int, current_date: Union[datetime.datetime, None] = None) -> list:
+    """
+    Creates the minimal list of name prefixes that cover the last delta hours
+
+    Days that are fully inside the window are covered by one day prefix, the 
+    remaining hours by one prefix per hour
+
+    Arguments
+    ---------
+    partition_prefixes: list
+        List of the partition folders, ending with a slash
+    delta_hours: int
+        The number of hours to look back in time 
+    current_date: datetime
+        The end of the window; Defaults to now
+    """
+    # Extracting the current date
+    if current_date is None:
+        current_date = datetime.datetime.now()
+
+    # Calculating the first and the last hour of the window
+    start_hour = (current_date - datetime.timedelta(hours=delta_hours)).replace(minute=0, second=0, microsecond=0)
+    end_hour = current_date.replace(minute=0, second=0, microsecond=0)
+
+    # Creating the time prefixes
+    time_prefixes = []
+    hour = start_hour
+    while hour <= end_hour:
+        # Checking if the whole day is inside the window
+        next_day = hour + datetime.timedelta(days=1)
+        if hour.hour == 0 and next_day - datetime.timedelta(hours=1) <= end_hour:
+            time_prefixes.append(hour.strftime("%Y/%m/%d/"))
+            hour = next_day
+        else:
+            time_prefixes.append(hour.strftime("%Y/%m/%d/%H/"))
+            hour = hour + datetime.timedelta(hours=1)
+
+    # Returning the prefixes for every partition
+    return [partition_prefix + time_prefix for partition_prefix in partition_prefixes for time_prefix in time_prefixes]
+
+def list_delta_blobs(container_client, root: str, delta_hours: Union[int, None]) -> list:
+    """
+    Lists the properties (name, etag, last_modified) of the blobs that are within the 
+    delta hours, only listing the folders of the time window instead of the whole container
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    delta_hours: int
+        The number of hours to look back in time; If None, all the blobs are listed
+    """
+    with timed("list_blobs") as counters:
+        if delta_hours is None:
+            # Listing the whole history
+            blobs = list(container_client.list_blobs(name_starts_with=root))
+            counters["blobs"] = len(blobs)
+            return blobs
+
+        # Fixing the current date so the prefixes and the filter use the same window
+        current_date = datetime.datetime.now()
+
+        # Listing only the prefixes of the window
+        blobs = []
+        for prefix in get_delta_prefixes(get_partition_prefixes(container_client, root), delta_hours, current_date):
+            blobs.extend(container_client.list_blobs(name_starts_with=prefix))
+
+        # Filtering the edges of the window exactly
+        delta_blob_names = set(get_delta_blobs(get_blob_names(blobs), delta_hours, current_date))
+        blobs = [blob for blob in blobs if blob.name in delta_blob_names]
+        counters["blobs"] = len(blobs)
+        return blobs
+
+def list_delta_blob_names(container_client, root: str, delta_hours: Union[int, None]) -> list:
+    """
+    Lists the names of the blobs that are within the delta hours, only listing the 
+    folders of the time window instead of the whole container
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the capture container
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    delta_hours: int
+        The number of hours to look back in time; If None, all the blobs are listed
+    """
+    return get_blob_names(list_delta_blobs(container_client, root, delta_hours))
+
+def get_delta_blobs(blob_names: list, delta_hours: Union[int, None], current_date: Union[datetime.datetime, None] = None) -> list:
     """
     Only leaves the names of the blobs that are within the delta hours; 
 
@@ -32,13 +167,16 @@ def get_delta_blobs(blob_names: list, delta_hours: Union[int, None]) -> list:
         List of blob names
     delta_hours: int
         The number of hours to look back in time to aggregate the features
+    current_date: datetime
+        The end of the window; Defaults to now
     """
     if delta_hours is None: 
         # Returning the blob names
         return blob_names
     
     # Extracting the current date
-    current_date = datetime.datetime.now()
+    if current_date is None:
+        current_date = datetime.datetime.now()
 
     # Creating an empty list to store the blob names
     delta_blob_names = []
@@ -64,4 +202,259 @@ def get_delta_blobs(blob_names: list, delta_hours: Union[int, None]) -> list:
             delta_blob_names.append(blob_name)
 
     # Returning the delta blob names
-    return delta_blob_names
\ No newline at end of file
+    return delta_blob_names
+
+class BlobStream(io.RawIOBase):
+    """
+    Read only file object over the chunks of a blob download, so a reader can consume the blob 
+    while it is being downloaded without the whole blob being buffered
+
+    The wait for every chunk and its bytes are reported under the "download" step, and the 
+    seconds are summed in download_seconds, so the reader can leave them out of its own step
+
+    Arguments
+    ---------
+    downloader: StorageStreamDownloader
+        The downloader returned by download_blob
+    """
+    def __init__(self, downloader):
+        self._chunks = iter(downloader.chunks())
+        self._chunk = memoryview(b"")
+        self.bytes_read = 0
+        self.download_seconds = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_read
+
+    def next_chunk(self) -> Union[bytes, None]:
+        """
+        Returns the next chunk of the download; None once the download is consumed
+        """
+        return next(self._chunks, None)
+
+    def readinto(self, buffer) -> int:
+        # Filling the whole buffer across the chunks, since the avro reader takes a short read for the end of the file
+        filled = 0
+        while filled < len(buffer):
+            # Moving to the next chunk once the current one is consumed, reporting its transfer as the download of the blob
+            if len(self._chunk) == 0:
+                start = time.perf_counter()
+                chunk = self.next_chunk()
+                seconds = time.perf_counter() - start
+                self.download_seconds += seconds
+                count("download", seconds, bytes=len(chunk) if chunk is not None else 0)
+                if chunk is None:
+                    break
+                self._chunk = memoryview(chunk)
+                continue
+
+            # Copying as much of the chunk as fits into the buffer
+            size = min(len(buffer) - filled, len(self._chunk))
+            buffer[filled:filled + size] = self._chunk[:size]
+            self._chunk = self._chunk[size:]
+            filled += size
+
+        self.bytes_read += filled
+        return filled
+
+def map_blobs(blob_names: list, fn: Callable, max_workers: int = 8, max_in_flight: Union[int, None] = None) -> Iterator[Tuple[str, Any]]:
+    """
+    Calls fn with every blob name concurrently and yields the results in the order of blob_names
+
+    At most max_in_flight blobs are pending at any time, so the caller can consume the finished 
+    results while the next blobs are still being processed without the whole window being 
+    buffered in memory.
+
+    Arguments
+    ---------
+    blob_names: list
+        List of blob names to process
+    fn: Callable
+        Downloads and processes a blob in a worker thread; The calls are reported under the 
+        stage of the caller
+    max_workers: int
+        The number of threads processing the blobs
+    max_in_flight: int
+        The maximum number of submitted but not yet consumed blobs; Defaults to 2 * max_workers
+    """
+    # Defaulting the number of pending blobs
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+
+    # Making sure there is at least one worker and one pending blob
+    max_workers = max(1, max_workers)
+    max_in_flight = max(max_workers, max_in_flight)
+
+    # Reporting the calls under the stage of the caller
+    process = bind_stage(fn)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Queue of the pending blobs, in submission order
+        pending = deque()
+
+        # Iterating over the blob names and keeping the queue filled up to max_in_flight
+        for blob_name in blob_names:
+            pending.append((blob_name, executor.submit(process, blob_name)))
+
+            # Waiting for the oldest blob once the queue is full
+            if len(pending) >= max_in_flight:
+                name, future = pending.popleft()
+                yield name, future.result()
+
+        # Draining the remaining blobs
+        while pending:
+            name, future = pending.popleft()
+            yield name, future.result()
+
+def download_blobs(container_client, blob_names: list, max_workers: int = 8, max_in_flight: Union[int, None] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Downloads the blobs concurrently and yields them in the order of blob_names
+
+    At most max_in_flight downloads are pending at any time, so the caller can 
+    consume (decode and aggregate) the finished blobs while the next ones are 
+    still being downloaded without the whole window being buffered in memory.
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client that is reused for all the downloads
+    blob_names: list
+        List of blob names to download
+    max_workers: int
+        The number of threads downloading the blobs
+    max_in_flight: int
+        The maximum number of submitted but not yet consumed downloads; Defaults to 2 * max_workers
+    """
+    # Defining the download of a single blob
+    def _download(blob_name: str) -> bytes:
+        with timed("download", blobs=1) as counters:
+            data = container_client.download_blob(blob_name).readall()
+            counters["bytes"] = len(data)
+        return data
+
+    return map_blobs(blob_names, _download, max_workers, max_in_flight)
+
+def get_partition_day(blob_name: str, root: str) -> str:
+    """
+    Extracts the <hub>/<partition>/YYYY/MM/DD folder of a capture blob
+
+    Arguments
+    ---------
+    blob_name: str
+        The name of the capture blob: <root><hub>/<partition>/YYYY/MM/DD/HH/MM/SS.avro
+    root: str
+        The root folder of the capture blobs, ending with a slash
+    """
+    return "/".join(blob_name[len(root):].split("/")[:5])
+
+def get_feature_blob_dates(blob_name: str) -> Union[Tuple[datetime.datetime, datetime.datetime], None]:
+    """
+    Extracts the min and max dates encoded in the name of an aggregated feature blob; 
+    Returns None if the name does not follow the format
+
+    The blob names are in the form: 
+    <path>/<min_date>_<max_date>.parquet or <path>/<partition>/<min_date>_<max_date>_<run stamp>.parquet 
+    with the dates formatted as FEATURE_BLOB_DATE_FORMAT
+
+    Arguments
+    ---------
+    blob_name: str
+        The name of the feature blob
+    """
+    # Extracting the file name 
+    file_name = blob_name.split('/')[-1]
+    if not file_name.endswith(".parquet"):
+        return None
+
+    # Parsing the dates
+    try:
+        min_date, max_date = file_name[:-len(".parquet")].split('_')[:2]
+        min_date = datetime.datetime.strptime(min_date, FEATURE_BLOB_DATE_FORMAT)
+        max_date = datetime.datetime.strptime(max_date, FEATURE_BLOB_DATE_FORMAT)
+    except ValueError:
+        return None
+
+    # Returning the dates
+    return min_date, max_date
+
+def get_partition_value(folder_name: str) -> int:
+    """
+    Extracts the value of a hive style partition folder, e.g. 2024 from <path>/year=2024/
+    """
+    return int(folder_name.rstrip("/").split("/")[-1].split("=")[-1])
+
+def list_feature_blobs(container_client, aggregated_feature_path: str, min_timestamp: Union[datetime.datetime, None] = None) -> list:
+    """
+    Lists the names of the feature blobs, only walking the year=/month=/day= partitions that 
+    can hold minutes after min_timestamp; The legacy files directly in the folder are always listed
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    min_timestamp: datetime
+        The watermark; If None, all the partitions are listed
+    """
+    # The minutes are whole, so the day of the first minute after the timestamp is the first day that is walked
+    min_date = datetime.date.min
+    if min_timestamp is not None:
+        min_date = (min_timestamp.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)).date()
+
+    blob_names = []
+    for item in container_client.walk_blobs(name_starts_with=aggregated_feature_path.rstrip("/") + "/", delimiter="/"):
+        # Keeping the flat files of the previous layout
+        if not item.name.endswith("/"):
+            blob_names.append(item.name)
+            continue
+
+        # Pruning the years, months and days before the watermark
+        if "year=" not in item.name or get_partition_value(item.name) < min_date.year:
+            continue
+        for month in container_client.walk_blobs(name_starts_with=item.name, delimiter="/"):
+            if not month.name.endswith("/") or (get_partition_value(item.name), get_partition_value(month.name)) < (min_date.year, min_date.month):
+                continue
+            for day in container_client.walk_blobs(name_starts_with=month.name, delimiter="/"):
+                if not day.name.endswith("/"):
+                    continue
+                date = datetime.date(get_partition_value(item.name), get_partition_value(month.name), get_partition_value(day.name))
+                if date >= min_date:
+                    blob_names.extend(get_blob_names(container_client.list_blobs(name_starts_with=day.name)))
+
+    # Returning the names 
+    return blob_names
+
+def get_new_feature_blobs(blob_names: list, max_timestamp: Union[datetime.datetime, None]) -> list:
+    """
+    Leaves only the parquet feature blobs that can contain minutes after max_timestamp
+
+    Blobs whose name can not be parsed are kept, so they are never silently skipped
+
+    Arguments
+    ---------
+    blob_names: list
+        List of the feature blob names
+    max_timestamp: datetime
+        The watermark; If None, all the parquet blobs are kept
+    """
+    # Creating an empty list to store the new blob names
+    new_blob_names = []
+
+    for blob_name in blob_names:
+        # Skipping everything that is not a parquet file
+        if not blob_name.endswith(".parquet"):
+            continue
+
+        # Skipping the files that only contain minutes up to the watermark
+        dates = get_feature_blob_dates(blob_name)
+        if max_timestamp is not None and dates is not None and dates[1] <= max_timestamp:
+            continue
+
+        new_blob_names.append(blob_name)
+
+    # Returning the new blob names
+    return new_blob_names
@@ -0,0 +1,182 @@
+# Date wrangling
+import datetime
+
+# Arg parsing
+import argparse
+
+# Typehinting
+from typing import Union
+
+# Importing logging
+import logging
+
+# Dataframes
+import pandas as pd
+
+# Importing blob functionalities
+from blobs import list_feature_blobs, download_blobs
+
+# Shared clients
+from resources import get_config, get_container_client
+
+# Importing the aggregation and the feature files
+from aggregation import add_means
+from feature_store import read_feature_partials, get_compacted_from, drop_compacted, drop_superseded, write_features_parquet, split_feature_files
+
+# Run metrics
+from metrics import timed
+
+# Defining the minimum number of files in a day partition before it is compacted
+DEFAULT_MIN_FILES = 2
+
+# Defining how many legacy files are merged at once
+LEGACY_BATCH_SIZE = 100
+
+def compact_files(container_client, aggregated_feature_path: str, blob_names: list, download_workers: int = 8) -> list:
+    """
+    Merges the feature files into one file per day and deletes them
+
+    The rows of every capture blob are kept apart, so a blob that is aggregated again later still 
+    supersedes them, and only the latest run of every blob is kept; The new files list the merged 
+    files in their metadata, so the readers skip the merged files until they are deleted
+
+    Returns the names of the new files
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    blob_names: list
+        The feature files to merge
+    download_workers: int
+        The number of threads downloading the files concurrently
+    """
+    # Reading the sums and counts of every file
+    partials, compacted_from = {}, {}
+    for blob_name, blob in download_blobs(container_client, blob_names, max_workers=download_workers):
+        partials[blob_name] = read_feature_partials(blob, blob_name)
+        sources = get_compacted_from(blob)
+        if len(sources) > 0:
+            compacted_from[blob_name] = sources
+
+    # Merging the rows of the files, leaving out the days an earlier compaction already holds and 
+    # the superseded runs of the capture blobs
+    with timed("merge") as counters:
+        remaining = drop_compacted(partials, compacted_from)
+        merged = drop_superseded(pd.concat(remaining, ignore_index=True)) if len(remaining) > 0 else pd.DataFrame()
+        counters["rows"] = merged.shape[0]
+    if merged.shape[0] == 0:
+        return []
+
+    # Writing one file per day before deleting anything
+    new_names = []
+    for blob_name, features in split_feature_files(aggregated_feature_path, add_means(merged)).items():
+        with timed("upload") as counters:
+            data = write_features_parquet(features, compacted_from=blob_names)
+            container_client.upload_blob(name=blob_name, data=data, overwrite=True)
+            counters["bytes"] = len(data)
+        new_names.append(blob_name)
+
+    # Deleting the merged files
+    with timed("delete", blobs=len(blob_names)):
+        for blob_name in blob_names:
+            container_client.delete_blob(blob_name)
+
+    return new_names
+
+def compact_features(
+        container_client,
+        aggregated_feature_path: str,
+        days: Union[int, None] = None,
+        min_files: int = DEFAULT_MIN_FILES,
+        include_legacy: bool = False,
+        download_workers: int = 8
+    ) -> int:
+    """
+    Compacts the year=/month=/day= partitions of the last days that hold at least min_files files;
+    Returns the number of compacted partitions
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client of the feature blobs
+    aggregated_feature_path: str
+        The folder of the feature blobs
+    days: int
+        The number of days to look back; If None, all the partitions are compacted
+    min_files: int
+        The minimum number of files in a partition before it is compacted
+    include_legacy: bool
+        If True, the flat files of the previous layout are moved into the day partitions as well
+    download_workers: int
+        The number of threads downloading the files concurrently
+    """
+    min_timestamp = None
+    if days is not None:
+        min_timestamp = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time.min)
+
+    # Grouping the files by their partition folder
+    partitions, legacy = {}, []
+    prefix = aggregated_feature_path.rstrip("/") + "/"
+    for blob_name in list_feature_blobs(container_client, aggregated_feature_path, min_timestamp):
+        if not blob_name.endswith(".parquet"):
+            continue
+        folder = blob_name.rsplit("/", 1)[0] + "/"
+        if folder == prefix:
+            legacy.append(blob_name)
+        else:
+            partitions.setdefault(folder, []).append(blob_name)
+
+    # Merging the legacy files in batches; Overlapping batches are merged by the next partition compaction
+    if include_legacy:
+        for start in range(0, len(legacy), LEGACY_BATCH_SIZE):
+            compact_files(container_client, aggregated_feature_path, legacy[start:start + LEGACY_BATCH_SIZE], download_workers)
+        logging.info(f"Moved {len(legacy)} legacy feature files into the day partitions")
+
+    # Merging the partitions with many small files
+    compacted = 0
+    for folder, blob_names in sorted(partitions.items()):
+        if len(blob_names) < min_files:
+            continue
+        compact_files(container_client, aggregated_feature_path, sorted(blob_names), download_workers)
+        compacted += 1
+
+    logging.info(f"Compacted {compacted} feature partitions")
+    return compacted
+
+def main(days: Union[int, None] = None, min_files: int = DEFAULT_MIN_FILES, include_legacy: bool = False) -> None:
+    """
+    Function that compacts the day partitions of the aggregated features
+
+    Arguments
+    ---------
+    days: int
+        The number of days to look back; If None, all the partitions are compacted
+    min_files: int
+        The minimum number of files in a partition before it is compacted
+    include_legacy: bool
+        If True, the flat files of the previous layout are moved into the day partitions as well
+    """
+    # Loading the settings once per process
+    config = get_config()
+
+    try:
+        # Reusing the cached container client
+        container_client = get_container_client()
+    except:
+        logging.warn("The connection was not successfull")
+        return
+
+    compact_features(container_client, config["aggregated_feature_path"], days, min_files, include_legacy)
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Compact the day partitions of the aggregated features")
+    parser.add_argument("--days", type=int, help="The number of days to look back; All the partitions by default", default=None)
+    parser.add_argument("--min_files", type=int, help="The minimum number of files in a partition before it is compacted", default=DEFAULT_MIN_FILES)
+    parser.add_argument("--include_legacy", action="store_true", help="Move the flat files of the previous layout into the day partitions")
+    args = parser.parse_args()
+
+    main(days=args.days, min_files=args.min_files, include_legacy=args.include_legacy)
@@ -1,6 +1,3 @@
-# Dotenv loading 
-from dotenv import load_dotenv
-
 # OS traversal 
 import os 
 
@@ -10,9 +7,6 @@ import datetime
 # Input/output stream
 import io
 
-# Iteration tracking 
-from tqdm import tqdm
-
 # Importing blob functionalities
 from blobs import get_blob_names
 
@@ -22,50 +16,225 @@ import pandas as pd
 # Importing logging 
 import logging
 
-# PSQL connection 
-import psycopg2
+# Typehinting 
+from typing import Union, Iterator
+
+# Shared connections
+from resources import get_config, get_connection_pool, borrow_connection
+
+# Bulk writing to PSQL
+from psql import get_write_mode, get_watermark, get_lookback, write_dataframe, stream_query, find_index, require_unique_index
+
+# Safe SQL composition
+from psycopg2 import sql
+
+# Run metrics
+from metrics import timed
 
 # Array math 
 import numpy as np
 
-# Infering the current file directory 
-def main():
-    current_file_directory = os.path.dirname(os.path.abspath(__file__))
-
-    # Loading the .env file from the parent directory
-    load_dotenv(os.path.join(current_file_directory, ".env"))
-
-    # PSQL credentials
-    db_user = os.getenv('PSQL_USER', 'default_user')
-    db_pass = os.getenv('PSQL_PASSWORD', 'default_pass')
-    db_host = os.getenv('PSQL_HOST', 'localhost')
-    db_name = os.getenv('PSQL_DATABASE', 'default_db')
-    db_port = os.getenv('PSQL_PORT', '5432')
-    
-    # Connecting to psql
-    try:
-        conn = psycopg2.connect(user=db_user, password=db_pass, host=db_host, port=db_port, database=db_name)
-        cursor = conn.cursor()
-        logging.info("Connected to PSQL")
-    except:
-        logging.warn("Could not connect to PSQL")
+# Defining the target columns of the power_consumption table 
+TARGETS = [
+    'power_usage_5_minutes_ahead',
+    'power_usage_15_minutes_ahead',
+    'power_usage_60_minutes_ahead'
+]
+
+# Defining the names of the api forecasts in the analytics table 
+FORECASTS = {target: f"{target}_forecast" for target in TARGETS}
+
+# Defining the columns of the api_power_usage_analytics table 
+ANALYTICS_COLUMNS = ['timestamp', 'endpoint', 'version'] + TARGETS + list(FORECASTS.values()) + ['created_datetime', 'updated_datetime']
+
+# Defining the ways the analytics data is created 
+MODES = ["memory", "chunked", "sql"]
+
+# Defining the indexes the watermark and the join need in the sql mode 
+INDEXES = [
+    ("power_consumption", ["timestamp"]),
+    ("api_power_usage", ["timestamp"]),
+    ("api_power_usage_analytics", ["timestamp"]),
+    ("api_power_usage_analytics", ["endpoint", "version", "timestamp"]),
+]
+
+# Defining the number of rows per chunk in the chunked mode
+DEFAULT_CHUNK_SIZE = 50000
+
+def merge_join_chunks(power_chunks: Iterator[pd.DataFrame], api_chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Inner joins two streams of chunks that are both sorted by timestamp
+
+    Only the power consumption rows that can still match the current and the 
+    following api chunks are buffered, so the memory is bounded by the chunk size
+
+    Arguments
+    ---------
+    power_chunks: iterator
+        Chunks of the power_consumption rows sorted by timestamp; One row per timestamp
+    api_chunks: iterator
+        Chunks of the api_power_usage rows sorted by timestamp
+    """
+    # The power consumption rows that were fetched but not joined yet
+    power_buffer = pd.DataFrame(columns=['timestamp'] + TARGETS)
+    power_exhausted = False
+
+    for api_chunk in api_chunks:
+        min_timestamp = api_chunk['timestamp'].iloc[0]
+        max_timestamp = api_chunk['timestamp'].iloc[-1]
+
+        # Dropping the buffered rows that are older than the api chunk
+        power_buffer = power_buffer[power_buffer['timestamp'] >= min_timestamp]
+
+        # Fetching the power consumption until it reaches past the api chunk
+        while not power_exhausted and (power_buffer.empty or power_buffer['timestamp'].iloc[-1] < max_timestamp):
+            power_chunk = next(power_chunks, None)
+            if power_chunk is None:
+                power_exhausted = True
+                break
+            power_chunk = power_chunk[power_chunk['timestamp'] >= min_timestamp]
+            power_buffer = pd.concat([power_buffer, power_chunk], ignore_index=True) if not power_buffer.empty else power_chunk
+
+        # Joining the api chunk; The order of the api rows is kept
+        joined = api_chunk.merge(power_buffer, on='timestamp', how='inner')
+        if not joined.empty:
+            yield joined
+
+        # Keeping the rows that the next api chunk can still match 
+        power_buffer = power_buffer[power_buffer['timestamp'] >= max_timestamp]
+
+def build_analytics_query(write_mode: str) -> sql.Composed:
+    """
+    Builds the set-based INSERT ... SELECT ... JOIN that appends the new joined rows to the 
+    api_power_usage_analytics table; The watermark is read inside the same statement 
+
+    The statement takes the %(lookback)s interval parameter that moves the watermark back
+
+    Arguments
+    ---------
+    write_mode: str
+        "insert" appends the rows, "upsert" updates the existing (timestamp, endpoint, version) rows
+    """
+    # Defining what happens to the existing rows
+    conflict = sql.SQL("")
+    if write_mode == "upsert":
+        conflict = sql.SQL("ON CONFLICT (timestamp, endpoint, version) DO UPDATE SET {}").format(
+            sql.SQL(", ").join(
+                sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column)) 
+                for column in ANALYTICS_COLUMNS if column not in ['timestamp', 'endpoint', 'version', 'created_datetime']
+            )
+        )
+
+    return sql.SQL("""
+        WITH watermark AS (
+            SELECT MAX(timestamp) - %(lookback)s::interval AS max_timestamp FROM api_power_usage_analytics
+        )
+        INSERT INTO api_power_usage_analytics ({columns})
+        SELECT 
+            power.timestamp, 
+            api.endpoint, 
+            api.version, 
+            {targets}, 
+            {forecasts}, 
+            now()::timestamp, 
+            now()::timestamp
+        FROM power_consumption AS power
+        JOIN api_power_usage AS api ON api.timestamp = power.timestamp
+        CROSS JOIN watermark
+        WHERE (watermark.max_timestamp IS NULL OR power.timestamp > watermark.max_timestamp) 
+        AND {not_null}
+        ORDER BY power.timestamp, api.endpoint, api.version
+        {conflict}
+    """).format(
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in ANALYTICS_COLUMNS),
+        targets=sql.SQL(", ").join(sql.SQL("power.{}").format(sql.Identifier(target)) for target in TARGETS),
+        forecasts=sql.SQL(", ").join(sql.SQL("api.{}").format(sql.Identifier(target)) for target in TARGETS),
+        not_null=sql.SQL(" AND ").join(sql.SQL("api.{} IS NOT NULL").format(sql.Identifier(target)) for target in TARGETS),
+        conflict=conflict,
+    )
+
+def write_analysis_data(conn, write_mode: str, mode: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+    """
+    Joins the power consumption after the watermark with the api forecasts and writes 
+    them to the api_power_usage_analytics table
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    write_mode: str
+        "insert" or "upsert"
+    mode: str
+        "memory", "chunked" or "sql"
+    chunk_size: int
+        The number of rows per chunk in the chunked mode
+    """
+    cursor = conn.cursor()
+
+    # Joining and inserting inside postgres in one statement
+    if mode == "sql":
+        # Checking the indexes of the watermark and the join, and the conflict target of the upserts;
+        # They are built once by migrate.py
+        for table, columns in INDEXES:
+            if find_index(cursor, table, columns) is None:
+                logging.warning(f"{table} has no index on {columns}, so the join scans it; Run `python -m migrate` to build it")
+        if write_mode == "upsert":
+            require_unique_index(conn, "api_power_usage_analytics", ['timestamp', 'endpoint', 'version'])
+
+        with timed("write_api_power_usage_analytics") as counters:
+            cursor.execute(build_analytics_query(write_mode), {"lookback": get_lookback(write_mode)})
+            logging.info(f"Wrote {cursor.rowcount} rows into api_power_usage_analytics")
+            conn.commit()
+            counters["rows"] = cursor.rowcount
         return
-    
+
     # Queryting the max date from the api_power_usage_analytics table 
-    cursor.execute("SELECT MAX(timestamp) FROM api_power_usage_analytics")
-    max_timestamp = cursor.fetchone()[0]
+    max_timestamp = get_watermark(cursor, "api_power_usage_analytics", write_mode)
+
+    # Streaming the join in bounded chunks
+    if mode == "chunked":
+        # Selecting only the needed columns, sorted by timestamp
+        power_query = sql.SQL("SELECT timestamp, {targets} FROM power_consumption WHERE %(max_timestamp)s::timestamp IS NULL OR timestamp > %(max_timestamp)s::timestamp ORDER BY timestamp").format(
+            targets=sql.SQL(", ").join(sql.Identifier(target) for target in TARGETS),
+        )
+        api_query = sql.SQL("""
+            SELECT timestamp, endpoint, version, {forecasts} FROM api_power_usage 
+            WHERE (%(max_timestamp)s::timestamp IS NULL OR timestamp > %(max_timestamp)s::timestamp) AND {not_null}
+            ORDER BY timestamp, endpoint, version
+        """).format(
+            forecasts=sql.SQL(", ").join(sql.SQL("{} AS {}").format(sql.Identifier(target), sql.Identifier(forecast)) for target, forecast in FORECASTS.items()),
+            not_null=sql.SQL(" AND ").join(sql.SQL("{} IS NOT NULL").format(sql.Identifier(target)) for target in TARGETS),
+        )
+        params = {"max_timestamp": max_timestamp}
+
+        # Merge-joining the two sorted streams and writing every joined chunk in bulk; The chunks are 
+        # written through a second connection, so the commits do not close the server-side cursors
+        power_chunks = stream_query(conn, "power_consumption_chunks", power_query, params, chunk_size)
+        api_chunks = stream_query(conn, "api_power_usage_chunks", api_query, params, chunk_size)
+        rows_written = 0
+        with borrow_connection() as write_conn:
+            for joined in merge_join_chunks(power_chunks, api_chunks):
+                now = datetime.datetime.now()
+                joined['created_datetime'] = now
+                joined['updated_datetime'] = now
+                rows_written += write_dataframe(write_conn, "api_power_usage_analytics", joined, ANALYTICS_COLUMNS, keys=['timestamp', 'endpoint', 'version'], write_mode=write_mode)
+
+        logging.info(f"Wrote {rows_written} rows into api_power_usage_analytics")
+        return
 
     # If the date is none, we will query all the data from the power_consumption table
     # and the api_power_usage tables 
     df = pd.DataFrame()
     df_api = pd.DataFrame()
-    if max_timestamp is None:
-        df = pd.read_sql("SELECT * FROM power_consumption", conn)
-        df_api = pd.read_sql("SELECT * FROM api_power_usage", conn)
-    else:
-        # Queryting the data from the power_consumption table
-        df = pd.read_sql(f"SELECT * FROM power_consumption WHERE timestamp > '{max_timestamp}'", conn)
-        df_api = pd.read_sql(f"SELECT * FROM api_power_usage WHERE timestamp > '{max_timestamp}'", conn)
+    with timed("read_tables") as counters:
+        if max_timestamp is None:
+            df = pd.read_sql("SELECT * FROM power_consumption", conn)
+            df_api = pd.read_sql("SELECT * FROM api_power_usage", conn)
+        else:
+            # Queryting the data from the power_consumption table
+            df = pd.read_sql("SELECT * FROM power_consumption WHERE timestamp > %(max_timestamp)s", conn, params={"max_timestamp": max_timestamp})
+            df_api = pd.read_sql("SELECT * FROM api_power_usage WHERE timestamp > %(max_timestamp)s", conn, params={"max_timestamp": max_timestamp})
+        counters["rows"] = df.shape[0] + df_api.shape[0]
 
     # If the dataframes are empty, we return
     if df.empty or df_api.empty:
@@ -74,11 +243,7 @@ def main():
     # Renaming the df_api columns power_usage_5_minutes_ahead to power_usage_5_minutes_ahead_forecast 
     # Renaming the df_api columns power_usage_15_minutes_ahead to power_usage_15_minutes_ahead_forecast
     # Renaming the df_api columns power_usage_60_minutes_ahead to power_usage_60_minutes_ahead_forecast
-    df_api = df_api.rename(columns={
-        'power_usage_5_minutes_ahead': 'power_usage_5_minutes_ahead_forecast',
-        'power_usage_15_minutes_ahead': 'power_usage_15_minutes_ahead_forecast',
-        'power_usage_60_minutes_ahead': 'power_usage_60_minutes_ahead_forecast'
-    })
+    df_api = df_api.rename(columns=FORECASTS)
 
     # Dropping the columns status_code, request, created_datetime, updated_datetime
     df_api = df_api.drop(columns=['response_status_code', 'request',  'created_datetime', 'updated_datetime', 'id'])
@@ -87,56 +252,71 @@ def main():
     df = df.drop(columns=['created_datetime', 'updated_datetime', 'id'])
 
     # Merging the dataframes on timestamp
-    df = df.merge(df_api, on='timestamp', how='inner')
+    with timed("join") as counters:
+        df = df.merge(df_api, on='timestamp', how='inner')
+        counters["rows"] = df.shape[0]
 
     # Sorting by timestamp, version 
     df = df.sort_values(['timestamp', 'endpoint', 'version'])
 
     # Dropping the rows with None forecasts 
-    df = df.dropna(subset=['power_usage_5_minutes_ahead_forecast', 'power_usage_15_minutes_ahead_forecast', 'power_usage_60_minutes_ahead_forecast'])
-
-    # Uploading the data to psql 
-    for i, row in tqdm(df.iterrows(), total=df.shape[0], desc="Uploading the data to PSQL"):
-        # Extracting the row as a dictionary
-        row_dict = row.to_dict()
-
-        # Getting the current date 
-        now = datetime.datetime.now()
-
-        # Creating the query 
-        query = f"""
-            INSERT INTO api_power_usage_analytics (
-                timestamp, 
-                endpoint, 
-                version, 
-                power_usage_5_minutes_ahead,
-                power_usage_15_minutes_ahead,
-                power_usage_60_minutes_ahead,
-                power_usage_5_minutes_ahead_forecast, 
-                power_usage_15_minutes_ahead_forecast, 
-                power_usage_60_minutes_ahead_forecast,
-                created_datetime,
-                updated_datetime
-            ) VALUES (
-                '{row_dict['timestamp']}', 
-                '{row_dict['endpoint']}', 
-                '{row_dict['version']}', 
-                {row_dict['power_usage_5_minutes_ahead']},
-                {row_dict['power_usage_15_minutes_ahead']},
-                {row_dict['power_usage_60_minutes_ahead']},
-                {row_dict['power_usage_5_minutes_ahead_forecast']}, 
-                {row_dict['power_usage_15_minutes_ahead_forecast']}, 
-                {row_dict['power_usage_60_minutes_ahead_forecast']},
-                '{now}',
-                '{now}'
-            )
-        """
+    df = df.dropna(subset=list(FORECASTS.values()))
+
+    # Adding the creation and update datetimes
+    now = datetime.datetime.now()
+    df['created_datetime'] = now
+    df['updated_datetime'] = now
+
+    # Writing the data to psql in bulk
+    write_dataframe(
+        conn, 
+        "api_power_usage_analytics", 
+        df, 
+        ANALYTICS_COLUMNS,
+        keys=['timestamp', 'endpoint', 'version'],
+        write_mode=write_mode
+    )
+
+def main(write_mode: Union[str, None] = None, mode: Union[str, None] = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Function that joins the power consumption with the api forecasts into the api_power_usage_analytics table
+
+    Arguments
+    ---------
+    write_mode: str
+        "insert" appends the rows after the watermark, "upsert" reprocesses the last 
+        PSQL_UPSERT_LOOKBACK_MINUTES before it; Defaults to the PSQL_WRITE_MODE variable
+    mode: str
+        "memory" reads both tables into pandas, "chunked" streams them sorted through 
+        server-side cursors and merge-joins and writes them chunk by chunk, "sql" runs the 
+        join inside postgres as one INSERT ... SELECT; Defaults to the ANALYSIS_DATA_MODE 
+        variable or "memory"
+    chunk_size: int
+        The number of rows per chunk in the chunked mode
+    """
+    # Loading the settings once per process
+    get_config()
+
+    # Resolving the write mode
+    write_mode = get_write_mode(write_mode)
 
-        # Executing the query 
-        cursor.execute(query)
+    # Resolving the mode
+    if mode is None:
+        mode = os.getenv("ANALYSIS_DATA_MODE", "memory")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}; Expected one of {MODES}")
+
+    # Connecting to psql through the shared pool
+    try:
+        get_connection_pool()
+        logging.info("Connected to PSQL")
+    except:
+        logging.warn("Could not connect to PSQL")
+        return
 
-    # Commiting the changes 
-    conn.commit()
+    # Borrowing a connection and returning it when the stage is done
+    with borrow_connection() as conn:
+        write_analysis_data(conn, write_mode, mode, chunk_size)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,274 @@
+# Input/output stream
+import io
+
+# Typehinting 
+from typing import Union, Dict, List
+
+# Json metadata 
+import json
+
+# Date wrangling 
+import datetime
+
+# Dataframes
+import pandas as pd 
+
+# Parquet reading and writing 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Importing the minute keys
+from aggregation import MINUTE_KEYS, SOURCE_KEYS, VARIABLES, PARTIAL_COLUMNS
+from blobs import FEATURE_BLOB_DATE_FORMAT, FEATURE_PARTITION_FORMAT, get_feature_blob_dates
+
+# Defining the number of rows per row group; One day of minutes 
+ROW_GROUP_SIZE = 24 * 60
+
+# Defining the metadata key listing the files a compacted file replaces
+COMPACTED_FROM_KEY = b"compacted_from"
+
+# Defining the format of the run stamp in the names of the feature files 
+RUN_STAMP_FORMAT = "%Y%m%d%H%M%S%f"
+
+def write_features_parquet(features: pd.DataFrame, compacted_from: Union[list, None] = None) -> bytes:
+    """
+    Serializes the per minute features to parquet bytes
+
+    A timestamp column is added and the rows are sorted by it, so the min/max 
+    statistics of each row group (one day of minutes) let the readers skip the 
+    row groups before their watermark
+
+    Arguments
+    ---------
+    features: pd.DataFrame
+        Dataframe with the minute keys and the aggregated variables
+    compacted_from: list
+        The names of the feature files this file replaces; Stored in the metadata of the file
+    """
+    # Adding the timestamp of the minute
+    features = features.copy()
+    features["timestamp"] = pd.to_datetime(features[MINUTE_KEYS])
+
+    # Sorting the rows by the timestamp
+    features = features.sort_values("timestamp").reset_index(drop=True)
+
+    # Recording the replaced files in the metadata
+    table = pa.Table.from_pandas(features, preserve_index=False)
+    if compacted_from is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), COMPACTED_FROM_KEY: json.dumps(compacted_from).encode("utf-8")})
+
+    # Writing the table with statistics
+    buffer = io.BytesIO()
+    pq.write_table(
+        table, 
+        buffer, 
+        row_group_size=ROW_GROUP_SIZE, 
+        write_statistics=True, 
+        compression="snappy"
+    )
+
+    # Returning the parquet bytes
+    return buffer.getvalue()
+
+def read_features_parquet(data: bytes, columns: Union[list, None] = None, min_timestamp: Union[datetime.datetime, None] = None) -> pd.DataFrame:
+    """
+    Reads the per minute features from parquet bytes, only reading the requested 
+    columns and the row groups with minutes after min_timestamp
+
+    Files written before the timestamp column existed are read whole and filtered in memory
+
+    Arguments
+    ---------
+    data: bytes
+        The parquet bytes
+    columns: list
+        The columns to read; If None, all the columns are read
+    min_timestamp: datetime
+        Only the minutes strictly after this timestamp are returned; If None, all the minutes are returned
+    """
+    # Opening the file without reading the data
+    parquet_file = pq.ParquetFile(io.BytesIO(data))
+    schema_names = parquet_file.schema_arrow.names
+
+    # Pushing the projection and the predicate down to the parquet reader
+    if "timestamp" in schema_names:
+        filters = [("timestamp", ">", pd.Timestamp(min_timestamp))] if min_timestamp is not None else None
+        table = pq.read_table(io.BytesIO(data), columns=columns, filters=filters)
+        return table.to_pandas()
+
+    # Reading the legacy files with the projection only
+    read_columns = None
+    if columns is not None:
+        read_columns = [column for column in columns if column in schema_names]
+        if min_timestamp is not None:
+            read_columns = list(dict.fromkeys(read_columns + MINUTE_KEYS))
+    features = parquet_file.read(columns=read_columns).to_pandas()
+
+    # Filtering the minutes after min_timestamp
+    if min_timestamp is not None:
+        features = features[pd.to_datetime(features[MINUTE_KEYS]) > min_timestamp]
+
+    # Returning the requested columns
+    if columns is not None:
+        features = features[[column for column in columns if column in features.columns]]
+    return features.reset_index(drop=True)
+
+def read_feature_partials(data: bytes, blob_name: str, min_timestamp: Union[datetime.datetime, None] = None) -> pd.DataFrame:
+    """
+    Reads the per minute sums and counts of every capture blob from parquet bytes, only reading 
+    the row groups with minutes after min_timestamp
+
+    Files written before the rows were kept per capture blob are read as the only run of a 
+    source of their own, the feature file, so they are never superseded
+
+    Files written before the sums and counts were stored only hold the means; Every minute of 
+    them is read as one reading, so they weigh like they did when the means were averaged. Files 
+    written before the counts of the variables were stored only hold readings with every variable, 
+    so their variables are counted with the reading count. The other statistics missing in older 
+    files are read as missing
+
+    Arguments
+    ---------
+    data: bytes
+        The parquet bytes
+    blob_name: str
+        The name of the feature file
+    min_timestamp: datetime
+        Only the minutes strictly after this timestamp are returned; If None, all the minutes are returned
+    """
+    schema_names = pq.ParquetFile(io.BytesIO(data)).schema_arrow.names
+    if "count" in schema_names:
+        features = read_features_parquet(data, columns=MINUTE_KEYS + [column for column in SOURCE_KEYS + PARTIAL_COLUMNS if column in schema_names], min_timestamp=min_timestamp)
+    else:
+        # Converting the means of the legacy files
+        features = read_features_parquet(data, columns=MINUTE_KEYS + VARIABLES, min_timestamp=min_timestamp)
+        for variable in VARIABLES:
+            features[f"{variable}_sum"] = features[variable]
+            features[f"{variable}_sumsq"] = features[variable] * features[variable]
+            features[f"{variable}_min"] = features[variable]
+            features[f"{variable}_max"] = features[variable]
+        features["count"] = 1
+
+    # Attributing the rows of the older files to the file itself
+    if "source_blob" not in features.columns:
+        features["source_blob"] = blob_name
+        features["source_run"] = ""
+
+    # Counting the variables of the older files with the reading count
+    for variable in VARIABLES:
+        if f"{variable}_count" not in features.columns:
+            features[f"{variable}_count"] = features["count"]
+
+    # Marking the statistics the file does not hold as missing
+    for column in PARTIAL_COLUMNS:
+        if column not in features.columns:
+            features[column] = float("nan")
+    return features[MINUTE_KEYS + SOURCE_KEYS + PARTIAL_COLUMNS]
+
+def get_compacted_from(data: bytes) -> list:
+    """
+    Returns the names of the feature files a compacted file replaces; Empty for the other files
+
+    Arguments
+    ---------
+    data: bytes
+        The parquet bytes
+    """
+    metadata = pq.ParquetFile(io.BytesIO(data)).schema_arrow.metadata or {}
+    if COMPACTED_FROM_KEY not in metadata:
+        return []
+    return json.loads(metadata[COMPACTED_FROM_KEY])
+
+def drop_compacted(partials: Dict[str, pd.DataFrame], compacted_from: Dict[str, list]) -> List[pd.DataFrame]:
+    """
+    Leaves out the minutes that a compacted file already holds
+
+    A compacted file of a day replaces that day of the files it was merged from; Until the 
+    compaction deletes them, a reader can see both and would count their readings twice
+
+    Arguments
+    ---------
+    partials: Dict[str, pd.DataFrame]
+        The sums and counts of every read feature file
+    compacted_from: Dict[str, list]
+        The files every compacted file replaces, see get_compacted_from
+    """
+    # Collecting the replaced days of every file
+    superseded = {}
+    for blob_name, sources in compacted_from.items():
+        day = get_feature_blob_dates(blob_name)[0].date()
+        for source in sources:
+            superseded.setdefault(source, set()).add(day)
+
+    # Dropping the replaced days
+    remaining = []
+    for blob_name, file_partials in partials.items():
+        days = superseded.get(blob_name)
+        if days:
+            dates = pd.to_datetime(file_partials[["year", "month", "day"]]).dt.date
+            file_partials = file_partials[~dates.isin(days)]
+        remaining.append(file_partials)
+
+    return remaining
+
+def drop_superseded(partials: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps only the rows of the latest run of every capture blob
+
+    A capture blob that is aggregated again, because it changed, a full backfill reprocessed it or 
+    the upload of its run failed half way, is written to a new feature file next to the rows of its 
+    earlier runs; Only its latest run is counted. The rows of a run that several files hold (a 
+    compacted file and the files it was merged from) are kept once
+
+    Arguments
+    ---------
+    partials: pd.DataFrame
+        The sums and counts of the read feature files, with the source keys
+    """
+    latest = partials.groupby("source_blob")["source_run"].transform("max")
+    partials = partials[partials["source_run"] == latest]
+    return partials.drop_duplicates(subset=MINUTE_KEYS + SOURCE_KEYS, ignore_index=True)
+
+def get_feature_file_name(aggregated_feature_path: str, features: pd.DataFrame, run_stamp: Union[datetime.datetime, None] = None) -> str:
+    """
+    Creates the name of a feature file of one day: 
+    <path>/year=YYYY/month=MM/day=DD/<min_date>_<max_date>_<run stamp>.parquet
+
+    The run stamp keeps the files of different runs over the same minutes apart
+
+    Arguments
+    ---------
+    aggregated_feature_path: str
+        The folder of the feature files
+    features: pd.DataFrame
+        The features of one day with the minute keys
+    run_stamp: datetime
+        The time of the run; Defaults to now
+    """
+    if run_stamp is None:
+        run_stamp = datetime.datetime.now()
+
+    date = pd.to_datetime(features[MINUTE_KEYS])
+    min_date, max_date = date.min(), date.max()
+    return f"{aggregated_feature_path}/{min_date.strftime(FEATURE_PARTITION_FORMAT)}{min_date.strftime(FEATURE_BLOB_DATE_FORMAT)}_{max_date.strftime(FEATURE_BLOB_DATE_FORMAT)}_{run_stamp.strftime(RUN_STAMP_FORMAT)}.parquet"
+
+def split_feature_files(aggregated_feature_path: str, features: pd.DataFrame, run_stamp: Union[datetime.datetime, None] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Splits the features into the files of their day partitions; Returns the features of every file name
+
+    Arguments
+    ---------
+    aggregated_feature_path: str
+        The folder of the feature files
+    features: pd.DataFrame
+        The features with the minute keys
+    run_stamp: datetime
+        The time of the run; Defaults to now
+    """
+    if run_stamp is None:
+        run_stamp = datetime.datetime.now()
+
+    return {
+        get_feature_file_name(aggregated_feature_path, day_features, run_stamp): day_features.reset_index(drop=True)
+        for _, day_features in features.groupby(["year", "month", "day"])
+    }
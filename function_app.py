@@ -1,11 +1,23 @@
+import os
 import logging
 import azure.functions as func
 
 # Importing the main functions
 from aggregate_features import main as aggregate_features
 from aggregate_to_timeseries import main as aggregate_to_timeseries
+from aggregate_to_rollups import main as aggregate_to_rollups
 from aggregate_to_power_consumption import main as aggregate_to_power_consumption
 from create_analysis_data import main as create_analysis_data
+from compact_features import main as compact_features
+from pipeline import main as run_pipeline
+from async_pipeline import main as run_async_pipeline
+
+# Run metrics
+import metrics
+from resources import get_config, get_container_client
+
+# Defining the ways the stages are run
+PIPELINE_MODES = ["dag", "async", "sequential"]
 
 app = func.FunctionApp()
 
@@ -15,16 +27,47 @@ def timer_trigger_electricity(myTimer: func.TimerRequest) -> None:
     if myTimer.past_due:
         logging.info('The timer is past due!')
 
-    aggregate_features(delta_hours=24)
-    logging.info('Aggregate features executed.')
-    
-    aggregate_to_timeseries()
-    logging.info('Aggregate to timeseries executed.')
+    # Running the stages as one pipeline that hands the data over in memory
+    pipeline_mode = os.getenv("PIPELINE_MODE", "dag")
+    if pipeline_mode not in PIPELINE_MODES:
+        raise ValueError(f"Unknown pipeline mode {pipeline_mode}; Expected one of {PIPELINE_MODES}")
+    if pipeline_mode == "dag":
+        run_pipeline(delta_hours=24)
+        logging.info('Python timer trigger function executed.')
+        return
+
+    # Running the same pipeline on an event loop with the async blob and PSQL clients
+    if pipeline_mode == "async":
+        run_async_pipeline(delta_hours=24)
+        logging.info('Python timer trigger function executed.')
+        return
+
+    metrics.start_run()
+    try:
+        with metrics.stage("aggregate_features"):
+            aggregate_features(delta_hours=24)
+        logging.info('Aggregate features executed.')
+        
+        with metrics.stage("aggregate_to_timeseries"):
+            aggregate_to_timeseries()
+        logging.info('Aggregate to timeseries executed.')
+
+        with metrics.stage("aggregate_to_rollups"):
+            aggregate_to_rollups()
+        logging.info('Aggregate to rollups executed.')
+
+        with metrics.stage("compact_features"):
+            compact_features(days=2)
+        logging.info('Compact features executed.')
 
-    aggregate_to_power_consumption()
-    logging.info('Aggregate to power consumption executed.')
+        with metrics.stage("aggregate_to_power_consumption"):
+            aggregate_to_power_consumption()
+        logging.info('Aggregate to power consumption executed.')
 
-    create_analysis_data()
-    logging.info('Create analysis data executed.')
+        with metrics.stage("create_analysis_data"):
+            create_analysis_data()
+        logging.info('Create analysis data executed.')
+    finally:
+        # Logging and uploading the run report
+        metrics.finish_run(get_container_client(), get_config()["metrics_report_path"])
     logging.info('Python timer trigger function executed.')
-    
\ No newline at end of file
@@ -0,0 +1,110 @@
+# Json serialization 
+import json
+
+# Typehinting 
+from typing import Union
+
+# Importing logging 
+import logging
+
+# Azure errors 
+from azure.core.exceptions import ResourceNotFoundError
+
+# Defining the default name of the manifest blob 
+DEFAULT_MANIFEST_PATH = "manifests/aggregate_features.json"
+
+def load_manifest(container_client, manifest_path: str) -> dict:
+    """
+    Loads the manifest of the processed blobs; Returns an empty manifest if it does not exist
+
+    The manifest maps every processed blob name to its etag and last modified time
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client where the manifest is stored
+    manifest_path: str
+        The name of the manifest blob
+    """
+    try:
+        manifest = json.loads(container_client.download_blob(manifest_path).readall())
+    except ResourceNotFoundError:
+        logging.info(f"No manifest found at {manifest_path}; Processing all the blobs")
+        return {}
+
+    # Returning the processed blobs
+    return manifest.get("blobs", {})
+
+def save_manifest(container_client, manifest_path: str, manifest: dict) -> None:
+    """
+    Saves the manifest of the processed blobs, overwriting the previous one
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client where the manifest is stored
+    manifest_path: str
+        The name of the manifest blob
+    manifest: dict
+        The processed blobs
+    """
+    container_client.upload_blob(name=manifest_path, data=json.dumps({"blobs": manifest}), overwrite=True)
+
+def get_blob_entry(blob) -> dict:
+    """
+    Creates the manifest entry of a listed blob
+
+    Arguments
+    ---------
+    blob: BlobProperties
+        The listed blob
+    """
+    last_modified = blob.last_modified.isoformat() if blob.last_modified is not None else None
+    return {"etag": blob.etag, "last_modified": last_modified}
+
+def get_unprocessed_blobs(blobs: list, manifest: dict) -> list:
+    """
+    Leaves only the blobs that are not in the manifest or changed since they were processed;
+    Late arriving blobs are not in the manifest yet, so they are picked up as well. The rows of a 
+    changed blob that is aggregated again supersede the ones of its earlier runs in the feature 
+    files, see feature_store.drop_superseded
+
+    Arguments
+    ---------
+    blobs: list
+        List of the listed blob properties
+    manifest: dict
+        The processed blobs
+    """
+    return [blob for blob in blobs if manifest.get(blob.name) != get_blob_entry(blob)]
+
+def update_manifest(manifest: dict, processed_blobs: list, listed_blobs: Union[list, None] = None) -> dict:
+    """
+    Adds the processed blobs to the manifest
+
+    If the listed blobs are given, the entries of the blobs that fell out of the 
+    listed window are dropped so the manifest does not grow forever
+
+    Arguments
+    ---------
+    manifest: dict
+        The processed blobs
+    processed_blobs: list
+        List of the blob properties processed in this run
+    listed_blobs: list
+        List of the blob properties of the current window
+    """
+    # Copying the manifest
+    manifest = dict(manifest)
+
+    # Dropping the blobs outside of the window
+    if listed_blobs is not None:
+        listed_names = set(blob.name for blob in listed_blobs)
+        manifest = {name: entry for name, entry in manifest.items() if name in listed_names}
+
+    # Adding the processed blobs
+    for blob in processed_blobs:
+        manifest[blob.name] = get_blob_entry(blob)
+
+    # Returning the updated manifest
+    return manifest
@@ -0,0 +1,224 @@
+# Timing
+import time
+
+# Date wrangling
+import datetime
+
+# Run report serialization
+import json
+
+# Thread safe collection
+import threading
+
+# Stage of the current thread or asyncio task
+import contextvars
+
+# Context managers
+from contextlib import contextmanager
+
+# Importing logging
+import logging
+
+# Typehinting
+from typing import Callable, Iterator, Union
+
+# OpenTelemetry is optional; Without it only the json run report is created
+try:
+    from opentelemetry import trace, context as otel_context
+    _tracer = trace.get_tracer("electricity_features")
+except ImportError:
+    trace = None
+    otel_context = None
+    _tracer = None
+
+# Defining the stage of the steps that run outside of any stage
+DEFAULT_STAGE = "main"
+
+# Defining the date format in the names of the run reports
+REPORT_DATE_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+# The stage of the current thread; Every asyncio task keeps the stage it was created in
+_stage = contextvars.ContextVar("stage", default=None)
+
+# The report of the current run
+_report = None
+_report_lock = threading.Lock()
+
+class RunReport:
+    """
+    Collects the durations and the counters (rows, bytes, records, ...) of the steps of every stage of a run
+    """
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, step: str, seconds: float, counters: dict) -> None:
+        """
+        Adds one call of a step
+        """
+        with self.lock:
+            entry = self.stages.setdefault(stage, {}).setdefault(step, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            for name, value in counters.items():
+                entry[name] = entry.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        """
+        Creates the machine readable report; Every counter also gets its rate per second of the step
+        """
+        with self.lock:
+            stages = {}
+            for stage, steps in self.stages.items():
+                stage_steps = {}
+                for step, entry in steps.items():
+                    entry = dict(entry)
+                    for name in [name for name in entry if name not in ("calls", "seconds")]:
+                        if entry["seconds"] > 0:
+                            entry[f"{name}_per_second"] = entry[name] / entry["seconds"]
+                    stage_steps[step] = entry
+
+                # The stage total is the wall time of the stage if it was timed, otherwise the sum of its steps
+                total = steps.get("total", {}).get("seconds", sum(entry["seconds"] for entry in steps.values()))
+                stages[stage] = {"seconds": total, "steps": stage_steps}
+
+        return {
+            "started": self.started.isoformat(),
+            "seconds": time.perf_counter() - self.start_time,
+            "stages": stages,
+        }
+
+def start_run() -> RunReport:
+    """
+    Starts a new run report; The steps timed afterwards are added to it
+    """
+    global _report
+    with _report_lock:
+        _report = RunReport()
+    return _report
+
+def get_report() -> RunReport:
+    """
+    Returns the report of the current run, starting one if there is none
+    """
+    global _report
+    with _report_lock:
+        if _report is None:
+            _report = RunReport()
+    return _report
+
+def finish_run(container_client=None, report_path: Union[str, None] = None) -> dict:
+    """
+    Ends the current run, logs its report as one json line and uploads it if a path is given
+
+    Arguments
+    ---------
+    container_client: ContainerClient
+        The container client the report is uploaded to
+    report_path: str
+        The folder of the run reports; The report is named after the start of the run
+    """
+    global _report
+    report = get_report().to_dict()
+    with _report_lock:
+        _report = None
+
+    # Logging the report so it ends up in the function logs
+    logging.info(f"Run report: {json.dumps(report)}")
+
+    # Uploading the report so the runs can be compared across deploys
+    if container_client is not None and report_path:
+        started = datetime.datetime.fromisoformat(report["started"])
+        try:
+            container_client.upload_blob(
+                name=f"{report_path}/{started.strftime(REPORT_DATE_FORMAT)}.json",
+                data=json.dumps(report, indent=2),
+                overwrite=True
+            )
+        except Exception as error:
+            logging.warning(f"Could not upload the run report: {error}")
+
+    return report
+
+def current_stage() -> str:
+    """
+    Returns the stage of the current thread
+    """
+    return _stage.get() or DEFAULT_STAGE
+
+@contextmanager
+def _span(name: str):
+    # Creating an OpenTelemetry span if the package is installed
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name) as span:
+        yield span
+
+@contextmanager
+def stage(name: str) -> Iterator[dict]:
+    """
+    Runs the block as a stage; The steps timed in the block are reported under the stage and
+    the wall time of the block is reported as its "total" step
+    """
+    token = _stage.set(name)
+    try:
+        with timed("total") as counters:
+            yield counters
+    finally:
+        _stage.reset(token)
+
+@contextmanager
+def timed(step: str, **counters) -> Iterator[dict]:
+    """
+    Times the block as a step of the current stage
+
+    Yields a dict the block can add its counters to, for example counters["rows"] = len(df)
+
+    Arguments
+    ---------
+    step: str
+        The name of the step
+    counters: dict
+        Counters that are known before the block runs
+    """
+    counters = dict(counters)
+    stage_name = current_stage()
+    with _span(f"{stage_name}.{step}") as span:
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            seconds = time.perf_counter() - start
+            get_report().add(stage_name, step, seconds, counters)
+            if span is not None:
+                for name, value in counters.items():
+                    span.set_attribute(name, value)
+
+def count(step: str, seconds: float = 0.0, **counters) -> None:
+    """
+    Adds the counters of a step of the current stage that was timed elsewhere
+    """
+    get_report().add(current_stage(), step, seconds, counters)
+
+def bind_stage(fn: Callable) -> Callable:
+    """
+    Wraps the function so it reports under the current stage (and OpenTelemetry span)
+    when it runs on another thread
+    """
+    stage_name = current_stage()
+    parent = otel_context.get_current() if otel_context is not None else None
+
+    def wrapper(*args, **kwargs):
+        stage_token = _stage.set(stage_name)
+        token = otel_context.attach(parent) if parent is not None else None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if token is not None:
+                otel_context.detach(token)
+            _stage.reset(stage_token)
+
+    return wrapper
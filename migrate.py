@@ -0,0 +1,96 @@
+# Arg parsing
+import argparse
+
+# Importing logging
+import logging
+
+# Shared connections
+from resources import get_config, get_connection_pool, borrow_connection
+
+# The tables of the pipeline
+from aggregate_to_rollups import ROLLUPS, ensure_rollup_tables
+from create_analysis_data import INDEXES
+
+# Index management
+from psql import find_index, count_duplicates, remove_duplicates, create_index
+
+# Defining the unique indexes the upserts of every table need
+UNIQUE_INDEXES = [
+    ("electricity_timeseries", ["timestamp"]),
+    ("power_consumption", ["timestamp"]),
+    ("api_power_usage_analytics", ["timestamp", "endpoint", "version"]),
+] + [(table, ["timestamp"]) for table in ROLLUPS]
+
+def migrate(conn, remove_duplicate_rows: bool = False) -> None:
+    """
+    Creates the rollup tables and builds the indexes of the pipeline that do not exist yet
+
+    The indexes are built with CREATE INDEX CONCURRENTLY, so the tables stay writable while they
+    build; A table that holds duplicate keys fails with the number of duplicates, unless they are
+    removed first
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    remove_duplicate_rows: bool
+        If True, the rows that repeat the keys of a newer row are deleted before the unique index is built
+    """
+    ensure_rollup_tables(conn)
+
+    # Building the conflict targets of the upserts
+    for table, keys in UNIQUE_INDEXES:
+        with conn.cursor() as cursor:
+            if find_index(cursor, table, keys, unique=True) is not None:
+                continue
+            duplicates = count_duplicates(cursor, table, keys)
+        if duplicates > 0:
+            if not remove_duplicate_rows:
+                raise ValueError(
+                    f"{table} holds {duplicates} duplicate rows of {keys}; Rerun with --remove_duplicates "
+                    f"to keep only the newest row of every key"
+                )
+            remove_duplicates(conn, table, keys)
+        create_index(conn, table, keys, unique=True)
+
+    # Building the indexes of the watermarks and the joins of the analysis data
+    for table, columns in INDEXES:
+        with conn.cursor() as cursor:
+            if find_index(cursor, table, columns) is not None:
+                continue
+        create_index(conn, table, columns)
+
+def main(remove_duplicate_rows: bool = False) -> None:
+    """
+    Function that prepares the database for the pipeline; Run it once before the first upsert and
+    after every deploy that adds a table
+
+    Arguments
+    ---------
+    remove_duplicate_rows: bool
+        If True, the duplicate keys are removed before the unique indexes are built
+    """
+    # Loading the settings once per process
+    get_config()
+
+    # Connecting to psql through the shared pool
+    try:
+        get_connection_pool()
+        logging.info("Connected to PSQL")
+    except:
+        logging.warn("Could not connect to PSQL")
+        return
+
+    # Borrowing a connection and returning it when the migration is done
+    with borrow_connection() as conn:
+        migrate(conn, remove_duplicate_rows)
+
+    logging.info("The migration was successfull")
+
+if __name__ == '__main__':
+    # Creating the argument parser
+    parser = argparse.ArgumentParser(description="Create the tables and build the indexes of the pipeline")
+    parser.add_argument("--remove_duplicates", action="store_true", help="Keep only the newest row of every duplicate key before building the unique indexes")
+    args = parser.parse_args()
+
+    main(remove_duplicate_rows=args.remove_duplicates)
@@ -0,0 +1,395 @@
+# OS traversal
+import os
+
+# Concurrent durable writes
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# Importing logging
+import logging
+
+# Typehinting
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+# Shared clients and connections
+from resources import get_config, get_container_client, get_connection_pool, borrow_connection
+
+# The stages
+from manifest import DEFAULT_MANIFEST_PATH
+from aggregate_features import aggregate_new_blobs, upload_features
+from compact_features import compact_features
+from feature_store import split_feature_files
+from aggregate_to_timeseries import build_timeseries, TIMESERIES_COLUMNS
+from aggregate_to_rollups import build_rollups, write_rollups
+from aggregate_to_power_consumption import build_power_consumption, write_power_consumption, POWER_CONSUMPTION_COLUMNS, ENGINES
+from create_analysis_data import write_analysis_data, MODES, DEFAULT_CHUNK_SIZE
+
+# Bulk writing to PSQL
+from psql import get_write_mode, write_dataframe
+
+# Run metrics
+import metrics
+
+# Defining the default number of threads running the durable writes
+DEFAULT_WRITE_WORKERS = 4
+
+class Stage:
+    """
+    A step of the pipeline
+
+    Arguments
+    ---------
+    name: str
+        The name of the stage
+    run: Callable
+        Called with the PipelineRun; Reads its inputs with run.get and hands its outputs over
+        with run.put (in memory values) or run.submit_write (durable writes)
+    inputs: Iterable[str]
+        The names of the values and writes the stage reads
+    outputs: Iterable[str]
+        The names of the values and writes the stage produces
+    """
+    def __init__(self, name: str, run: Callable, inputs: Iterable[str] = (), outputs: Iterable[str] = ()):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+class PipelineRun:
+    """
+    Holds the in memory values and the pending durable writes of one run of the pipeline
+
+    Arguments
+    ---------
+    executor: ThreadPoolExecutor
+        The executor running the durable writes
+    """
+    def __init__(self, executor: ThreadPoolExecutor):
+        self.executor = executor
+        self.values = {}
+        self.writes = {}
+
+    def put(self, name: str, value: Any) -> None:
+        """
+        Hands a value over to the downstream stages
+        """
+        self.values[name] = value
+
+    def submit_write(self, name: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Starts a durable write in the background; The downstream stages that read it wait for it to finish
+        """
+        logging.info(f"Started the write {name}")
+        self.writes[name] = self.executor.submit(metrics.bind_stage(fn), *args, **kwargs)
+        return self.writes[name]
+
+    def get(self, name: str) -> Any:
+        """
+        Returns an in memory value or waits for a durable write and returns its result;
+        A failed write raises its exception
+        """
+        if name in self.values:
+            return self.values[name]
+
+        # Reporting how long the stage was blocked by the write
+        with metrics.timed(f"wait_{name}"):
+            return self.writes[name].result()
+
+    def wait(self) -> None:
+        """
+        Waits for all the durable writes and raises the first failure
+        """
+        errors = []
+        for name, future in self.writes.items():
+            try:
+                future.result()
+                logging.info(f"Finished the write {name}")
+            except Exception as error:
+                logging.error(f"The write {name} failed: {error}")
+                errors.append(error)
+        if len(errors) > 0:
+            raise errors[0]
+
+def sort_stages(stages: List[Stage]) -> List[Stage]:
+    """
+    Orders the stages so every stage runs after the stages producing its inputs
+
+    Arguments
+    ---------
+    stages: List[Stage]
+        The stages in any order
+    """
+    # Mapping every output to the stage producing it
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"{output} is produced by both {producers[output].name} and {stage.name}")
+            producers[output] = stage
+
+    # Visiting the stages depth first
+    ordered, visiting, visited = [], set(), set()
+    def visit(stage: Stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"The stage {stage.name} depends on itself")
+        visiting.add(stage.name)
+        for name in stage.inputs:
+            if name not in producers:
+                raise ValueError(f"No stage produces {name}, the input of {stage.name}")
+            visit(producers[name])
+        visiting.discard(stage.name)
+        visited.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+
+    return ordered
+
+def run_stages(stages: List[Stage], write_workers: int = DEFAULT_WRITE_WORKERS) -> Dict[str, Any]:
+    """
+    Runs the stages one after the other while their durable writes run in the background
+
+    Returns the in memory values of the run
+
+    Arguments
+    ---------
+    stages: List[Stage]
+        The stages of the pipeline
+    write_workers: int
+        The number of threads running the durable writes
+    """
+    with ThreadPoolExecutor(max_workers=write_workers) as executor:
+        run = PipelineRun(executor)
+        try:
+            for stage in sort_stages(stages):
+                logging.info(f"Running the stage {stage.name}")
+                with metrics.stage(stage.name):
+                    stage.run(run)
+
+                # Every declared output has to be handed over
+                missing = [output for output in stage.outputs if output not in run.values and output not in run.writes]
+                if len(missing) > 0:
+                    raise ValueError(f"The stage {stage.name} did not produce {missing}")
+        except BaseException:
+            # Letting the started writes finish; Their failures are only logged, so the failure of the stage is raised
+            try:
+                run.wait()
+            except Exception:
+                pass
+            raise
+
+        # Waiting for the writes; The first failed write fails the run
+        run.wait()
+
+    return run.values
+
+def build_stages(
+        container_client,
+        aggregated_feature_path: str,
+        delta_hours: Union[int, None],
+        write_mode: str,
+        engine: str,
+        mode: str,
+        download_workers: int = 8,
+        full_backfill: bool = False,
+        manifest_path: str = DEFAULT_MANIFEST_PATH,
+        chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> List[Stage]:
+    """
+    Creates the stages of the electricity pipeline
+
+    The features, the timeseries minutes and the power consumption sums are handed over in memory;
+    The feature files, the electricity_timeseries rows and the power_consumption rows are written in
+    the background while the next stage computes; The rollup tables are recomputed from the same
+    feature files and the in memory features; The day partitions of the window are compacted in the
+    background once the timeseries and rollup stages have read them
+    """
+    def features_stage(run: PipelineRun):
+        features, manifest = aggregate_new_blobs(container_client, delta_hours, download_workers, full_backfill, manifest_path)
+        feature_files = {}
+        if features is not None:
+            feature_files = split_feature_files(aggregated_feature_path, features)
+            run.submit_write("feature_blob", upload_features, container_client, feature_files, manifest_path, manifest)
+        else:
+            run.put("feature_blob", None)
+        run.put("features", features)
+        run.put("feature_blob_names", list(feature_files))
+
+    def timeseries_stage(run: PipelineRun):
+        with borrow_connection() as conn:
+            timeseries = build_timeseries(
+                conn,
+                container_client,
+                aggregated_feature_path,
+                write_mode,
+                download_workers,
+                features=run.get("features"),
+                exclude_blobs=run.get("feature_blob_names")
+            )
+        if timeseries is not None:
+            run.submit_write("electricity_timeseries", write_table, "electricity_timeseries", timeseries, TIMESERIES_COLUMNS, write_mode)
+        else:
+            run.put("electricity_timeseries", None)
+        run.put("timeseries", timeseries)
+
+    def rollup_stage(run: PipelineRun):
+        with borrow_connection() as conn:
+            rollups = build_rollups(
+                conn,
+                container_client,
+                aggregated_feature_path,
+                write_mode,
+                download_workers,
+                features=run.get("features"),
+                exclude_blobs=run.get("feature_blob_names")
+            )
+        if rollups is not None:
+            run.submit_write("rollup_tables", write_rollup_tables, rollups)
+        else:
+            run.put("rollup_tables", None)
+        run.put("rollups", rollups)
+
+    def compaction_stage(run: PipelineRun):
+        # Merging the files of the days the run wrote to, once they are uploaded
+        run.get("feature_blob")
+        days = None if delta_hours is None else delta_hours // 24 + 1
+        run.submit_write("compacted_features", compact_features, container_client, aggregated_feature_path, days, download_workers=download_workers)
+
+    def power_consumption_stage(run: PipelineRun):
+        # The sql engine reads the minutes from the table, so their write has to finish first
+        if engine == "sql":
+            run.get("electricity_timeseries")
+            run.submit_write("power_consumption", write_sql_power_consumption, write_mode)
+            return
+
+        with borrow_connection() as conn:
+            power_consumption = build_power_consumption(conn, write_mode, timeseries=run.get("timeseries"))
+
+        # The sums follow the minutes, so they are only written once the minutes are; A failed write stops the stage
+        run.get("electricity_timeseries")
+        if power_consumption is not None:
+            run.submit_write("power_consumption", write_table, "power_consumption", power_consumption, POWER_CONSUMPTION_COLUMNS, write_mode)
+        else:
+            run.put("power_consumption", None)
+
+    def analysis_stage(run: PipelineRun):
+        # The join reads both tables, so the power_consumption write has to finish first
+        run.get("power_consumption")
+        with borrow_connection() as conn:
+            write_analysis_data(conn, write_mode, mode, chunk_size)
+
+    return [
+        Stage("aggregate_features", features_stage, outputs=["features", "feature_blob_names", "feature_blob"]),
+        Stage("aggregate_to_timeseries", timeseries_stage, inputs=["features", "feature_blob_names"], outputs=["timeseries", "electricity_timeseries"]),
+        Stage("aggregate_to_rollups", rollup_stage, inputs=["features", "feature_blob_names"], outputs=["rollups", "rollup_tables"]),
+        Stage("compact_features", compaction_stage, inputs=["feature_blob", "timeseries", "rollups"], outputs=["compacted_features"]),
+        Stage(
+            "aggregate_to_power_consumption",
+            power_consumption_stage,
+            inputs=["electricity_timeseries"] if engine == "sql" else ["timeseries", "electricity_timeseries"],
+            outputs=["power_consumption"]
+        ),
+        Stage("create_analysis_data", analysis_stage, inputs=["power_consumption"]),
+    ]
+
+def write_table(table: str, df, columns: List[str], write_mode: str) -> int:
+    """
+    Writes a dataframe through its own pooled connection; Runs as a durable write of the pipeline
+    """
+    with borrow_connection() as conn:
+        return write_dataframe(conn, table, df, columns, keys=["timestamp"], write_mode=write_mode)
+
+def write_rollup_tables(rollups: Dict[str, Any]) -> None:
+    """
+    Writes the recomputed buckets through their own pooled connection; Runs as a durable write of the pipeline
+    """
+    with borrow_connection() as conn:
+        write_rollups(conn, rollups)
+
+def write_sql_power_consumption(write_mode: str) -> None:
+    """
+    Computes and writes the power_consumption sums inside postgres; Runs as a durable write of the pipeline
+    """
+    with borrow_connection() as conn:
+        write_power_consumption(conn, write_mode, "sql")
+
+def resolve_modes(write_mode: Union[str, None], engine: Union[str, None], mode: Union[str, None]) -> Tuple[str, str, str]:
+    """
+    Resolves the write mode, the power consumption engine and the analysis data mode from their 
+    PSQL_WRITE_MODE, POWER_CONSUMPTION_ENGINE and ANALYSIS_DATA_MODE variables if they are not given
+    """
+    write_mode = get_write_mode(write_mode)
+    if engine is None:
+        engine = os.getenv("POWER_CONSUMPTION_ENGINE", "pandas")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}; Expected one of {ENGINES}")
+    if mode is None:
+        mode = os.getenv("ANALYSIS_DATA_MODE", "memory")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}; Expected one of {MODES}")
+
+    return write_mode, engine, mode
+
+def main(
+        delta_hours: Union[int, None],
+        write_mode: Union[str, None] = None,
+        engine: Union[str, None] = None,
+        mode: Union[str, None] = None,
+        download_workers: int = 8,
+        full_backfill: bool = False
+    ) -> None:
+    """
+    Runs aggregate_features, aggregate_to_timeseries, aggregate_to_rollups, aggregate_to_power_consumption
+    and create_analysis_data as one pipeline that hands the data over in memory
+
+    Arguments
+    ---------
+    delta_hours: int
+        The number of hours to look back in time to aggregate the features
+    write_mode: str
+        "insert" or "upsert"; Defaults to the PSQL_WRITE_MODE variable
+    engine: str
+        The power consumption engine; Defaults to the POWER_CONSUMPTION_ENGINE variable or "pandas"
+    mode: str
+        The analysis data mode; Defaults to the ANALYSIS_DATA_MODE variable or "memory"
+    download_workers: int
+        The number of threads downloading the blobs concurrently
+    full_backfill: bool
+        If True, the manifest of the processed blobs is ignored and every blob in the window is processed
+    """
+    # Loading the settings once per process
+    config = get_config()
+
+    # Resolving the write mode, the engine and the mode
+    write_mode, engine, mode = resolve_modes(write_mode, engine, mode)
+
+    # Connecting to the blob storage and psql
+    try:
+        container_client = get_container_client()
+        get_connection_pool()
+        logging.info("The connection was successfull")
+    except:
+        logging.warn("The connection was not successfull")
+        return
+
+    stages = build_stages(
+        container_client,
+        config["aggregated_feature_path"],
+        delta_hours,
+        write_mode,
+        engine,
+        mode,
+        download_workers=download_workers,
+        full_backfill=full_backfill,
+        manifest_path=os.getenv("AZURE_MANIFEST_PATH", DEFAULT_MANIFEST_PATH),
+    )
+    metrics.start_run()
+    try:
+        run_stages(stages, write_workers=int(os.getenv("PIPELINE_WRITE_WORKERS", DEFAULT_WRITE_WORKERS)))
+    finally:
+        # Logging and uploading the run report even if a stage failed
+        metrics.finish_run(container_client, config["metrics_report_path"])
+
+    logging.info("The pipeline was successfull")
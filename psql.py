@@ -0,0 +1,421 @@
+# Input/output stream
+import io
+
+# OS traversal 
+import os 
+
+# Date wrangling 
+import datetime
+
+# Typehinting 
+from typing import Union, Iterator
+
+# Dataframes
+import pandas as pd 
+
+# Importing logging 
+import logging
+
+# Safe SQL composition
+from psycopg2 import sql
+
+# Run metrics
+from metrics import timed
+
+# Defining the number of rows written per transaction 
+DEFAULT_BATCH_SIZE = 50000
+
+# Defining the write modes of the sinks 
+WRITE_MODES = ["insert", "upsert"]
+
+# Defining how many minutes before the watermark are reprocessed in upsert mode
+DEFAULT_UPSERT_LOOKBACK_MINUTES = 120
+
+def copy_dataframe(conn, table: str, df: pd.DataFrame, columns: list, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Streams the dataframe into the table with COPY FROM STDIN; Every batch is written 
+    and committed in its own transaction
+
+    The values are sent as csv and cast by postgres to the column types of the table; 
+    Missing values (NaN, None, NaT) are written as NULL
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    table: str
+        The name of the table
+    df: pd.DataFrame
+        The dataframe to write
+    columns: list
+        The columns of the dataframe to write, named as the columns of the table
+    batch_size: int
+        The number of rows written per transaction
+
+    Returns the number of rows written
+    """
+    # Composing the COPY statement with quoted identifiers
+    query = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+        table=sql.Identifier(table),
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+    )
+
+    # Writing the dataframe in batches
+    rows_written = 0
+    with conn.cursor() as cursor:
+        for start in range(0, df.shape[0], batch_size):
+            # Serializing the batch to csv in memory
+            buffer = io.StringIO()
+            df[columns].iloc[start:start + batch_size].to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+
+            # Copying the batch and committing it
+            try:
+                cursor.copy_expert(query, buffer)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            rows_written += min(batch_size, df.shape[0] - start)
+            logging.info(f"Copied {rows_written}/{df.shape[0]} rows into {table}")
+
+    # Returning the number of rows written
+    return rows_written
+
+def get_index_name(table: str, columns: list, unique: bool = False) -> str:
+    """
+    Creates the name of the index of the pipeline on the columns of the table
+    """
+    return f"{table}_{'_'.join(columns)}_{'key' if unique else 'idx'}"
+
+def find_index(cursor, table: str, columns: list, unique: bool = False) -> Union[str, None]:
+    """
+    Returns the name of a valid index of the table on exactly the columns, or None if there is none
+
+    A unique index matches the columns in any order, since any of them is a conflict target of 
+    INSERT ... ON CONFLICT; Any other index has to have the columns in the given order
+
+    Arguments
+    ---------
+    cursor: psycopg2 cursor
+        The cursor of the connection
+    table: str
+        The name of the table
+    columns: list
+        The indexed columns
+    unique: bool
+        Whether the index has to be unique
+    """
+    cursor.execute("""
+        SELECT index_class.relname
+        FROM pg_index AS index
+        JOIN pg_class AS index_class ON index_class.oid = index.indexrelid
+        JOIN pg_attribute AS attribute ON attribute.attrelid = index.indrelid AND attribute.attnum = ANY(index.indkey)
+        WHERE index.indrelid = to_regclass(%(table)s) AND index.indisvalid AND index.indpred IS NULL 
+        AND (index.indisunique OR NOT %(unique)s)
+        GROUP BY index_class.relname, index.indnatts, index.indkey
+        HAVING COUNT(*) = index.indnatts AND CASE 
+            WHEN %(unique)s THEN ARRAY_AGG(attribute.attname::text ORDER BY attribute.attname)
+            ELSE ARRAY_AGG(attribute.attname::text ORDER BY ARRAY_POSITION(index.indkey::int2[], attribute.attnum))
+        END = %(columns)s::text[]
+        LIMIT 1
+    """, {"table": table, "unique": unique, "columns": sorted(columns) if unique else list(columns)})
+    row = cursor.fetchone()
+
+    return row[0] if row is not None else None
+
+def count_duplicates(cursor, table: str, keys: list) -> int:
+    """
+    Counts the rows of the table that repeat the keys of another row; Rows with a NULL key never conflict
+    """
+    cursor.execute(sql.SQL("""
+        SELECT COALESCE(SUM(rows - 1), 0) FROM (
+            SELECT COUNT(*) AS rows FROM {table} WHERE {not_null} GROUP BY {keys} HAVING COUNT(*) > 1
+        ) AS duplicates
+    """).format(
+        table=sql.Identifier(table),
+        not_null=sql.SQL(" AND ").join(sql.SQL("{} IS NOT NULL").format(sql.Identifier(key)) for key in keys),
+        keys=sql.SQL(", ").join(sql.Identifier(key) for key in keys),
+    ))
+
+    return int(cursor.fetchone()[0])
+
+def remove_duplicates(conn, table: str, keys: list) -> int:
+    """
+    Deletes the rows that repeat the keys of a newer row (a higher id), so only the latest write 
+    of every key is kept; Returns the number of deleted rows
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("DELETE FROM {table} AS old USING {table} AS new WHERE {same_keys} AND old.id < new.id").format(
+            table=sql.Identifier(table),
+            same_keys=sql.SQL(" AND ").join(sql.SQL("old.{key} = new.{key}").format(key=sql.Identifier(key)) for key in keys),
+        ))
+        deleted = cursor.rowcount
+    conn.commit()
+    logging.info(f"Deleted {deleted} duplicate rows from {table}")
+
+    return deleted
+
+def create_index(conn, table: str, columns: list, unique: bool = False) -> None:
+    """
+    Builds an index on the columns of the table with CREATE INDEX CONCURRENTLY, so the writes to 
+    the table are not blocked while it builds; An invalid index left by a failed build is dropped 
+    and built again. Meant for the setup step in migrate.py, not for every write
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    table: str
+        The name of the table
+    columns: list
+        The indexed columns
+    unique: bool
+        Whether the index is unique; Fails if the table holds duplicate keys
+    """
+    index = get_index_name(table, columns, unique)
+
+    # A concurrent build cannot run inside a transaction
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (index,))
+            row = cursor.fetchone()
+            if row is not None and row[0]:
+                logging.warning(f"Dropping the invalid index {index}")
+                cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {index}").format(index=sql.Identifier(index)))
+
+            cursor.execute(sql.SQL("CREATE {unique} INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} ({columns})").format(
+                unique=sql.SQL("UNIQUE" if unique else ""),
+                index=sql.Identifier(index),
+                table=sql.Identifier(table),
+                columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+            ))
+    finally:
+        conn.autocommit = autocommit
+    logging.info(f"Created the index {index}")
+
+def require_unique_index(conn, table: str, keys: list) -> None:
+    """
+    Checks that the unique index INSERT ... ON CONFLICT needs exists; The index is built once by 
+    migrate.py, since building it takes a lock on the table and fails on duplicate keys
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    table: str
+        The name of the table
+    keys: list
+        The columns that identify a row
+    """
+    with conn.cursor() as cursor:
+        index = find_index(cursor, table, keys, unique=True)
+    if index is None:
+        raise RuntimeError(
+            f"{table} has no unique index on {keys}, which upserts need; Run `python -m migrate` "
+            f"(with --remove_duplicates if the table holds duplicate keys) before upserting"
+        )
+
+def upsert_dataframe(conn, table: str, df: pd.DataFrame, columns: list, keys: list, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Writes the dataframe into the table, updating the rows whose keys already exist
+
+    Every batch is copied into a temporary staging table and merged with 
+    INSERT ... SELECT ... ON CONFLICT DO UPDATE in one transaction; The created_datetime 
+    of an existing row is kept
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    table: str
+        The name of the table
+    df: pd.DataFrame
+        The dataframe to write
+    columns: list
+        The columns of the dataframe to write, named as the columns of the table
+    keys: list
+        The columns that identify a row; A unique index on them has to exist, see migrate.py
+    batch_size: int
+        The number of rows written per transaction
+
+    Returns the number of rows written
+    """
+    # Making sure the conflict target exists
+    require_unique_index(conn, table, keys)
+
+    # Defining the columns that are overwritten on a conflict
+    update_columns = [column for column in columns if column not in keys and column != "created_datetime"]
+
+    # Composing the statements
+    column_list = sql.SQL(", ").join(sql.Identifier(column) for column in columns)
+    key_list = sql.SQL(", ").join(sql.Identifier(key) for key in keys)
+    create_query = sql.SQL("CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA").format(
+        staging=sql.Identifier(f"{table}_staging"),
+        columns=column_list,
+        table=sql.Identifier(table),
+    )
+    copy_query = sql.SQL("COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+        staging=sql.Identifier(f"{table}_staging"),
+        columns=column_list,
+    )
+    merge_query = sql.SQL("""
+        INSERT INTO {table} ({columns}) 
+        SELECT DISTINCT ON ({keys}) {columns} FROM {staging} ORDER BY {keys}
+        ON CONFLICT ({keys}) DO {action}
+    """).format(
+        table=sql.Identifier(table),
+        columns=column_list,
+        keys=key_list,
+        staging=sql.Identifier(f"{table}_staging"),
+        action=sql.SQL("UPDATE SET {}").format(sql.SQL(", ").join(
+            sql.SQL("{column} = EXCLUDED.{column}").format(column=sql.Identifier(column)) for column in update_columns
+        )) if update_columns else sql.SQL("NOTHING"),
+    )
+
+    # Writing the dataframe in batches
+    rows_written = 0
+    with conn.cursor() as cursor:
+        for start in range(0, df.shape[0], batch_size):
+            # Serializing the batch to csv in memory
+            buffer = io.StringIO()
+            df[columns].iloc[start:start + batch_size].to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+
+            # Staging and merging the batch in one transaction
+            try:
+                cursor.execute(create_query)
+                cursor.copy_expert(copy_query, buffer)
+                cursor.execute(merge_query)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            rows_written += min(batch_size, df.shape[0] - start)
+            logging.info(f"Upserted {rows_written}/{df.shape[0]} rows into {table}")
+
+    # Returning the number of rows written
+    return rows_written
+
+def get_write_mode(write_mode: Union[str, None] = None) -> str:
+    """
+    Resolves the write mode of the PSQL sinks; Defaults to the PSQL_WRITE_MODE variable or "insert"
+
+    Arguments
+    ---------
+    write_mode: str
+        Either "insert" (append after the watermark) or "upsert" (reprocess an overlapping window)
+    """
+    if write_mode is None:
+        write_mode = os.getenv("PSQL_WRITE_MODE", "insert")
+
+    if write_mode not in WRITE_MODES:
+        raise ValueError(f"Unknown write mode {write_mode}; Expected one of {WRITE_MODES}")
+
+    return write_mode
+
+def get_watermark(cursor, table: str, write_mode: str) -> Union[datetime.datetime, None]:
+    """
+    Gets the max timestamp of the table; In upsert mode the watermark is moved back by 
+    PSQL_UPSERT_LOOKBACK_MINUTES so the last minutes are reprocessed
+
+    Arguments
+    ---------
+    cursor: psycopg2 cursor
+        The cursor of the connection
+    table: str
+        The name of the table
+    write_mode: str
+        The write mode of the sink
+    """
+    cursor.execute(sql.SQL("SELECT MAX(timestamp) FROM {table}").format(table=sql.Identifier(table)))
+    max_timestamp = cursor.fetchone()[0]
+
+    # Moving the watermark back to reprocess the overlapping window
+    if max_timestamp is not None:
+        max_timestamp = max_timestamp - get_lookback(write_mode)
+
+    return max_timestamp
+
+def get_lookback(write_mode: str) -> datetime.timedelta:
+    """
+    Gets how far before the watermark the rows are reprocessed; PSQL_UPSERT_LOOKBACK_MINUTES 
+    in upsert mode and nothing in insert mode
+
+    Arguments
+    ---------
+    write_mode: str
+        The write mode of the sink
+    """
+    if write_mode == "upsert":
+        return datetime.timedelta(minutes=int(os.getenv("PSQL_UPSERT_LOOKBACK_MINUTES", DEFAULT_UPSERT_LOOKBACK_MINUTES)))
+
+    return datetime.timedelta(0)
+
+def write_dataframe(conn, table: str, df: pd.DataFrame, columns: list, keys: list, write_mode: str, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Writes the dataframe with COPY in "insert" mode or with ON CONFLICT DO UPDATE in "upsert" mode
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    table: str
+        The name of the table
+    df: pd.DataFrame
+        The dataframe to write
+    columns: list
+        The columns of the dataframe to write
+    keys: list
+        The columns that identify a row, used in "upsert" mode
+    write_mode: str
+        Either "insert" or "upsert"
+    batch_size: int
+        The number of rows written per transaction
+    """
+    with timed(f"write_{table}") as counters:
+        if write_mode == "upsert":
+            rows = upsert_dataframe(conn, table, df, columns, keys, batch_size=batch_size)
+        else:
+            rows = copy_dataframe(conn, table, df, columns, batch_size=batch_size)
+        counters["rows"] = rows
+
+    return rows
+
+def stream_query(conn, name: str, query, params: Union[dict, None] = None, chunk_size: int = DEFAULT_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Runs the query with a named (server-side) cursor and yields the result in dataframes of 
+    at most chunk_size rows, so the whole result is never held in memory
+
+    The cursor lives in the transaction of the connection, so nothing may commit on the 
+    connection while the chunks are consumed
+
+    Arguments
+    ---------
+    conn: psycopg2 connection
+        The connection to the database
+    name: str
+        The name of the server-side cursor
+    query: str
+        The query to run
+    params: dict
+        The parameters of the query
+    chunk_size: int
+        The number of rows per chunk
+    """
+    with conn.cursor(name=name) as cursor:
+        # Fetching the rows in round trips of chunk_size
+        cursor.itersize = chunk_size
+        cursor.execute(query, params)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            yield pd.DataFrame(rows, columns=[column[0] for column in cursor.description])
@@ -0,0 +1,215 @@
+# OS traversal
+import os
+
+# Date wrangling
+import datetime
+
+# Dataframes
+import pandas as pd
+
+# Array math
+import numpy as np
+
+# Importing logging
+import logging
+
+# Typehinting
+from typing import List, Tuple, Union
+
+# Defining the policies that fill the missing minutes of the grid
+FILL_POLICIES = ["none", "zero", "ffill", "linear"]
+
+# Defining the default length of the longest gap that is filled
+DEFAULT_FILL_LIMIT_MINUTES = 5
+
+# Defining the number of gaps listed in the gap report
+MAX_REPORTED_GAPS = 10
+
+def get_fill_policy(policy: Union[str, None] = None) -> str:
+    """
+    Resolves the fill policy of the missing minutes; Defaults to the GAP_FILL_POLICY variable or "none"
+
+    Arguments
+    ---------
+    policy: str
+        "none" leaves the missing minutes empty, so every window they fall in is dropped; "zero" fills
+        them with 0, "ffill" with the last reading before the gap and "linear" interpolates between
+        the readings around the gap
+    """
+    if policy is None:
+        policy = os.getenv("GAP_FILL_POLICY", "none")
+
+    if policy not in FILL_POLICIES:
+        raise ValueError(f"Unknown fill policy {policy}; Expected one of {FILL_POLICIES}")
+
+    return policy
+
+def get_fill_limit(limit: Union[int, None] = None) -> int:
+    """
+    Resolves the length in minutes of the longest gap that is filled; Defaults to the
+    GAP_FILL_LIMIT_MINUTES variable or DEFAULT_FILL_LIMIT_MINUTES
+    """
+    if limit is None:
+        limit = int(os.getenv("GAP_FILL_LIMIT_MINUTES", DEFAULT_FILL_LIMIT_MINUTES))
+
+    return limit
+
+def find_gaps(observed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the runs of missing minutes of a grid
+
+    Returns the grid position of the first minute and the length of every gap
+
+    Arguments
+    ---------
+    observed: np.ndarray
+        Boolean mask of the grid minutes that have a row
+    """
+    # The mask flips from observed to missing at the start of a gap and back at its end
+    changes = np.diff(np.concatenate([[1], observed.astype(np.int8), [1]]))
+    starts = np.flatnonzero(changes == -1)
+    ends = np.flatnonzero(changes == 1)
+
+    return starts, ends - starts
+
+def fill_gaps(values: np.ndarray, starts: np.ndarray, lengths: np.ndarray, policy: str, limit: int) -> np.ndarray:
+    """
+    Fills the gaps of at most limit minutes of a grid column; The longer gaps and the gaps the
+    policy has no reading for (before the first reading) stay missing
+
+    Returns a boolean mask of the filled minutes; The values are filled in place
+
+    Arguments
+    ---------
+    values: np.ndarray
+        The grid column with NaN in the missing minutes
+    starts: np.ndarray
+        The grid positions of the first minutes of the gaps, created by find_gaps
+    lengths: np.ndarray
+        The lengths of the gaps, created by find_gaps
+    policy: str
+        One of FILL_POLICIES
+    limit: int
+        The length of the longest gap that is filled
+    """
+    filled = np.zeros(values.shape[0], dtype=bool)
+    if policy == "none":
+        return filled
+
+    # Selecting the gaps short enough to be filled and with the readings the policy needs
+    fillable = lengths <= limit
+    if policy in ("ffill", "linear"):
+        fillable &= starts > 0
+    if policy == "linear":
+        fillable &= starts + lengths < values.shape[0]
+    starts, lengths = starts[fillable], lengths[fillable]
+    if starts.shape[0] == 0:
+        return filled
+
+    # Expanding the gaps into their grid positions and the offsets within their gap
+    gap_ids = np.repeat(np.arange(starts.shape[0]), lengths)
+    offsets = np.arange(gap_ids.shape[0]) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    positions = starts[gap_ids] + offsets
+
+    if policy == "zero":
+        values[positions] = 0.0
+    elif policy == "ffill":
+        values[positions] = values[starts - 1][gap_ids]
+    else:
+        # Interpolating between the readings right before and right after the gap
+        before = values[starts - 1][gap_ids]
+        after = values[starts + lengths][gap_ids]
+        values[positions] = before + (after - before) * (offsets + 1) / (lengths[gap_ids] + 1)
+
+    filled[positions] = True
+    return filled
+
+def resample_minutes(
+        timeseries: pd.DataFrame,
+        columns: List[str],
+        start: Union[datetime.datetime, None] = None,
+        policy: Union[str, None] = None,
+        limit: Union[int, None] = None
+    ) -> Tuple[pd.DataFrame, dict]:
+    """
+    Places a minute timeseries on a dense minute grid, so every row is one minute and a window
+    of N rows is always N minutes long
+
+    The grid runs from start (or the first minute) to the last minute; The minutes without a row
+    are marked in the gap column and filled with the policy, and the gaps are summarized in the
+    gap report
+
+    Returns the dense timeseries with the timestamp, the columns, the gap column (the minute had no
+    row) and the filled column (the policy filled it), and the gap report
+
+    Arguments
+    ---------
+    timeseries: pd.DataFrame
+        Dataframe with the timestamp column and the columns
+    columns: List[str]
+        The columns placed on the grid
+    start: datetime.datetime
+        The first minute of the grid, so a gap before the first row is found as well
+    policy: str
+        One of FILL_POLICIES; Defaults to the GAP_FILL_POLICY variable or "none"
+    limit: int
+        The length of the longest gap that is filled; Defaults to the GAP_FILL_LIMIT_MINUTES variable
+    """
+    policy = get_fill_policy(policy)
+    limit = get_fill_limit(limit)
+
+    # Sorting by the timestamp and keeping one row per minute
+    timeseries = timeseries.sort_values("timestamp").drop_duplicates("timestamp", keep="last")
+    minutes_index = timeseries["timestamp"].values.astype("datetime64[m]").astype(np.int64)
+
+    # Spanning the grid from the first to the last minute
+    first = minutes_index[0] if minutes_index.shape[0] > 0 else 0
+    if start is not None and minutes_index.shape[0] > 0:
+        first = min(first, np.datetime64(start, "m").astype(np.int64))
+    size = minutes_index[-1] - first + 1 if minutes_index.shape[0] > 0 else 0
+
+    # Marking the grid minutes that have a row
+    positions = minutes_index - first
+    observed = np.zeros(size, dtype=bool)
+    observed[positions] = True
+    starts, lengths = find_gaps(observed)
+
+    # Placing every column on the grid and filling its gaps
+    dense = {"timestamp": (first + np.arange(size)).astype("datetime64[m]").astype("datetime64[ns]")}
+    filled = np.zeros(size, dtype=bool)
+    for column in columns:
+        values = np.full(size, np.nan)
+        values[positions] = timeseries[column].to_numpy(dtype=float)
+        filled |= fill_gaps(values, starts, lengths, policy, limit)
+        dense[column] = values
+    dense["gap"] = ~observed
+    dense["filled"] = filled
+
+    # Listing the longest gaps first
+    longest = np.argsort(-lengths, kind="stable")[:MAX_REPORTED_GAPS]
+    report = {
+        "policy": policy,
+        "minutes": int(size),
+        "missing_minutes": int(lengths.sum()),
+        "gaps": int(lengths.shape[0]),
+        "longest_gap_minutes": int(lengths.max()) if lengths.shape[0] > 0 else 0,
+        "filled_minutes": int(filled.sum()),
+        "longest_gaps": [
+            {"start": pd.Timestamp(dense["timestamp"][starts[gap]]).isoformat(), "minutes": int(lengths[gap])} for gap in longest
+        ],
+    }
+
+    return pd.DataFrame(dense), report
+
+def log_gap_report(report: dict) -> None:
+    """
+    Logs the gap report of a run; A warning if there are gaps that were not filled
+    """
+    message = (
+        f"Found {report['gaps']} gaps with {report['missing_minutes']} missing minutes out of {report['minutes']}, "
+        f"the longest {report['longest_gap_minutes']} minutes; Filled {report['filled_minutes']} minutes with the {report['policy']} policy"
+    )
+    if report["missing_minutes"] > report["filled_minutes"]:
+        logging.warning(f"{message}; Longest gaps: {report['longest_gaps']}")
+    else:
+        logging.info(message)
@@ -0,0 +1,164 @@
+# Dotenv loading 
+from dotenv import load_dotenv
+
+# OS traversal 
+import os 
+
+# Caching 
+from functools import lru_cache
+
+# Context managers 
+from contextlib import contextmanager
+
+# Thread safe initialization 
+import threading
+
+# Typehinting 
+from typing import Union, Iterator
+
+# Blob wrangling
+from azure.storage.blob import BlobServiceClient
+
+# PSQL connection 
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# Importing logging 
+import logging
+
+# Run metrics
+from metrics import timed
+
+# Defining the default number of idle PSQL connections kept open between the stages 
+DEFAULT_POOL_MIN_CONNECTIONS = 2
+
+# Defining the default maximum number of pooled PSQL connections 
+DEFAULT_POOL_MAX_CONNECTIONS = 4
+
+# Defining the default size cap of the local cache of the decoded capture blobs in megabytes
+DEFAULT_BLOB_CACHE_MAX_MB = 1024
+
+# Defining the default number of concurrent blob requests of the async pipeline
+DEFAULT_ASYNC_BLOB_CONCURRENCY = 32
+
+# Defining the default number of concurrent PSQL writes of the async pipeline
+DEFAULT_ASYNC_PSQL_CONCURRENCY = 4
+
+# The connection pool shared by the stages of a warm function host
+_pool = None
+_pool_lock = threading.Lock()
+
+# Limits the borrowed connections to the size of the pool, so concurrent borrowers wait instead of failing
+_pool_slots = None
+
+@lru_cache(maxsize=None)
+def get_config() -> dict:
+    """
+    Loads the .env file next to this file once and returns the settings of the pipeline
+    """
+    # Infering the current file directory 
+    current_file_directory = os.path.dirname(os.path.abspath(__file__))
+
+    # Loading the .env file from the parent directory
+    load_dotenv(os.path.join(current_file_directory, ".env"))
+
+    return {
+        "connection_string": os.getenv("AZURE_BLOB_CONNECTION_STRING"),
+        "container_name": os.getenv("AZURE_BLOB_CONTAINER_NAME"),
+        "aggregated_feature_path": os.getenv("AZURE_ML_DATASET_PATH"),
+        "psql": {
+            "user": os.getenv('PSQL_USER', 'default_user'),
+            "password": os.getenv('PSQL_PASSWORD', 'default_pass'),
+            "host": os.getenv('PSQL_HOST', 'localhost'),
+            "database": os.getenv('PSQL_DATABASE', 'default_db'),
+            "port": os.getenv('PSQL_PORT', '5432'),
+        },
+        "pool_min_connections": int(os.getenv("PSQL_POOL_MIN_CONNECTIONS", DEFAULT_POOL_MIN_CONNECTIONS)),
+        "pool_max_connections": int(os.getenv("PSQL_POOL_MAX_CONNECTIONS", DEFAULT_POOL_MAX_CONNECTIONS)),
+        "metrics_report_path": os.getenv("METRICS_REPORT_PATH"),
+        "blob_cache_path": os.getenv("BLOB_CACHE_PATH"),
+        "blob_cache_max_mb": int(os.getenv("BLOB_CACHE_MAX_MB", DEFAULT_BLOB_CACHE_MAX_MB)),
+        "async_blob_concurrency": int(os.getenv("ASYNC_BLOB_CONCURRENCY", DEFAULT_ASYNC_BLOB_CONCURRENCY)),
+        "async_psql_concurrency": int(os.getenv("ASYNC_PSQL_CONCURRENCY", DEFAULT_ASYNC_PSQL_CONCURRENCY)),
+    }
+
+@lru_cache(maxsize=None)
+def get_blob_service_client() -> BlobServiceClient:
+    """
+    Creates the blob service client once; The client and its http session are reused by every stage
+    """
+    return BlobServiceClient.from_connection_string(get_config()["connection_string"])
+
+@lru_cache(maxsize=None)
+def get_container_client(container_name: Union[str, None] = None):
+    """
+    Creates the container client once per container
+
+    Arguments
+    ---------
+    container_name: str
+        The name of the container; Defaults to AZURE_BLOB_CONTAINER_NAME
+    """
+    if container_name is None:
+        container_name = get_config()["container_name"]
+
+    return get_blob_service_client().get_container_client(container_name)
+
+def get_connection_pool() -> ThreadedConnectionPool:
+    """
+    Creates the PSQL connection pool on first use; The pool lives as long as the process, 
+    so a warm function host reuses its connections between invocations
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            config = get_config()
+            _pool = ThreadedConnectionPool(config["pool_min_connections"], config["pool_max_connections"], **config["psql"])
+            _pool_slots = threading.BoundedSemaphore(config["pool_max_connections"])
+            logging.info("Created the PSQL connection pool")
+
+    return _pool
+
+@contextmanager
+def borrow_connection() -> Iterator[psycopg2.extensions.connection]:
+    """
+    Borrows a connection from the pool and always returns it
+
+    Whatever is left uncommitted is rolled back before the connection goes back to the pool; 
+    Broken connections are closed instead of being reused; When all the connections are 
+    borrowed, for example by the concurrent writes of the pipeline, the call waits for one to come back
+    """
+    pool = get_connection_pool()
+    slots = _pool_slots
+    with timed("connection_wait"):
+        slots.acquire()
+        try:
+            conn = pool.getconn()
+        except:
+            slots.release()
+            raise
+    try:
+        yield conn
+    finally:
+        # Discarding the connections that broke during the stage
+        try:
+            if conn.closed:
+                pool.putconn(conn, close=True)
+            else:
+                try:
+                    conn.rollback()
+                    pool.putconn(conn)
+                except psycopg2.Error:
+                    pool.putconn(conn, close=True)
+        finally:
+            slots.release()
+
+def close_connection_pool() -> None:
+    """
+    Closes all the pooled connections
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
@@ -0,0 +1,157 @@
+# Dataframes
+import pandas as pd 
+
+# Array math 
+import numpy as np
+
+# Safe SQL composition
+from psycopg2 import sql
+
+# Defining the minutes ahead horizons of the power usage sums 
+HORIZONS = [5, 15, 60]
+
+def get_target_name(minutes: int) -> str:
+    """
+    Creates the column name of the minutes ahead power usage sum
+    """
+    return f"power_usage_{minutes}_minutes_ahead"
+
+def compute_forward_sums(timeseries: pd.DataFrame, horizons: list = HORIZONS) -> pd.DataFrame:
+    """
+    Creates the minutes ahead power usage sums of a minute timeseries
+
+    The sum for the minute t and the horizon h is the sum of the power usage of the 
+    minutes in (t, t + h]; The window is defined in time, so missing minutes are 
+    missing from the sum instead of pulling in later rows. On the dense grid of 
+    resample_minutes the missing minutes are NaN, so their windows are dropped unless 
+    the minutes were filled. Only the minutes whose 
+    windows of all the horizons are fully covered by the data (t + max(h) <= the last 
+    timestamp) are returned, the rest are computed by a later run once the data 
+    arrives. All the horizons are computed from one cumulative sum.
+
+    Arguments
+    ---------
+    timeseries: pd.DataFrame
+        Dataframe with the timestamp and power_usage columns
+    horizons: list
+        The minutes ahead horizons
+    """
+    # Sorting by the timestamp and keeping one row per minute
+    timeseries = timeseries.sort_values("timestamp").drop_duplicates("timestamp", keep="last").reset_index(drop=True)
+
+    # Returning the empty frame with the target columns if there is no data
+    if timeseries.shape[0] == 0:
+        return timeseries.assign(**{get_target_name(minutes): pd.Series(dtype=float) for minutes in horizons})
+
+    # Converting the timestamps to integer minutes
+    minutes_index = timeseries["timestamp"].values.astype("datetime64[m]").astype(np.int64)
+
+    # Cumulative sums of the power usage and of the missing values, with a leading zero
+    values = timeseries["power_usage"].to_numpy(dtype=float)
+    missing = np.isnan(values)
+    value_sums = np.concatenate([[0.0], np.cumsum(np.where(missing, 0.0, values))])
+    missing_sums = np.concatenate([[0], np.cumsum(missing)])
+
+    # The windows start right after the current minute
+    start = np.arange(1, minutes_index.shape[0] + 1)
+
+    for minutes in horizons:
+        # Finding the end of the window of every minute
+        end = np.searchsorted(minutes_index, minutes_index + minutes, side="right")
+
+        # Summing the window as the difference of the cumulative sums
+        sums = value_sums[end] - value_sums[start]
+
+        # A missing power usage in the window makes the sum missing
+        sums[missing_sums[end] - missing_sums[start] > 0] = np.nan
+
+        # Appending the feature to the dataframe
+        timeseries[get_target_name(minutes)] = sums
+
+    # Keeping only the minutes whose longest window is complete
+    complete = minutes_index + max(horizons) <= minutes_index[-1]
+    timeseries = timeseries[complete]
+
+    # Dropping the minutes with missing sums
+    return timeseries.dropna(subset=[get_target_name(minutes) for minutes in horizons]).reset_index(drop=True)
+
+def build_forward_sums_query(source_table: str = "electricity_timeseries", target_table: str = "power_consumption", horizons: list = HORIZONS, write_mode: str = "insert") -> sql.Composed:
+    """
+    Builds the INSERT ... SELECT statement that computes the minutes ahead power usage 
+    sums inside postgres with range window frames and writes them straight into the target table
+
+    The statement follows the same rules as compute_forward_sums on the dense minute grid with 
+    the "none" fill policy: the window of the minute t is (t, t + h], a NULL power usage or a 
+    missing minute in the window makes the sum NULL and only the minutes whose longest window 
+    is complete are written. The statement takes the watermark as the 
+    %(max_timestamp)s parameter; Pass None to use the whole source table.
+
+    Arguments
+    ---------
+    source_table: str
+        The minute timeseries table
+    target_table: str
+        The table the sums are written to
+    horizons: list
+        The minutes ahead horizons
+    write_mode: str
+        "insert" appends the rows, "upsert" updates the existing timestamps
+    """
+    # Creating one window per horizon that excludes the current minute
+    windows = sql.SQL(", ").join(
+        sql.SQL("{window} AS (ORDER BY timestamp RANGE BETWEEN CURRENT ROW AND INTERVAL {interval} FOLLOWING EXCLUDE GROUP)").format(
+            window=sql.Identifier(f"w{minutes}"),
+            interval=sql.Literal(f"{minutes} minutes"),
+        ) for minutes in horizons
+    )
+
+    # Summing each window; Missing values and missing minutes make the sum NULL
+    sums = sql.SQL(", ").join(
+        sql.SQL("CASE WHEN COUNT(*) OVER {window} < {minutes} OR COUNT(*) OVER {window} > COUNT(power_usage) OVER {window} THEN NULL ELSE SUM(power_usage) OVER {window} END AS {name}").format(
+            window=sql.Identifier(f"w{minutes}"),
+            minutes=sql.Literal(minutes),
+            name=sql.Identifier(get_target_name(minutes)),
+        ) for minutes in horizons
+    )
+
+    # Listing the target columns
+    targets = [get_target_name(minutes) for minutes in horizons]
+    target_list = sql.SQL(", ").join(sql.Identifier(target) for target in targets)
+
+    # Defining what happens to the existing timestamps
+    conflict = sql.SQL("")
+    if write_mode == "upsert":
+        conflict = sql.SQL("ON CONFLICT (timestamp) DO UPDATE SET {}, updated_datetime = EXCLUDED.updated_datetime").format(
+            sql.SQL(", ").join(sql.SQL("{target} = EXCLUDED.{target}").format(target=sql.Identifier(target)) for target in targets)
+        )
+
+    return sql.SQL("""
+        INSERT INTO {target_table} (timestamp, {target_list}, created_datetime, updated_datetime)
+        SELECT timestamp, {target_list}, timestamp, timestamp 
+        FROM (
+            SELECT 
+                timestamp, 
+                {sums}, 
+                MAX(timestamp) OVER () AS last_timestamp
+            FROM (
+                SELECT DISTINCT ON (timestamp) timestamp, power_usage 
+                FROM {source_table} 
+                WHERE %(max_timestamp)s::timestamp IS NULL OR timestamp > %(max_timestamp)s::timestamp
+                ORDER BY timestamp
+            ) AS timeseries
+            WINDOW {windows}
+        ) AS sums
+        WHERE timestamp + INTERVAL {max_horizon} <= last_timestamp 
+        AND {not_null}
+        ORDER BY timestamp
+        {conflict}
+    """).format(
+        target_table=sql.Identifier(target_table),
+        target_list=target_list,
+        sums=sums,
+        source_table=sql.Identifier(source_table),
+        windows=windows,
+        max_horizon=sql.Literal(f"{max(horizons)} minutes"),
+        not_null=sql.SQL(" AND ").join(sql.SQL("{} IS NOT NULL").format(sql.Identifier(target)) for target in targets),
+        conflict=conflict,
+    )
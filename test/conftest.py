@@ -0,0 +1,6 @@
+# OS traversal
+import os
+import sys
+
+# Importing the flat modules of the function app from the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,155 @@
+# Timing
+import time
+
+# Date wrangling
+import datetime
+
+# Test runner
+import pytest
+
+# Run metrics
+import metrics
+
+# Decoding the capture blobs
+from aggregate_features import CAPTURE_ROOT, aggregate_blob_stream, extract_batch_features, parse_bodies_arrow, aggregate_new_blobs, upload_features
+
+# Per minute partials
+from aggregation import MINUTE_KEYS, PARTIAL_COLUMNS, aggregate_partials, merge_partials, partials_to_statistics
+
+# Feature files and their readers
+from feature_store import split_feature_files
+from compact_features import compact_features
+from aggregate_to_timeseries import read_minute_partials
+
+# In-memory stand-ins of the container and the synthetic capture files
+from benchmarks.fakes import FakeContainerClient, FakeDownloader
+from benchmarks.capture import create_capture_blobs
+
+# Defining the blobs of the feature store tests
+FEATURE_PATH = "features"
+MANIFEST_PATH = "manifests/aggregate_features.json"
+
+class SlowDownloader(FakeDownloader):
+    """
+    Download whose chunks take a given time to arrive
+    """
+    def __init__(self, data: bytes, chunk_size: int, delay: float):
+        super().__init__(data, chunk_size)
+        self.delay = delay
+
+    def chunks(self):
+        for chunk in super().chunks():
+            time.sleep(self.delay)
+            yield chunk
+
+class SlowContainerClient(FakeContainerClient):
+    """
+    In-memory container whose downloads arrive in small slow chunks
+    """
+    def __init__(self, chunk_size: int, delay: float):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self.delay = delay
+
+    def download_blob(self, name: str, **kwargs):
+        return SlowDownloader(super().download_blob(name, **kwargs).readall(), self.chunk_size, self.delay)
+
+def test_streamed_download_is_reported_under_download():
+    container_client = SlowContainerClient(chunk_size=4096, delay=0.02)
+    create_capture_blobs(container_client, CAPTURE_ROOT, days=1 / 24, partitions=1, readings_per_minute=60)
+    blob_name = container_client.names[0]
+    size = len(FakeContainerClient.download_blob(container_client, blob_name).readall())
+    chunks = -(-size // container_client.chunk_size)
+
+    metrics.start_run()
+    with metrics.stage("aggregate_features"):
+        aggregate_blob_stream(container_client, blob_name)
+    steps = metrics.finish_run()["stages"]["aggregate_features"]["steps"]
+
+    # Every chunk is counted and timed as the download, and left out of the decode
+    assert steps["download"]["bytes"] == size
+    assert steps["download"]["blobs"] == 1
+    assert steps["download"]["seconds"] >= chunks * container_client.delay
+    assert steps["decode"]["bytes"] == size
+    assert steps["decode"]["seconds"] < chunks * container_client.delay
+
+@pytest.mark.parametrize("parse", ["records", "arrow"])
+def test_missing_variable_only_leaves_out_that_variable(parse: str):
+    bodies = [
+        b'{"timestamp": "2024-01-01 00:00:10", "power_usage": 1.0, "voltage": 230.0, "current": 2.0}',
+        b'{"timestamp": "2024-01-01 00:00:20", "power_usage": 3.0, "voltage": null, "current": 4.0}',
+        b'{"timestamp": "2024-01-01 00:00:30", "power_usage": 5.0}',
+        b'{"timestamp": "not a time", "power_usage": 7.0, "voltage": 240.0, "current": 8.0}',
+    ]
+    if parse == "records":
+        features, skipped = extract_batch_features([{"Body": body} for body in bodies])
+    else:
+        features = parse_bodies_arrow(bodies)
+        skipped = len(bodies) - features.shape[0]
+    statistics = partials_to_statistics(aggregate_partials(features)).iloc[0]
+
+    # Only the reading without a timestamp is skipped
+    assert skipped == 1
+    assert statistics["count"] == 3
+
+    # Every variable is averaged over the readings that hold it
+    assert statistics["power_usage_mean"] == pytest.approx(3.0)
+    assert statistics["voltage_mean"] == pytest.approx(230.0)
+    assert statistics["current_mean"] == pytest.approx(3.0)
+    assert statistics["current_min"] == 2.0 and statistics["current_max"] == 4.0
+
+def test_reprocessed_capture_blobs_are_counted_once():
+    container_client = FakeContainerClient()
+    create_capture_blobs(container_client, CAPTURE_ROOT, days=1, partitions=2, readings_per_minute=2, capture_minutes=60)
+    features, manifest = aggregate_new_blobs(container_client, None, manifest_path=MANIFEST_PATH)
+    expected = merge_partials([features])
+
+    # Uploading only the first day, as if the run failed before the manifest was saved
+    first_name, first_features = next(iter(split_feature_files(FEATURE_PATH, features).items()))
+    upload_features(container_client, {first_name: first_features}, MANIFEST_PATH, {})
+
+    # The next run aggregates every blob again
+    features, manifest = aggregate_new_blobs(container_client, None, manifest_path=MANIFEST_PATH)
+    upload_features(container_client, split_feature_files(FEATURE_PATH, features), MANIFEST_PATH, manifest)
+
+    # The readers only count the latest run of every blob, also once the days are compacted
+    for compact in [False, True]:
+        if compact:
+            assert compact_features(container_client, FEATURE_PATH) > 0
+        partials = read_minute_partials(container_client, FEATURE_PATH, None)
+        assert partials[MINUTE_KEYS].equals(expected[MINUTE_KEYS])
+        assert partials["count"].tolist() == expected["count"].tolist()
+        for column in PARTIAL_COLUMNS:
+            assert partials[column].to_numpy() == pytest.approx(expected[column].to_numpy())
+
+def test_changed_and_backfilled_blobs_replace_their_earlier_rows():
+    end = datetime.datetime(2024, 1, 2)
+    container_client = FakeContainerClient()
+    create_capture_blobs(container_client, CAPTURE_ROOT, days=1, partitions=2, readings_per_minute=2, capture_minutes=60, end=end)
+
+    def run(full_backfill: bool = False) -> None:
+        features, manifest = aggregate_new_blobs(container_client, None, full_backfill=full_backfill, manifest_path=MANIFEST_PATH)
+        upload_features(container_client, split_feature_files(FEATURE_PATH, features) if features is not None else {}, MANIFEST_PATH, manifest)
+    run()
+
+    # Rewriting one capture blob with other readings, which changes its etag
+    changed_client = FakeContainerClient()
+    create_capture_blobs(changed_client, CAPTURE_ROOT, days=1, partitions=2, readings_per_minute=3, capture_minutes=60, end=end, seed=1)
+    capture_names = [blob_name for blob_name in container_client.names if blob_name.startswith(CAPTURE_ROOT)]
+    changed_name = capture_names[0]
+    container_client.upload_blob(changed_name, changed_client.download_blob(changed_name).readall(), overwrite=True)
+
+    # The partials of a single run over the current blobs
+    current_client = FakeContainerClient()
+    for blob_name in capture_names:
+        current_client.upload_blob(blob_name, container_client.download_blob(blob_name).readall())
+    expected = merge_partials([aggregate_new_blobs(current_client, None, manifest_path=MANIFEST_PATH)[0]])
+
+    # Neither the changed blob nor a full backfill add to the earlier runs
+    for full_backfill in [False, True]:
+        run(full_backfill)
+        partials = read_minute_partials(container_client, FEATURE_PATH, None)
+        assert partials[MINUTE_KEYS].equals(expected[MINUTE_KEYS])
+        assert partials["count"].tolist() == expected["count"].tolist()
+        for column in PARTIAL_COLUMNS:
+            assert partials[column].to_numpy() == pytest.approx(expected[column].to_numpy())
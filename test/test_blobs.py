@@ -0,0 +1,146 @@
+# Date wrangling
+import datetime
+
+# Timing
+import time
+
+# Thread safe counters
+import threading
+
+# Test runner
+import pytest
+
+# Importing blob functionalities
+from blobs import map_blobs, download_blobs, list_feature_blobs, BlobStream
+
+# In-memory stand-in of the container
+from benchmarks.fakes import FakeContainerClient, FakeDownloader
+
+class SlowContainerClient(FakeContainerClient):
+    """
+    In-memory container whose downloads take a given time per blob, fail a given number of times
+    before the client retries them, and count the downloads running at the same time
+    """
+    def __init__(self, delays: dict = None, failures: dict = None):
+        super().__init__()
+        self.delays = delays or {}
+        self.failures = dict(failures or {})
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.started = []
+
+    def download_blob(self, name: str, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.started.append(name)
+        try:
+            # Retrying the failed attempts like the retry policy of the storage client
+            while True:
+                time.sleep(self.delays.get(name, 0.0))
+                with self.lock:
+                    failed = self.failures.get(name, 0) > 0
+                    if failed:
+                        self.failures[name] -= 1
+                if not failed:
+                    return super().download_blob(name, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+class ListedContainerClient(FakeContainerClient):
+    """
+    In-memory container that records the prefixes whose blobs are listed
+    """
+    def __init__(self):
+        super().__init__()
+        self.listed = []
+
+    def list_blobs(self, name_starts_with: str = None, **kwargs):
+        self.listed.append(name_starts_with)
+        return super().list_blobs(name_starts_with, **kwargs)
+
+def create_container(count: int, **kwargs) -> SlowContainerClient:
+    """
+    Creates a container with count blobs whose content is their name
+    """
+    container_client = SlowContainerClient(**kwargs)
+    for index in range(count):
+        name = f"blob-{index:03d}"
+        container_client.upload_blob(name, name.encode("utf-8"))
+    return container_client
+
+def test_download_blobs_in_input_order():
+    container_client = create_container(20)
+    names = sorted(container_client.names, reverse=True)
+
+    results = list(download_blobs(container_client, names, max_workers=4))
+
+    assert [name for name, _ in results] == names
+    assert [data for _, data in results] == [name.encode("utf-8") for name in names]
+
+def test_slow_and_retried_blobs_keep_the_order():
+    names = [f"blob-{index:03d}" for index in range(12)]
+    container_client = create_container(
+        12,
+        delays={names[0]: 0.2, names[5]: 0.1},
+        failures={names[1]: 2, names[7]: 1},
+    )
+
+    results = list(download_blobs(container_client, names, max_workers=4))
+
+    assert [name for name, _ in results] == names
+    assert [data for _, data in results] == [name.encode("utf-8") for name in names]
+    assert container_client.failures == {names[1]: 0, names[7]: 0}
+
+def test_in_flight_limit():
+    names = [f"blob-{index:03d}" for index in range(30)]
+    container_client = create_container(30, delays={name: 0.01 for name in names})
+    max_workers, max_in_flight = 3, 5
+
+    for position, (name, _) in enumerate(download_blobs(container_client, names, max_workers=max_workers, max_in_flight=max_in_flight)):
+        # Consuming slowly, so the workers could run ahead if nothing held them back
+        time.sleep(0.02)
+        assert len(container_client.started) <= position + max_in_flight
+
+    assert container_client.max_running <= max_workers
+
+def test_map_blobs_raises_the_failure_of_a_blob():
+    def process(blob_name: str) -> str:
+        if blob_name == "b":
+            raise ValueError("broken blob")
+        return blob_name.upper()
+
+    results = map_blobs(["a", "b", "c"], process, max_workers=2)
+
+    assert next(results) == ("a", "A")
+    with pytest.raises(ValueError, match="broken blob"):
+        next(results)
+
+def test_list_feature_blobs_walks_the_days_of_the_minutes_after_the_timestamp():
+    container_client = ListedContainerClient()
+    for day in [1, 2, 3]:
+        container_client.upload_blob(f"features/year=2024/month=01/day=0{day}/features.parquet", b"")
+
+    # The minute before midnight is the exclusive bound of a read that starts at the day
+    blob_names = list_feature_blobs(container_client, "features", datetime.datetime(2024, 1, 1, 23, 59))
+
+    assert blob_names == [f"features/year=2024/month=01/day=0{day}/features.parquet" for day in [2, 3]]
+    assert container_client.listed == [f"features/year=2024/month=01/day=0{day}/" for day in [2, 3]]
+
+    # A timestamp inside a day still walks that day
+    container_client.listed = []
+    blob_names = list_feature_blobs(container_client, "features", datetime.datetime(2024, 1, 1, 23, 58, 30))
+    assert len(blob_names) == 3
+
+def test_blob_stream_reads_across_the_chunks():
+    data = bytes(range(256)) * 40
+    stream = BlobStream(FakeDownloader(data, chunk_size=1000))
+
+    # Every read returns the requested bytes, even where it spans several chunks
+    assert stream.read(10) == data[:10]
+    assert stream.read(2500) == data[10:2510]
+    assert stream.read() == data[2510:]
+    assert stream.read(10) == b""
+    assert stream.tell() == len(data)
@@ -0,0 +1,41 @@
+# Async runs
+import asyncio
+
+# Test runner
+import pytest
+
+# The pipeline runners
+from pipeline import Stage, run_stages
+from async_pipeline import run_stages_async
+
+def fail_write():
+    raise RuntimeError("broken write")
+
+def test_run_stages_raises_the_failure_of_the_stage():
+    def write_stage(run):
+        run.submit_write("table", fail_write)
+
+    def failing_stage(run):
+        raise ValueError("broken stage")
+
+    stages = [Stage("write", write_stage, outputs=["table"]), Stage("fail", failing_stage, inputs=["table"])]
+    with pytest.raises(ValueError, match="broken stage"):
+        run_stages(stages)
+
+def test_run_stages_raises_the_failure_of_a_write():
+    def write_stage(run):
+        run.submit_write("table", fail_write)
+
+    with pytest.raises(RuntimeError, match="broken write"):
+        run_stages([Stage("write", write_stage, outputs=["table"])])
+
+def test_run_stages_async_raises_the_failure_of_the_stage():
+    async def write_stage(run):
+        run.submit_write("table", asyncio.to_thread(fail_write))
+
+    async def failing_stage(run):
+        raise ValueError("broken stage")
+
+    stages = [Stage("write", write_stage, outputs=["table"]), Stage("fail", failing_stage, inputs=["table"])]
+    with pytest.raises(ValueError, match="broken stage"):
+        asyncio.run(run_stages_async(stages))
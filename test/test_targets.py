@@ -0,0 +1,106 @@
+# Dataframes
+import pandas as pd
+
+# Array math
+import numpy as np
+
+# Test runner
+import pytest
+
+# Minutes ahead targets
+from targets import HORIZONS, get_target_name, compute_forward_sums, build_forward_sums_query
+
+# Dense minute grid
+from resampling import resample_minutes
+
+# Defining the test tables
+SOURCE_TABLE = "test_electricity_timeseries"
+TARGET_TABLE = "test_power_consumption"
+
+@pytest.fixture
+def timeseries() -> pd.DataFrame:
+    """
+    A day of gap-free minutes with a random power usage
+    """
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "timestamp": pd.date_range("2020-01-01", periods=1440, freq="min"),
+        "power_usage": rng.random(1440) * 10,
+    })
+
+@pytest.fixture
+def timeseries_with_gaps(timeseries: pd.DataFrame) -> pd.DataFrame:
+    """
+    The same minutes with two missing stretches and two missing power usages
+    """
+    timeseries = timeseries.drop(index=list(range(100, 103)) + list(range(700, 760))).reset_index(drop=True)
+    timeseries.loc[[300, 1000], "power_usage"] = np.nan
+    return timeseries
+
+@pytest.fixture
+def conn():
+    """
+    A connection to the database of the PSQL_* variables; The test is skipped if there is none
+    """
+    psycopg2 = pytest.importorskip("psycopg2")
+    from resources import get_config
+    try:
+        conn = psycopg2.connect(**get_config()["psql"], connect_timeout=3)
+    except psycopg2.OperationalError:
+        pytest.skip("No database is available")
+    yield conn
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SOURCE_TABLE}, {TARGET_TABLE}")
+    conn.commit()
+    conn.close()
+
+def test_forward_sums_match_the_rolling_baseline(timeseries: pd.DataFrame):
+    sums = compute_forward_sums(timeseries, HORIZONS)
+
+    # The previous row based sums of the minutes (t, t + h]
+    baseline = timeseries.set_index("timestamp")["power_usage"]
+    for minutes in HORIZONS:
+        expected = baseline.rolling(minutes).sum().shift(-minutes).reindex(sums["timestamp"]).to_numpy()
+        np.testing.assert_allclose(sums[get_target_name(minutes)].to_numpy(), expected, rtol=0, atol=1e-9)
+
+    # Every minute whose longest window is complete is returned
+    assert sums.shape[0] == timeseries.shape[0] - max(HORIZONS)
+
+def test_forward_sums_leave_out_the_windows_with_gaps(timeseries_with_gaps: pd.DataFrame):
+    sums = compute_forward_sums(resample_minutes(timeseries_with_gaps, ["power_usage"], policy="none")[0], HORIZONS)
+
+    # Summing every window over the minutes themselves
+    values = timeseries_with_gaps.set_index("timestamp")["power_usage"]
+    for row in sums.itertuples(index=False):
+        for minutes in HORIZONS:
+            window = values[(values.index > row.timestamp) & (values.index <= row.timestamp + pd.Timedelta(minutes=minutes))]
+            assert window.shape[0] == minutes and not window.isna().any()
+            assert getattr(row, get_target_name(minutes)) == pytest.approx(window.sum(), abs=1e-9)
+
+def test_sql_forward_sums_match_pandas(conn, timeseries_with_gaps: pd.DataFrame):
+    targets = [get_target_name(minutes) for minutes in HORIZONS]
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SOURCE_TABLE}, {TARGET_TABLE}")
+        cursor.execute(f"CREATE TABLE {SOURCE_TABLE} (id SERIAL PRIMARY KEY, timestamp TIMESTAMP, power_usage DOUBLE PRECISION)")
+        cursor.execute(f"""
+            CREATE TABLE {TARGET_TABLE} (
+                id SERIAL PRIMARY KEY, timestamp TIMESTAMP, {', '.join(f'{target} DOUBLE PRECISION' for target in targets)},
+                created_datetime TIMESTAMP, updated_datetime TIMESTAMP
+            )
+        """)
+        cursor.executemany(
+            f"INSERT INTO {SOURCE_TABLE} (timestamp, power_usage) VALUES (%s, %s)",
+            [(row.timestamp.to_pydatetime(), None if np.isnan(row.power_usage) else row.power_usage) for row in timeseries_with_gaps.itertuples(index=False)],
+        )
+        cursor.execute(build_forward_sums_query(SOURCE_TABLE, TARGET_TABLE, HORIZONS), {"max_timestamp": None})
+        cursor.execute(f"SELECT timestamp, {', '.join(targets)} FROM {TARGET_TABLE} ORDER BY timestamp")
+        written = pd.DataFrame(cursor.fetchall(), columns=["timestamp"] + targets)
+    conn.commit()
+
+    # The sql engine only writes the minutes that are in the source table
+    sums = compute_forward_sums(resample_minutes(timeseries_with_gaps, ["power_usage"], policy="none")[0], HORIZONS)
+    sums = sums[~sums["gap"]]
+
+    assert written["timestamp"].tolist() == sums["timestamp"].tolist()
+    for target in targets:
+        np.testing.assert_allclose(written[target].to_numpy(dtype=float), sums[target].to_numpy(), rtol=0, atol=1e-9)